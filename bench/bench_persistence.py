@@ -0,0 +1,73 @@
+#Стоимость сохранения данных на один запрос: запись после каждого изменения против отложенной записи
+#Запуск: python bench/bench_persistence.py [--users 10000] [--history 10] [--requests 200] [--backend json]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def request_cycle(user_id: int, flush_each_save: bool):
+    """Изменения данных одного запроса на загрузку; flush_each_save - запись после каждого save_* (как раньше)"""
+    steps = [
+        lambda: main.increment_request_count(user_id),
+        lambda: main.update_user_stats(user_id, f"user{user_id}", 'video'),
+        lambda: main.validate_download_token(main.generate_download_token(user_id), user_id),
+        lambda: main.add_to_history(user_id, 'https://www.youtube.com/watch?v=aaaaaaaaaaa', 'Видео', 'video', '720'),
+    ]
+    for step in steps:
+        step()
+        if flush_each_save:
+            main.flush_data()
+
+
+def populate(users: int, history: int):
+    """Заполнение данных пользователями и историей их загрузок"""
+    for user_id in range(users):
+        main.update_user_stats(user_id, f"user{user_id}", 'video')
+        main.increment_request_count(user_id)
+        for _ in range(history):
+            main.add_to_history(user_id, 'https://www.youtube.com/watch?v=aaaaaaaaaaa', 'Видео', 'video', '720')
+    main.flush_data()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Стоимость сохранения данных на один запрос")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--history', type=int, default=10, help="записей истории на пользователя")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        main.storage = main.JsonStorage() if args.backend == 'json' else main.SqliteStorage(main.SQLITE_DB_FILE)
+        populate(args.users, args.history)
+        print(f"Хранилище {args.backend}: {args.users} пользователей, {args.users * args.history} записей истории")
+
+        started = time.perf_counter()
+        for request in range(args.requests):
+            request_cycle(request % args.users, flush_each_save=True)
+        before = (time.perf_counter() - started) / args.requests
+        print(f"Запись после каждого изменения: {before * 1000:.2f} мс на запрос")
+
+        started = time.perf_counter()
+        for request in range(args.requests):
+            request_cycle(request % args.users, flush_each_save=False)
+        after = (time.perf_counter() - started) / args.requests
+        started = time.perf_counter()
+        main.flush_data()
+        flush = time.perf_counter() - started
+        print(f"Отложенная запись: {after * 1000:.3f} мс на запрос и одна запись {flush * 1000:.0f} мс "
+              f"за PERSIST_INTERVAL ({main.PERSIST_INTERVAL} с)")
+        main.storage.close()
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    main_bench()
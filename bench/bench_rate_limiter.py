@@ -0,0 +1,73 @@
+#Память и скорость ограничения частоты сообщений на большом числе пользователей
+#Запуск: python bench/bench_rate_limiter.py [--users 1000000]
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def legacy_check(user_rate_limits: dict, user_id: int, limit: int) -> bool:
+    """Прежняя проверка: список времен сообщений пользователя за минуту, записи не удаляются"""
+    now = time.time()
+    if user_id not in user_rate_limits:
+        user_rate_limits[user_id] = []
+    user_rate_limits[user_id] = [t for t in user_rate_limits[user_id] if now - t < 60]
+    if len(user_rate_limits[user_id]) >= limit:
+        return False
+    user_rate_limits[user_id].append(now)
+    return True
+
+
+def measure_memory(fill) -> float:
+    """Память в MiB, занятая структурой после fill()"""
+    tracemalloc.start()
+    keep = fill()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return used / 2 ** 20
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Память и скорость ограничения частоты сообщений")
+    parser.add_argument('--users', type=int, default=1000000)
+    args = parser.parse_args()
+    limit = main.RATE_LIMITS['free']
+
+    def fill_legacy():
+        user_rate_limits = {}
+        for user_id in range(args.users):
+            legacy_check(user_rate_limits, user_id, limit)
+        return user_rate_limits
+
+    def fill_limiter():
+        limiter = main.RateLimiter(main.RATE_LIMITS, main.RATE_LIMIT_SWEEP_INTERVAL)
+        for user_id in range(args.users):
+            limiter.allow(user_id, 'free')
+        return limiter
+
+    print(f"{args.users} пользователей по одному сообщению:")
+    print(f"  списки времен сообщений: {measure_memory(fill_legacy):.0f} MiB")
+    print(f"  RateLimiter: {measure_memory(fill_limiter):.0f} MiB")
+
+    limiter = fill_limiter()
+    started = time.perf_counter()
+    for user_id in range(args.users):
+        limiter.allow(user_id, 'free')
+    print(f"  allow(): {(time.perf_counter() - started) / args.users * 1e6:.2f} мкс на сообщение")
+
+    # Ведра всех пользователей пополнились - очистка удаляет их целиком
+    started = time.perf_counter()
+    limiter.sweep(time.monotonic() + 60)
+    print(f"  очистка {args.users} неактивных пользователей: {(time.perf_counter() - started) * 1000:.0f} мс, "
+          f"осталось {len(limiter.full_at)}")
+
+
+if __name__ == '__main__':
+    main_bench()
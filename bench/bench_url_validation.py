@@ -0,0 +1,126 @@
+#Микробенчмарк проверки ссылок: validate_url против прежней цепочки проверок с повторным разбором URL
+#Запуск: python bench/bench_url_validation.py [--urls 100000]
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from urllib.parse import urlparse
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+REAL_URLS = [
+    'https://www.youtube.com/watch?v={id}',
+    'https://www.youtube.com/watch?v={id}&list=PL{word}&index=3&t=42s&ab_channel={word}',
+    'https://m.youtube.com/watch?v={id}&feature=share',
+    'https://youtu.be/{id}?si={word}',
+    'https://www.youtube.com/shorts/{id}',
+    'https://www.tiktok.com/@{word}/video/7{digits}',
+    'https://vm.tiktok.com/{word}/',
+    'https://rutube.ru/video/{hex}/',
+    'https://rutube.ru/video/private/{hex}/?p={word}',
+]
+FOREIGN_URLS = [
+    'https://vimeo.com/{digits}',
+    'https://example.org/{word}/{word}.html',
+    'ftp://youtube.com/{word}',
+    'not a link {word}',
+]
+HOSTILE_URLS = [
+    'https://notyoutube.com.evil/watch?v={id}',
+    'https://youtube.com.{word}.net/watch?v={id}',
+    'https://ssyoutube.com/watch?v={id}',
+    'https://youtube.com@evil.net/watch?v={id}',
+    'https://www.youtube.com.malicious.com/watch?v={id}',
+    'https://cdn.spam.org/youtube.com/{word}',
+    'https://www.youtube.com/watch?v={id}&next=javascript:alert(1)',
+    'https://www.youtube.com/watch?v={id}&q=%3Cscript%3E{word}',
+    'https://www.youtube.com/{long}',
+]
+
+
+def legacy_is_valid(url: str) -> bool:
+    """Прежняя проверка (is_valid_url, is_supported_platform, is_blacklisted_domain, is_suspicious_url)"""
+    if len(url) > main.MAX_URL_LENGTH:
+        return False
+    try:
+        result = urlparse(url)
+        if not all([result.scheme in ['http', 'https'], result.netloc]):
+            return False
+    except Exception:
+        return False
+    supported_domains = ['youtube.com', 'www.youtube.com', 'm.youtube.com', 'youtu.be', 'tiktok.com', 'www.tiktok.com',
+                         'vm.tiktok.com', 'vt.tiktok.com', 'rutube.ru', 'www.rutube.ru', 'y2mate.com', 'ssyoutube.com']
+    domain = urlparse(url).netloc.lower().replace('www.', '')
+    if not any(supported in domain for supported in supported_domains):
+        return False
+    domain = urlparse(url).netloc.lower()
+    if any(blacklisted in domain for blacklisted in main.BLACKLISTED_DOMAINS):
+        return False
+    suspicious_patterns = ['javascript:', 'data:', 'vbscript:', '<script>', '</script>', 'onload=', 'onerror=',
+                           'onclick=', '%3Cscript%3E', '%3C/script%3E']
+    url_lower = url.lower()
+    if any(pattern in url_lower for pattern in suspicious_patterns):
+        return False
+    domain = urlparse(url).netloc.lower()
+    return any(platform in domain for platform in ['youtube.com', 'youtu.be', 'tiktok.com', 'rutube.ru'])
+
+
+def make_corpus(count: int, seed: int = 1) -> list:
+    """Набор ссылок: половина настоящих, четверть чужих и четверть враждебных"""
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + '-_'
+
+    def fill(template: str) -> str:
+        return template.format(
+            id=''.join(rng.choices(alphabet, k=11)),
+            word=''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))),
+            digits=''.join(rng.choices(string.digits, k=18)),
+            hex=''.join(rng.choices('0123456789abcdef', k=32)),
+            long='a' * 600,
+        )
+
+    corpus = []
+    for index in range(count):
+        kind = index % 4
+        templates = REAL_URLS if kind < 2 else FOREIGN_URLS if kind == 2 else HOSTILE_URLS
+        corpus.append(fill(rng.choice(templates)))
+    return corpus
+
+
+def measure(check, corpus: list, repeat: int) -> float:
+    """Лучшее из repeat время проверки одной ссылки в микросекундах"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for url in corpus:
+            check(url)
+        best = min(best, time.perf_counter() - started)
+    return best / len(corpus) * 1e6
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Микробенчмарк проверки ссылок")
+    parser.add_argument('--urls', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.urls)
+    legacy = measure(legacy_is_valid, corpus, args.repeat)
+    current = measure(main.validate_url, corpus, args.repeat)
+    print(f"{len(corpus)} ссылок: прежняя проверка {legacy:.1f} мкс/ссылка, validate_url {current:.1f} мкс/ссылка")
+
+    typical = [url for url in corpus if url.startswith('https://www.youtube.com/watch?v=') and '&list=' in url]
+    print(f"Длинная ссылка YouTube: {measure(legacy_is_valid, typical, args.repeat):.1f} против "
+          f"{measure(main.validate_url, typical, args.repeat):.1f} мкс/ссылка")
+
+    accepted_before = sum(1 for url in corpus if legacy_is_valid(url) and not main.validate_url(url).valid)
+    print(f"Ссылок, которые прежняя проверка пропускала, а validate_url отклоняет: {accepted_before}")
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -1,2238 +1,5180 @@
-#Создано на Python 3
-#Telegram бот для скачивания видео и аудио с YouTube, TikTok, RUTube
-import os
-import logging
-import tempfile
-import multiprocessing
-import asyncio
-import datetime
-import json
-import time
-import re
-import string
-import hashlib
-import secrets
-from urllib.parse import urlparse
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.request import HTTPXRequest
-import yt_dlp
-from config import BOT_TOKEN, ADMIN_IDS, ADMIN_USERNAME, BLACKLISTED_DOMAINS, ALLOWED_EXTENSIONS
-
-# Настройка логирования для отслеживания работы бота
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
-
-# Глобальные переменные для хранения состояния бота
-active_processes = {}  # Активные процессы загрузки
-error_log = []  # Лог ошибок для диагностики
-bot_enabled = True  # Флаг включен/выключен бот
-blocked_users = set()  # Множество заблокированных пользователей
-user_stats = {}  # Статистика пользователей
-premium_users = {}  # Премиум пользователи и сроки подписки
-user_history = {}  # История загрузок пользователей
-user_requests = {}  # Количество запросов пользователей по дням
-download_tokens = {}  # Токены для безопасной загрузки
-
-# Файлы для хранения данных
-BLOCKED_USERS_FILE = "blocked_users.json"
-USER_STATS_FILE = "user_stats.json"
-BOT_STATE_FILE = "bot_state.json"
-PREMIUM_USERS_FILE = "premium_users.json"
-USER_HISTORY_FILE = "user_history.json"
-USER_REQUESTS_FILE = "user_requests.json"
-TOKENS_FILE = "download_tokens.json"
-
-# Лимиты запросов для разных типов пользователей
-REQUEST_LIMITS = {
-    'free': 5,      # Бесплатные пользователи - 5 запросов в день
-    'premium': 20,  # Премиум пользователи - 20 запросов в день  
-    'admin': 999999 # Администраторы - без ограничений
-}
-
-# Константы бота
-SUBSCRIPTION_PRICE = 200  # Цена премиум подписки
-MAX_FILE_SIZE = 50  # Максимальный размер файла в MB
-MAX_FILENAME_LENGTH = 100  # Максимальная длина имени файла
-MAX_URL_LENGTH = 500  # Максимальная длина URL
-MAX_CONCURRENT_DOWNLOADS = 3  # Максимум одновременных загрузок
-RATE_LIMIT_PER_USER = 10  # Лимит запросов в минуту на пользователя
-
-# Счетчики для ограничений
-user_rate_limits = {}  # Трекинг запросов пользователей
-concurrent_downloads = 0  # Текущее количество активных загрузок
-
-def load_data():
-    """Загрузка всех данных бота из JSON файлов при запуске"""
-    global blocked_users, user_stats, bot_enabled, premium_users, user_history, user_requests, download_tokens
-    
-    try:
-        # Загрузка списка заблокированных пользователей
-        if os.path.exists(BLOCKED_USERS_FILE):
-            with open(BLOCKED_USERS_FILE, 'r') as f:
-                blocked_users = set(json.load(f))
-    except Exception as e:
-        logger.error(f"Ошибка загрузки blocked_users: {e}")
-    
-    try:
-        # Загрузка статистики пользователей
-        if os.path.exists(USER_STATS_FILE):
-            with open(USER_STATS_FILE, 'r') as f:
-                user_stats = json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки user_stats: {e}")
-    
-    try:
-        # Загрузка состояния бота (включен/выключен)
-        if os.path.exists(BOT_STATE_FILE):
-            with open(BOT_STATE_FILE, 'r') as f:
-                state_data = json.load(f)
-                bot_enabled = state_data.get('enabled', True)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки bot_state: {e}")
-    
-    try:
-        # Загрузка премиум пользователей с проверкой срока действия
-        if os.path.exists(PREMIUM_USERS_FILE):
-            with open(PREMIUM_USERS_FILE, 'r') as f:
-                premium_data = json.load(f)
-                for user_id, expiry in premium_data.items():
-                    # Проверяем не истекла ли подписка
-                    if datetime.datetime.now().timestamp() < expiry:
-                        premium_users[int(user_id)] = expiry
-    except Exception as e:
-        logger.error(f"Ошибка загрузки premium_users: {e}")
-    
-    try:
-        # Загрузка истории загрузок пользователей
-        if os.path.exists(USER_HISTORY_FILE):
-            with open(USER_HISTORY_FILE, 'r') as f:
-                user_history = json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки user_history: {e}")
-    
-    try:
-        # Загрузка счетчиков запросов пользователей
-        if os.path.exists(USER_REQUESTS_FILE):
-            with open(USER_REQUESTS_FILE, 'r') as f:
-                user_requests = json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки user_requests: {e}")
-    
-    try:
-        # Загрузка токенов для загрузки
-        if os.path.exists(TOKENS_FILE):
-            with open(TOKENS_FILE, 'r') as f:
-                download_tokens = json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка загрузки download_tokens: {e}")
-
-def save_blocked_users():
-    """Сохранение списка заблокированных пользователей"""
-    try:
-        with open(BLOCKED_USERS_FILE, 'w') as f:
-            json.dump(list(blocked_users), f)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения blocked_users: {e}")
-
-def save_user_stats():
-    """Сохранение статистики пользователей"""
-    try:
-        with open(USER_STATS_FILE, 'w') as f:
-            json.dump(user_stats, f)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения user_stats: {e}")
-
-def save_bot_state():
-    """Сохранение состояния бота"""
-    try:
-        with open(BOT_STATE_FILE, 'w') as f:
-            json.dump({'enabled': bot_enabled}, f)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения bot_state: {e}")
-
-def save_premium_users():
-    """Сохранение списка премиум пользователей"""
-    try:
-        with open(PREMIUM_USERS_FILE, 'w') as f:
-            json.dump(premium_users, f)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения premium_users: {e}")
-
-def save_user_history():
-    """Сохранение истории загрузок пользователей"""
-    try:
-        with open(USER_HISTORY_FILE, 'w') as f:
-            json.dump(user_history, f)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения user_history: {e}")
-
-def save_user_requests():
-    """Сохранение счетчиков запросов пользователей"""
-    try:
-        with open(USER_REQUESTS_FILE, 'w') as f:
-            json.dump(user_requests, f)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения user_requests: {e}")
-
-def save_tokens():
-    """Сохранение токенов для загрузки"""
-    try:
-        with open(TOKENS_FILE, 'w') as f:
-            json.dump(download_tokens, f)
-    except Exception as e:
-        logger.error(f"Ошибка сохранения download_tokens: {e}")
-
-def get_user_type(user_id: int) -> str:
-    """Определение типа пользователя по ID"""
-    if user_id in ADMIN_IDS:
-        return 'admin'
-    elif user_id in premium_users:
-        return 'premium'
-    else:
-        return 'free'
-
-def can_make_request(user_id: int) -> bool:
-    """Проверка может ли пользователь сделать запрос (не превышен лимит)"""
-    user_type = get_user_type(user_id)
-    if user_type == 'admin':
-        return True
-    
-    # Получаем текущую дату для подсчета дневных лимитов
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    if today not in user_requests:
-        user_requests[today] = {}
-    
-    # Инициализируем счетчик если пользователь еще не делал запросов сегодня
-    if str(user_id) not in user_requests[today]:
-        user_requests[today][str(user_id)] = 0
-    
-    limit = REQUEST_LIMITS[user_type]
-    return user_requests[today][str(user_id)] < limit
-
-def increment_request_count(user_id: int):
-    """Увеличение счетчика запросов пользователя"""
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    if today not in user_requests:
-        user_requests[today] = {}
-    
-    if str(user_id) not in user_requests[today]:
-        user_requests[today][str(user_id)] = 0
-    
-    user_requests[today][str(user_id)] += 1
-    save_user_requests()
-
-def get_remaining_requests(user_id: int) -> int:
-    """Получение количества оставшихся запросов пользователя"""
-    user_type = get_user_type(user_id)
-    if user_type == 'admin':
-        return 999999
-    
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    if today not in user_requests or str(user_id) not in user_requests[today]:
-        return REQUEST_LIMITS[user_type]
-    
-    used = user_requests[today][str(user_id)]
-    return max(0, REQUEST_LIMITS[user_type] - used)
-
-def add_to_history(user_id: int, url: str, title: str, download_type: str, quality: str = None, success: bool = True):
-    """Добавление записи в историю загрузок пользователя"""
-    if user_id not in user_history:
-        user_history[user_id] = []
-    
-    history_entry = {
-        'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'url': url,
-        'title': title,
-        'type': download_type,
-        'quality': quality,
-        'success': success
-    }
-    
-    # Добавляем запись и ограничиваем историю 50 последними загрузками
-    user_history[user_id].append(history_entry)
-    if len(user_history[user_id]) > 50:
-        user_history[user_id].pop(0)
-    
-    save_user_history()
-
-def update_user_stats(user_id: int, username: str, action: str, success: bool = True):
-    """Обновление статистики пользователя"""
-    if user_id not in user_stats:
-        user_stats[user_id] = {
-            'username': username,
-            'first_seen': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'last_activity': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'video_downloads': 0,
-            'audio_downloads': 0,
-            'total_requests': 0,
-            'successful_requests': 0,
-            'failed_requests': 0,
-            'user_type': get_user_type(user_id)
-        }
-    else:
-        user_stats[user_id]['username'] = username
-    
-    # Обновляем время последней активности и тип пользователя
-    user_stats[user_id]['last_activity'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user_stats[user_id]['user_type'] = get_user_type(user_id)
-    user_stats[user_id]['total_requests'] += 1
-    
-    # Обновляем счетчики в зависимости от успешности операции
-    if success:
-        user_stats[user_id]['successful_requests'] += 1
-        if action == 'video':
-            user_stats[user_id]['video_downloads'] += 1
-        elif action == 'audio':
-            user_stats[user_id]['audio_downloads'] += 1
-    else:
-        user_stats[user_id]['failed_requests'] += 1
-    
-    save_user_stats()
-
-def log_error(user_id: int, username: str, error_type: str, error_message: str, url: str = ""):
-    """Логирование ошибок для последующего анализа"""
-    error_entry = {
-        'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'user_id': user_id,
-        'username': username,
-        'error_type': error_type,
-        'error_message': error_message,
-        'url': url
-    }
-    error_log.append(error_entry)
-    # Ограничиваем лог 100 последними ошибками
-    if len(error_log) > 100:
-        error_log.pop(0)
-
-def is_safe_filename(filename: str) -> bool:
-    """Проверка безопасности имени файла"""
-    if len(filename) > MAX_FILENAME_LENGTH:
-        return False
-    dangerous_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|', '..']
-    return all(char not in filename for char in dangerous_chars)
-
-def is_valid_url(url: str) -> bool:
-    """Валидация URL"""
-    if len(url) > MAX_URL_LENGTH:
-        return False
-    try:
-        result = urlparse(url)
-        return all([result.scheme in ['http', 'https'], result.netloc])
-    except:
-        return False
-
-def is_supported_platform(url: str) -> bool:
-    """Проверка поддерживаемых платформ"""
-    supported_domains = [
-        'youtube.com', 'www.youtube.com', 'm.youtube.com', 'youtu.be',
-        'tiktok.com', 'www.tiktok.com', 'vm.tiktok.com', 'vt.tiktok.com',
-        'rutube.ru', 'www.rutube.ru',
-        'y2mate.com', 'ssyoutube.com'
-    ]
-    try:
-        domain = urlparse(url).netloc.lower()
-        domain = domain.replace('www.', '')
-        return any(supported in domain for supported in supported_domains)
-    except:
-        return False
-
-def sanitize_filename(filename: str) -> str:
-    """Очистка имени файла от опасных символов"""
-    valid_chars = f"-_.() {string.ascii_letters}{string.digits}"
-    sanitized = ''.join(c for c in filename if c in valid_chars)
-    return sanitized[:MAX_FILENAME_LENGTH]
-
-def check_rate_limit(user_id: int) -> bool:
-    """Проверка ограничения частоты запросов пользователя"""
-    now = time.time()
-    if user_id not in user_rate_limits:
-        user_rate_limits[user_id] = []
-    # Удаляем старые запросы (старше 60 секунд)
-    user_rate_limits[user_id] = [t for t in user_rate_limits[user_id] if now - t < 60]
-    if len(user_rate_limits[user_id]) >= RATE_LIMIT_PER_USER:
-        return False
-    user_rate_limits[user_id].append(now)
-    return True
-
-def can_start_download() -> bool:
-    """Проверка можно ли начать новую загрузку (ограничение одновременных загрузок)"""
-    global concurrent_downloads
-    return concurrent_downloads < MAX_CONCURRENT_DOWNLOADS
-
-def start_download():
-    """Увеличение счетчика активных загрузок"""
-    global concurrent_downloads
-    concurrent_downloads += 1
-
-def finish_download():
-    """Уменьшение счетчика активных загрузок"""
-    global concurrent_downloads
-    concurrent_downloads = max(0, concurrent_downloads - 1)
-
-def generate_download_token(user_id: int) -> str:
-    """Генерация токена для безопасной загрузки"""
-    token = secrets.token_urlsafe(32)
-    expiry = datetime.datetime.now() + datetime.timedelta(minutes=10)
-    download_tokens[token] = {
-        'user_id': user_id,
-        'expiry': expiry.timestamp()
-    }
-    save_tokens()
-    return token
-
-def validate_download_token(token: str, user_id: int) -> bool:
-    """Валидация токена загрузки"""
-    if token not in download_tokens:
-        return False
-    
-    token_data = download_tokens[token]
-    if token_data['user_id'] != user_id:
-        return False
-    
-    # Проверяем не истек ли токен
-    if datetime.datetime.now().timestamp() > token_data['expiry']:
-        del download_tokens[token]
-        save_tokens()
-        return False
-    
-    # Удаляем использованный токен
-    del download_tokens[token]
-    save_tokens()
-    return True
-
-def is_blacklisted_domain(url: str) -> bool:
-    """Проверка домена в черном списке"""
-    try:
-        domain = urlparse(url).netloc.lower()
-        return any(blacklisted in domain for blacklisted in BLACKLISTED_DOMAINS)
-    except:
-        return True
-
-def calculate_file_hash(file_path: str) -> str:
-    """Вычисление хеша файла для проверки целостности"""
-    try:
-        hasher = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hasher.update(chunk)
-        return hasher.hexdigest()
-    except Exception as e:
-        logger.error(f"Ошибка вычисления хеша файла: {e}")
-        return ""
-
-def validate_file_extension(file_path: str) -> bool:
-    """Проверка разрешенного расширения файла"""
-    _, ext = os.path.splitext(file_path)
-    return ext.lower() in ALLOWED_EXTENSIONS
-
-def clean_temp_files():
-    """Очистка временных файлов"""
-    try:
-        for root, dirs, files in os.walk(tempfile.gettempdir()):
-            for file in files:
-                if file.startswith('tmp') or file.endswith(('.mp4', '.mp3', '.webm', '.mkv')):
-                    try:
-                        file_path = os.path.join(root, file)
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                    except:
-                        continue
-    except Exception as e:
-        logger.error(f"Ошибка очистки временных файлов: {e}")
-
-def is_suspicious_url(url: str) -> bool:
-    """Проверка URL на подозрительные паттерны"""
-    suspicious_patterns = [
-        r'javascript:',
-        r'data:',
-        r'vbscript:',
-        r'<script>',
-        r'</script>',
-        r'onload=',
-        r'onerror=',
-        r'onclick=',
-        r'%3Cscript%3E',
-        r'%3C/script%3E'
-    ]
-    
-    try:
-        url_lower = url.lower()
-        return any(pattern in url_lower for pattern in suspicious_patterns)
-    except:
-        return True
-
-def get_video_info(url: str) -> dict:
-    """Получение информации о видео без загрузки"""
-    try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Accept-Encoding': 'gzip, deflate',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            }
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Форматирование длительности видео
-            duration_seconds = info.get('duration', 0)
-            hours = duration_seconds // 3600
-            minutes = (duration_seconds % 3600) // 60
-            seconds = duration_seconds % 60
-            
-            if hours > 0:
-                duration_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-            else:
-                duration_str = f"{minutes:02d}:{seconds:02d}"
-            
-            return {
-                'success': True,
-                'title': info.get('title', 'Неизвестно'),
-                'author': info.get('uploader', 'Неизвестно'),
-                'duration': duration_str,
-                'views': info.get('view_count', 0),
-                'upload_date': info.get('upload_date', 'Неизвестно'),
-                'description': info.get('description', '')[:200] + '...' if info.get('description') else 'Нет описания',
-                'thumbnail': info.get('thumbnail', '')
-            }
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
-
-def download_video_worker(url: str, quality: str, temp_dir: str, result_dict: dict):
-    """Воркер для загрузки видео в отдельном процессе"""
-    try:
-        if not can_start_download():
-            result_dict.update({'success': False, 'error': 'too_many_downloads'})
-            return
-            
-        start_download()
-        
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': False,
-            'ignoreerrors': True,
-            'nooverwrites': True,
-            'noplaylist': True,
-            'restrictfilenames': True,
-            'paths': {'home': temp_dir},
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Accept-Encoding': 'gzip, deflate',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            }
-        }
-        
-        if not quality:
-            # Автоматический подбор качества - пробуем от высшего к низшему
-            qualities_to_try = ['1080', '720', '480', '360', '240']
-            
-            for q in qualities_to_try:
-                try:
-                    current_opts = ydl_opts.copy()
-                    current_opts['format'] = f'best[height<={q}]'
-                    current_opts['outtmpl'] = os.path.join(temp_dir, f'video_{q}p.%(ext)s')
-                    
-                    with yt_dlp.YoutubeDL(current_opts) as ydl:
-                        try:
-                            info = ydl.extract_info(url, download=True)
-                            if not info:
-                                continue
-                            video_title = sanitize_filename(info.get('title', 'video'))
-                        except Exception as e:
-                            continue
-                    
-                    # Поиск безопасных файлов в временной директории
-                    safe_files = []
-                    for file in os.listdir(temp_dir):
-                        if is_safe_filename(file) and file.endswith(('.mp4', '.mkv', '.webm')) and f'video_{q}p' in file:
-                            safe_files.append(file)
-                    
-                    for file in safe_files:
-                        media_file = os.path.join(temp_dir, file)
-                        if os.path.exists(media_file):
-                            # Проверка расширения файла
-                            if not validate_file_extension(media_file):
-                                os.remove(media_file)
-                                continue
-                                
-                            # Проверка целостности файла через хеш
-                            file_hash = calculate_file_hash(media_file)
-                            if not file_hash:
-                                os.remove(media_file)
-                                continue
-                                
-                            file_size = os.path.getsize(media_file) / (1024 * 1024)
-                            
-                            # Проверка размера файла
-                            if file_size <= MAX_FILE_SIZE:
-                                result_dict.update({
-                                    'success': True,
-                                    'file_path': media_file,
-                                    'title': video_title,
-                                    'quality': f"{q}p",
-                                    'file_size': file_size,
-                                    'quality_reduced': False,
-                                    'file_hash': file_hash
-                                })
-                                return
-                            else:
-                                os.remove(media_file)
-                                break
-                                
-                except Exception as e:
-                    continue
-            
-            result_dict.update({'success': False, 'error': 'no_suitable_quality'})
-            
-        else:
-            # Загрузка с конкретным качеством
-            ydl_opts['format'] = f'best[height<={quality}]'
-            ydl_opts['outtmpl'] = os.path.join(temp_dir, 'video.%(ext)s')
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                try:
-                    info = ydl.extract_info(url, download=True)
-                    if not info:
-                        result_dict.update({'success': False, 'error': 'no_video_info'})
-                        return
-                    video_title = sanitize_filename(info.get('title', 'video'))
-                except Exception as e:
-                    result_dict.update({'success': False, 'error': str(e)})
-                    return
-                
-            safe_files = []
-            for file in os.listdir(temp_dir):
-                if is_safe_filename(file) and file.endswith(('.mp4', '.mkv', '.webm')):
-                    safe_files.append(file)
-            
-            for file in safe_files:
-                media_file = os.path.join(temp_dir, file)
-                if os.path.exists(media_file):
-                    if not validate_file_extension(media_file):
-                        os.remove(media_file)
-                        continue
-                        
-                    file_hash = calculate_file_hash(media_file)
-                    if not file_hash:
-                        os.remove(media_file)
-                        continue
-                        
-                    file_size = os.path.getsize(media_file) / (1024 * 1024)
-                    
-                    if file_size <= MAX_FILE_SIZE:
-                        result_dict.update({
-                            'success': True,
-                            'file_path': media_file,
-                            'title': video_title,
-                            'quality': f"{quality}p",
-                            'file_size': file_size,
-                            'quality_reduced': False,
-                            'file_hash': file_hash
-                        })
-                        return
-                    else:
-                        os.remove(media_file)
-            
-            result_dict.update({'success': False, 'error': 'file_too_big'})
-            
-    except Exception as e:
-        result_dict.update({'success': False, 'error': str(e)})
-    finally:
-        finish_download()
-
-def download_video_reduced_quality_worker(url: str, original_quality: str, temp_dir: str, result_dict: dict):
-    """Воркер для загрузки видео с пониженным качеством"""
-    try:
-        quality_order = ['1080', '720', '480', '360', '240']
-        
-        # Определяем с какого качества начинать попытки
-        if original_quality in quality_order:
-            start_index = quality_order.index(original_quality)
-            qualities_to_try = quality_order[start_index + 1:]
-        else:
-            qualities_to_try = quality_order
-        
-        # Пробуем качества по порядку пока не найдем подходящее
-        for quality in qualities_to_try:
-            try:
-                ydl_opts = {
-                    'format': f'best[height<={quality}]',
-                    'outtmpl': os.path.join(temp_dir, f'video_{quality}p.%(ext)s'),
-                    'quiet': True,
-                    'http_headers': {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                        'Accept-Language': 'en-US,en;q=0.5',
-                        'Accept-Encoding': 'gzip, deflate',
-                        'DNT': '1',
-                        'Connection': 'keep-alive',
-                        'Upgrade-Insecure-Requests': '1',
-                    }
-                }
-                
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                    video_title = info.get('title', 'video')
-                
-                for file in os.listdir(temp_dir):
-                    if file.endswith(('.mp4', '.mkv', '.webm')) and f'video_{quality}p' in file:
-                        media_file = os.path.join(temp_dir, file)
-                        
-                        if not validate_file_extension(media_file):
-                            os.remove(media_file)
-                            continue
-                            
-                        file_hash = calculate_file_hash(media_file)
-                        if not file_hash:
-                            os.remove(media_file)
-                            continue
-                            
-                        file_size = os.path.getsize(media_file) / (1024 * 1024)
-                        
-                        if file_size <= 50:
-                            result_dict.update({
-                                'success': True,
-                                'file_path': media_file,
-                                'title': video_title,
-                                'quality': f"{quality}p",
-                                'file_size': file_size,
-                                'quality_reduced': True,
-                                'original_quality': f"{original_quality}p",
-                                'reduced_quality': f"{quality}p",
-                                'file_hash': file_hash
-                            })
-                            return
-                        else:
-                            os.remove(media_file)
-                            
-            except Exception as e:
-                continue
-        
-        result_dict.update({'success': False, 'error': 'no_suitable_quality'})
-        
-    except Exception as e:
-        result_dict.update({'success': False, 'error': str(e)})
-
-def download_audio_worker(url: str, temp_dir: str, result_dict: dict):
-    """Воркер для конвертации видео в аудио"""
-    try:
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'quiet': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Accept-Encoding': 'gzip, deflate',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            }
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            video_title = info.get('title', 'audio')
-            safe_title = "".join(c for c in video_title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            
-        for file in os.listdir(temp_dir):
-            if file.endswith('.mp3'):
-                media_file = os.path.join(temp_dir, file)
-                
-                if not validate_file_extension(media_file):
-                    os.remove(media_file)
-                    continue
-                    
-                file_hash = calculate_file_hash(media_file)
-                if not file_hash:
-                    os.remove(media_file)
-                    continue
-                    
-                file_size = os.path.getsize(media_file) / (1024 * 1024)
-                
-                if file_size <= 50:
-                    result_dict.update({
-                        'success': True,
-                        'file_path': media_file,
-                        'title': safe_title,
-                        'file_size': file_size,
-                        'file_hash': file_hash
-                    })
-                    return
-                else:
-                    os.remove(media_file)
-        
-        result_dict.update({'success': False, 'error': 'audio_too_big'})
-        
-    except Exception as e:
-        result_dict.update({'success': False, 'error': str(e)})
-
-def find_user_by_username(username: str) -> list:
-    """Поиск пользователей по username"""
-    found_users = []
-    username_lower = username.lower().replace('@', '').strip()
-    
-    if not username_lower:
-        return found_users
-    
-    # Поиск по всем пользователям в статистике
-    for user_id, stats in user_stats.items():
-        current_username = stats.get('username', '')
-        if not current_username or current_username == 'Unknown':
-            continue
-            
-        current_username_lower = current_username.lower().replace('@', '')
-        
-        if username_lower == current_username_lower or username_lower in current_username_lower:
-            found_users.append({
-                'user_id': user_id,
-                'username': current_username,
-                'stats': stats
-            })
-    
-    return found_users
-
-class YouTubeDownloaderBot:
-    """Основной класс бота для скачивания видео и аудио"""
-    
-    def __init__(self, token):
-        # Настройка HTTP запросов с увеличенными таймаутами для больших файлов
-        request = HTTPXRequest(
-            read_timeout=600,
-            write_timeout=600,
-            connect_timeout=600,
-            pool_timeout=600
-        )
-        self.application = Application.builder().token(token).request(request).build()
-        self.setup_handlers()
-        load_data()
-        clean_temp_files()
-
-    def setup_handlers(self):
-        """Настройка обработчиков команд и сообщений"""
-        self.application.add_handler(CommandHandler("start", self.show_welcome))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("admin", self.admin_panel))
-        self.application.add_handler(CommandHandler("premium", self.premium_info))
-        self.application.add_handler(CommandHandler("history", self.show_history))
-        self.application.add_handler(CommandHandler("info", self.video_info_command))
-        self.application.add_handler(CommandHandler("stats", self.user_stats_command))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
-
-    def get_main_keyboard(self):
-        """Клавиатура главного меню"""
-        keyboard = [
-            [KeyboardButton("Скачать видео"), KeyboardButton("Скачать аудио")],
-            [KeyboardButton("Информация о видео"), KeyboardButton("История загрузок")],
-            [KeyboardButton("Помощь"), KeyboardButton("Премиум"), KeyboardButton("Главное меню")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_welcome_keyboard(self):
-        """Клавиатура приветственного сообщения"""
-        keyboard = [
-            [KeyboardButton("Поздороваться")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_quality_keyboard(self):
-        """Клавиатура выбора качества видео"""
-        keyboard = [
-            [KeyboardButton("Авто качество"), KeyboardButton("1080p"), KeyboardButton("720p")],
-            [KeyboardButton("480p"), KeyboardButton("360p"), KeyboardButton("240p")],
-            [KeyboardButton("Назад")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_admin_keyboard(self):
-        """Клавиатура админ-панели"""
-        keyboard = [
-            [KeyboardButton("Статистика"), KeyboardButton("Пользователи")],
-            [KeyboardButton("Блокировка"), KeyboardButton("Настройки")],
-            [KeyboardButton("Логи ошибок"), KeyboardButton("Управление ботом")],
-            [KeyboardButton("Управление премиум"), KeyboardButton("Рассылка"), KeyboardButton("Выйти из админки")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_admin_users_keyboard(self):
-        """Клавиатура управления пользователями в админ-панели"""
-        keyboard = [
-            [KeyboardButton("Общая статистика"), KeyboardButton("Поиск пользователя")],
-            [KeyboardButton("Топ пользователей"), KeyboardButton("В админ-панель")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_admin_block_keyboard(self):
-        """Клавиатура управления блокировками"""
-        keyboard = [
-            [KeyboardButton("Заблокировать"), KeyboardButton("Разблокировать")],
-            [KeyboardButton("Список заблокированных"), KeyboardButton("В админ-панель")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_admin_control_keyboard(self):
-        """Клавиатура управления ботом"""
-        bot_status = "ВКЛ" if bot_enabled else "ВЫКЛ"
-        keyboard = [
-            [KeyboardButton(f"{bot_status} Бот"), KeyboardButton("Перезагрузить данные")],
-            [KeyboardButton("Очистить логи"), KeyboardButton("В админ-панель")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_admin_premium_keyboard(self):
-        """Клавиатура управления премиум подписками"""
-        keyboard = [
-            [KeyboardButton("Выдать премиум"), KeyboardButton("Забрать премиум")],
-            [KeyboardButton("Список премиум"), KeyboardButton("В админ-панель")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def get_admin_broadcast_keyboard(self):
-        """Клавиатура рассылки сообщений"""
-        keyboard = [
-            [KeyboardButton("Всем пользователям"), KeyboardButton("Только премиум")],
-            [KeyboardButton("Обычным пользователям"), KeyboardButton("В админ-панель")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-    def is_admin(self, user_id: int) -> bool:
-        """Проверка является ли пользователь администратором"""
-        return user_id in ADMIN_IDS
-
-    def is_user_blocked(self, user_id: int) -> bool:
-        """Проверка заблокирован ли пользователь"""
-        return user_id in blocked_users
-
-    def is_premium(self, user_id: int) -> bool:
-        """Проверка является ли пользователь премиум"""
-        return user_id in premium_users
-
-    def is_valid_youtube_url(self, url: str) -> bool:
-        """Комплексная проверка валидности YouTube URL"""
-        if not is_valid_url(url):
-            return False
-        if not is_supported_platform(url):
-            return False
-        if is_blacklisted_domain(url):
-            return False
-        if is_suspicious_url(url):
-            return False
-        try:
-            domain = urlparse(url).netloc.lower()
-            if any(yt_domain in domain for yt_domain in ['youtube.com', 'youtu.be']):
-                return True
-            if any(tt_domain in domain for tt_domain in ['tiktok.com', 'vm.tiktok.com', 'vt.tiktok.com']):
-                return True
-            if any(rt_domain in domain for rt_domain in ['rutube.ru']):
-                return True
-            return False
-        except:
-            return False
-
-    async def show_welcome(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать приветственное сообщение"""
-        welcome_text = "Привет! Нажми кнопку 'Поздороваться' чтобы начать общение..."
-        await update.message.reply_text(welcome_text, reply_markup=self.get_welcome_keyboard())
-
-    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработка команды /start"""
-        user_id = update.message.from_user.id
-        username = update.message.from_user.username or "Unknown"
-        
-        if self.is_user_blocked(user_id):
-            await update.message.reply_text("К сожалению, вы заблокированы и не можете использовать бота...")
-            return
-        
-        if not bot_enabled:
-            await update.message.reply_text("Бот временно отключен... Попробуйте позже!")
-            return
-        
-        user_type = get_user_type(user_id)
-        remaining = get_remaining_requests(user_id)
-        
-        welcome_text = f"""
-Добро пожаловать в UwU botyk!
-
-Здесь ты можешь:
-Скачать видео с YouTube, TikTok, RUTube
-Конвертировать видео в MP3
-Получить информацию о видео
-Посмотреть историю загрузок
-Получить премиум-статус!
-
-Твой статус: {user_type.upper()}
-Осталось запросов сегодня: {remaining}
-
-Выбирай нужную опцию из меню ниже...
-        """
-        context.user_data['greeted'] = True
-        update_user_stats(user_id, username, 'start')
-        await update.message.reply_text(welcome_text, reply_markup=self.get_main_keyboard())
-
-    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработка команды /help"""
-        help_text = """
-Как пользоваться ботом:
-
-1 Нажми «Скачать видео» или «Скачать аудио»
-2 Выбери качество для видео...
-3 Отправь ссылку на видео
-4 Жди загрузки файла!
-
-Поддерживаемые платформы:
-• YouTube (youtube.com, youtu.be)
-• TikTok (tiktok.com, vm.tiktok.com)  
-• RUTube (rutube.ru)
-
-Ограничения:
-• Максимальный размер файла 50MB
-• Время обработки до 10 минут
-• Автоматическое понижение качества
-
-В любой момент можно вернуться в главное меню!
-        """
-        await update.message.reply_text(help_text, reply_markup=self.get_main_keyboard())
-
-    async def premium_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Информация о премиум подписке"""
-        user_id = update.message.from_user.id
-        user_type = get_user_type(user_id)
-        
-        if user_type == 'premium':
-            expiry_timestamp = premium_users[user_id]
-            expiry_date = datetime.datetime.fromtimestamp(expiry_timestamp).strftime("%Y-%m-%d %H:%M:%S")
-            premium_text = f"""
-ВЫ ПРЕМИУМ ПОЛЬЗОВАТЕЛЬ!
-
-Ваши преимущества:
-• 20 запросов в день (вместо 5)!
-• Приоритетная обработка
-• Специальная поддержка
-• Доступ к будущим функциям...
-
-Премиум действует до: {expiry_date}
-
-Спасибо за поддержку!
-            """
-        else:
-            premium_text = f"""
-ПРЕМИУМ ПОДПИСКА
-
-Всего {SUBSCRIPTION_PRICE} руб/мес!
-
-Преимущества:
-• 20 запросов в день (вместо 5)!
-• Приоритетная обработка
-• Специальная поддержка
-• Доступ к будущим функциям...
-
-Сейчас у вас: {REQUEST_LIMITS['free']} запросов/день
-С премиум: {REQUEST_LIMITS['premium']} запросов/день
-
-Для приобретения премиум обратитесь к администратору:
-{ADMIN_USERNAME}
-            """
-        
-        await update.message.reply_text(premium_text, reply_markup=self.get_main_keyboard())
-
-    async def show_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать историю загрузок пользователя"""
-        user_id = update.message.from_user.id
-        
-        if user_id not in user_history or not user_history[user_id]:
-            await update.message.reply_text("История загрузок пуста... Попробуйте что-нибудь скачать!", reply_markup=self.get_main_keyboard())
-            return
-        
-        history_entries = user_history[user_id][-10:]
-        history_text = "ПОСЛЕДНИЕ ЗАГРУЗКИ:\n\n"
-        
-        for i, entry in enumerate(reversed(history_entries), 1):
-            status = "✅" if entry['success'] else "❌"
-            type_icon = "🎥" if entry['type'] == 'video' else "🎵"
-            quality = f" ({entry['quality']})" if entry['quality'] else ""
-            
-            history_text += f"{i}. {status} {type_icon} {entry['title']}{quality}\n"
-            history_text += f"   📅 {entry['timestamp']}\n"
-            history_text += f"   🔗 {entry['url'][:30]}...\n\n"
-        
-        await update.message.reply_text(history_text, reply_markup=self.get_main_keyboard())
-
-    async def video_info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Получение информации о видео"""
-        user_id = update.message.from_user.id
-        username = update.message.from_user.username or "Unknown"
-        
-        if not can_make_request(user_id):
-            remaining = get_remaining_requests(user_id)
-            await update.message.reply_text(
-                f"Лимит запросов исчерпан... Осталось: {remaining}\n"
-                f"Приобретите премиум для увеличения лимита!",
-                reply_markup=self.get_main_keyboard()
-            )
-            return
-        
-        context.user_data['awaiting_info_url'] = True
-        increment_request_count(user_id)
-        update_user_stats(user_id, username, 'info')
-        
-        await update.message.reply_text(
-            "Отправьте ссылку на видео для получения информации...",
-            reply_markup=self.get_main_keyboard()
-        )
-
-    async def user_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать статистику пользователя"""
-        user_id = update.message.from_user.id
-        username = update.message.from_user.username or "Unknown"
-        
-        if user_id not in user_stats:
-            await update.message.reply_text(
-                "У вас еще нет статистики... Начните использовать бота!",
-                reply_markup=self.get_main_keyboard()
-            )
-            return
-        
-        stats = user_stats[user_id]
-        user_type = get_user_type(user_id)
-        remaining = get_remaining_requests(user_id)
-        
-        stats_text = f"""
-ВАША СТАТИСТИКА:
-
-Статус: {user_type.upper()}
-Осталось запросов сегодня: {remaining}
-
-Всего запросов: {stats['total_requests']}
-Успешных: {stats['successful_requests']}
-Неудачных: {stats['failed_requests']}
-
-Видео скачано: {stats['video_downloads']}
-Аудио скачано: {stats['audio_downloads']}
-
-Первое использование: {stats['first_seen']}
-Последняя активность: {stats['last_activity']}
-        """
-        
-        await update.message.reply_text(stats_text, reply_markup=self.get_main_keyboard())
-
-    async def admin_panel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Панель администратора"""
-        if not self.is_admin(update.message.from_user.id):
-            await update.message.reply_text("У вас нет доступа к админ-панели...")
-            return
-        
-        admin_text = f"""
-АДМИН-ПАНЕЛЬ:
-
-Статистика - общая статистика бота
-Пользователи - управление пользователями
-Блокировка - блокировка/разблокировка
-Настройки - настройки бота
-Логи ошибок - просмотр ошибок
-Управление ботом - включение/выключение
-Управление премиум - премиум подписки
-Рассылка - отправка сообщений пользователям
-
-Статус: {'ВКЛЮЧЕН' if bot_enabled else 'ВЫКЛЮЧЕН'}
-Пользователей: {len(user_stats)}
-Премиум: {len(premium_users)}
-        """
-        await update.message.reply_text(admin_text, reply_markup=self.get_admin_keyboard())
-
-    async def run_process_download(self, worker_func, download_id, *args, timeout=600):
-        """Запуск процесса загрузки в отдельном процессе с таймаутом"""
-        try:
-            manager = multiprocessing.Manager()
-            result_dict = manager.dict()
-            
-            process = multiprocessing.Process(
-                target=worker_func,
-                args=(*args, result_dict)
-            )
-            
-            active_processes[download_id] = process
-            
-            process.start()
-            
-            process.join(timeout=timeout)
-            
-            if process.is_alive():
-                process.terminate()
-                process.join()
-                return {'success': False, 'error': 'timeout'}
-            
-            if 'success' in result_dict:
-                return dict(result_dict)
-            else:
-                return {'success': False, 'error': 'unknown_error'}
-                
-        except Exception as e:
-            logger.error(f"Ошибка в run_process_download: {e}")
-            return {'success': False, 'error': str(e)}
-        finally:
-            if download_id in active_processes:
-                del active_processes[download_id]
-
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Основной обработчик текстовых сообщений"""
-        user_message = update.message.text
-        user_id = update.message.from_user.id
-        username = update.message.from_user.username or "Unknown"
-        
-        # Проверка длины сообщения
-        if len(user_message) > 1000:
-            await update.message.reply_text("Сообщение слишком длинное...")
-            return
-        
-        # Проверка блокировки пользователя
-        if self.is_user_blocked(user_id):
-            await update.message.reply_text("К сожалению, вы заблокированы и не можете использовать бота...")
-            return
-        
-        # Проверка включен ли бот
-        if not bot_enabled and not self.is_admin(user_id):
-            await update.message.reply_text("Бот временно отключен... Попробуйте позже!")
-            return
-        
-        # Проверка ограничения частоты запросов
-        if not check_rate_limit(user_id):
-            await update.message.reply_text("Слишком много запросов... Подождите минуту!")
-            return
-        
-        # Обработка команд администратора
-        if self.is_admin(user_id):
-            # ... (обработка админских команд)
-            pass
-        
-        # Обработка основных команд пользователя
-        if user_message == "Поздороваться":
-            await self.start_command(update, context)
-            return
-        
-        if not context.user_data.get('greeted'):
-            welcome_text = "Нажми кнопку 'Поздороваться' чтобы начать..."
-            await update.message.reply_text(welcome_text, reply_markup=self.get_welcome_keyboard())
-            return
-        
-        # Обработка основных действий пользователя
-        if user_message == "Главное меню":
-            await self.start_command(update, context)
-            return
-        elif user_message == "Помощь":
-            await self.help_command(update, context)
-            return
-        elif user_message == "Премиум":
-            await self.premium_info(update, context)
-            return
-        elif user_message == "История загрузок":
-            await self.show_history(update, context)
-            return
-        elif user_message == "Информация о видео":
-            await self.video_info_command(update, context)
-            return
-        elif user_message == "Скачать видео":
-            # Проверка лимита запросов
-            if not can_make_request(user_id):
-                remaining = get_remaining_requests(user_id)
-                await update.message.reply_text(
-                    f"Лимит запросов исчерпан... Осталось: {remaining}\n"
-                    f"Приобретите премиум для увеличения лимита!",
-                    reply_markup=self.get_main_keyboard()
-                )
-                return
-            
-            context.user_data['awaiting_quality'] = True
-            context.user_data['download_type'] = 'video'
-            increment_request_count(user_id)
-            update_user_stats(user_id, username, 'video_menu')
-            await update.message.reply_text(
-                "Выбери качество видео...",
-                reply_markup=self.get_quality_keyboard()
-            )
-            return
-        elif user_message == "Скачать аудио":
-            if not can_make_request(user_id):
-                remaining = get_remaining_requests(user_id)
-                await update.message.reply_text(
-                    f"Лимит запросов исчерпан... Осталось: {remaining}\n"
-                    f"Приобретите премиум для увеличения лимита!",
-                    reply_markup=self.get_main_keyboard()
-                )
-                return
-            
-            context.user_data['awaiting_url'] = True
-            context.user_data['download_type'] = 'audio'
-            increment_request_count(user_id)
-            update_user_stats(user_id, username, 'audio_menu')
-            await update.message.reply_text(
-                "Отправь ссылку на видео для конвертации в MP3...",
-                reply_markup=self.get_main_keyboard()
-            )
-            return
-        elif user_message == "Назад":
-            if context.user_data.get('awaiting_quality'):
-                context.user_data['awaiting_quality'] = False
-            await update.message.reply_text(
-                "Возвращаюсь в главное меню...",
-                reply_markup=self.get_main_keyboard()
-            )
-            return
-
-        # Обработка выбора качества видео
-        if context.user_data.get('awaiting_quality'):
-            context.user_data['awaiting_quality'] = False
-            context.user_data['awaiting_url'] = True
-            
-            if user_message == "Авто качество":
-                context.user_data['quality'] = None
-                await update.message.reply_text(
-                    "Отправь ссылку на видео (автоматический подбор качества)...",
-                    reply_markup=self.get_main_keyboard()
-                )
-            elif user_message in ["1080p", "720p", "480p", "360p", "240p"]:
-                quality = user_message.replace('p', '')
-                context.user_data['quality'] = quality
-                await update.message.reply_text(
-                    f"Отправь ссылку на видео (будет скачано в {quality}p)...",
-                    reply_markup=self.get_main_keyboard()
-                )
-            return
-
-        # Проверка валидности URL
-        if not self.is_valid_youtube_url(user_message):
-            await update.message.reply_text(
-                "Пожалуйста, отправь корректную ссылку на видео с YouTube, TikTok или RUTube...",
-                reply_markup=self.get_main_keyboard()
-            )
-            return
-
-        # Обработка URL для загрузки
-        if context.user_data.get('awaiting_url'):
-            context.user_data['awaiting_url'] = False
-            download_type = context.user_data.get('download_type')
-            
-            if download_type == 'video':
-                quality = context.user_data.get('quality')
-                if quality:
-                    await self.process_video_quality_download(update, user_message, quality, user_id, username)
-                else:
-                    await self.process_video_auto_download(update, user_message, user_id, username)
-            elif download_type == 'audio':
-                await self.process_audio_download(update, user_message, user_id, username)
-        else:
-            await update.message.reply_text(
-                "Сначала выбери тип загрузки через меню...",
-                reply_markup=self.get_main_keyboard()
-            )
-
-    async def broadcast_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message: str, target: str):
-        """Рассылка сообщений пользователям"""
-        if not message.strip():
-            await update.message.reply_text("Сообщение не может быть пустым...", reply_markup=self.get_admin_broadcast_keyboard())
-            return
-    
-        status_msg = await update.message.reply_text(f"Начинаю рассылку для {target}...")
-    
-        try:
-            sent_count = 0
-            failed_count = 0
-            total_users = 0
-        
-            # Рассылка сообщений выбранной группе пользователей
-            for user_id in user_stats.keys():
-                user_type = get_user_type(user_id)
-            
-                if target == 'all' or (target == 'premium' and user_type == 'premium') or (target == 'free' and user_type == 'free'):
-                    total_users += 1
-                
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=f"Сообщение от администратора:\n\n{message}\n\n— Бот UwU botyk"
-                        )
-                        sent_count += 1
-                        await asyncio.sleep(0.1)  # Задержка чтобы не превысить лимиты Telegram
-                    except Exception as e:
-                        failed_count += 1
-        
-            await status_msg.delete()
-            await update.message.reply_text(
-                f"Рассылка завершена!\n\n"
-                f"Статистика:\n"
-                f"• Целевая группа: {target}\n"
-                f"• Всего пользователей: {total_users}\n"
-                f"• Успешно отправлено: {sent_count}\n"
-                f"• Не удалось отправить: {failed_count}",
-                reply_markup=self.get_admin_broadcast_keyboard()
-            )
-        
-        except Exception as e:
-            logger.error(f"Ошибка при рассылке: {e}")
-            await status_msg.delete()
-            await update.message.reply_text(
-                f"Ошибка при рассылке: {str(e)}",
-                reply_markup=self.get_admin_broadcast_keyboard()
-            )
-
-    async def process_video_info(self, update: Update, url: str, user_id: int, username: str):
-        """Обработка запроса информации о видео"""
-        if not self.is_valid_youtube_url(url):
-            await update.message.reply_text(
-                "Пожалуйста, отправь корректную ссылку на видео...",
-                reply_markup=self.get_main_keyboard()
-            )
-            return
-        
-        status_message = await update.message.reply_text("Получаю информацию о видео...")
-        
-        try:
-            info = get_video_info(url)
-            
-            if info['success']:
-                info_text = f"""
-ИНФОРМАЦИЯ О ВИДЕО:
-
-Название: {info['title']}
-Автор: {info['author']}
-Длительность: {info['duration']}
-Просмотры: {info['views']:,}
-Дата публикации: {info['upload_date']}
-Описание: {info['description']}
-                """
-                
-                add_to_history(user_id, url, info['title'], 'info', success=True)
-                await status_message.edit_text(info_text)
-            else:
-                log_error(user_id, username, 'video_info_error', info['error'], url)
-                add_to_history(user_id, url, 'Ошибка', 'info', success=False)
-                await status_message.edit_text("Не удалось получить информацию о видео...")
-                await update.message.reply_text(
-                    "Попробуй другую ссылку...",
-                    reply_markup=self.get_main_keyboard()
-                )
-                
-        except Exception as e:
-            logger.error(f"Ошибка при получении информации о видео: {e}")
-            log_error(user_id, username, 'video_info_processing_error', str(e), url)
-            add_to_history(user_id, url, 'Ошибка', 'info', success=False)
-            await status_message.edit_text("Произошла ошибка при получении информации...")
-            await update.message.reply_text(
-                "Попробуй еще раз...",
-                reply_markup=self.get_main_keyboard()
-            )
-
-    async def add_premium(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
-        """Выдача премиум подписки пользователю"""
-        if not user_input:
-            await update.message.reply_text("Введите ID пользователя или @username...", reply_markup=self.get_admin_premium_keyboard())
-            return
-        
-        user_input = user_input.strip()
-        
-        if user_input.isdigit():
-            # Обработка по ID пользователя
-            user_id = int(user_input)
-            
-            if user_id in premium_users:
-                expiry_date = datetime.datetime.fromtimestamp(premium_users[user_id]).strftime("%Y-%m-%d %H:%M:%S")
-                await update.message.reply_text(
-                    f"Пользователь уже имеет премиум до {expiry_date}...",
-                    reply_markup=self.get_admin_premium_keyboard()
-                )
-                return
-            
-            if user_id not in user_stats:
-                await update.message.reply_text(
-                    f"Пользователь с ID {user_id} не найден в базе...",
-                    reply_markup=self.get_admin_premium_keyboard()
-                )
-                return
-            
-            # Выдача премиум на 30 дней
-            expiry = datetime.datetime.now() + datetime.timedelta(days=30)
-            premium_users[user_id] = expiry.timestamp()
-            save_premium_users()
-            
-            username = user_stats.get(user_id, {}).get('username', 'Unknown')
-            await update.message.reply_text(
-                f"Пользователь @{username} (ID: {user_id}) получил премиум на 30 дней!", 
-                reply_markup=self.get_admin_premium_keyboard()
-            )
-        
-        else:
-            # Обработка по username
-            found_users = find_user_by_username(user_input)
-            
-            if not found_users:
-                await update.message.reply_text(
-                    f"Пользователь с username '{user_input}' не найден...\n\n"
-                    f"Убедитесь, что пользователь хотя бы раз использовал бота...",
-                    reply_markup=self.get_admin_premium_keyboard()
-                )
-                return
-            
-            if len(found_users) > 1:
-                # Если найдено несколько пользователей
-                users_text = "Найдено несколько пользователей:\n\n"
-                for i, user in enumerate(found_users[:5], 1):
-                    has_premium = " 💎" if user['user_id'] in premium_users else ""
-                    users_text += f"{i}. @{user['username']}{has_premium} (ID: {user['user_id']})\n"
-                
-                users_text += "\nВведите ID пользователя для точного выбора..."
-                await update.message.reply_text(users_text, reply_markup=self.get_admin_premium_keyboard())
-                return
-            
-            user = found_users[0]
-            user_id = user['user_id']
-            
-            if user_id in premium_users:
-                expiry_date = datetime.datetime.fromtimestamp(premium_users[user_id]).strftime("%Y-%m-%d %H:%M:%S")
-                await update.message.reply_text(
-                    f"Пользователь @{user['username']} уже имеет премиум до {expiry_date}...",
-                    reply_markup=self.get_admin_premium_keyboard()
-                )
-                return
-            
-            expiry = datetime.datetime.now() + datetime.timedelta(days=30)
-            premium_users[user_id] = expiry.timestamp()
-            save_premium_users()
-            
-            await update.message.reply_text(
-                f"Пользователь @{user['username']} (ID: {user_id}) получил премиум на 30 дней!", 
-                reply_markup=self.get_admin_premium_keyboard()
-            )
-
-    async def remove_premium(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
-        """Удаление премиум подписки у пользователя"""
-        if not user_input:
-            await update.message.reply_text("Введите ID пользователя или @username...", reply_markup=self.get_admin_premium_keyboard())
-            return
-        
-        user_input = user_input.strip()
-        
-        if user_input.isdigit():
-            user_id = int(user_input)
-            
-            if user_id in premium_users:
-                del premium_users[user_id]
-                save_premium_users()
-                username = user_stats.get(user_id, {}).get('username', 'Unknown')
-                await update.message.reply_text(
-                    f"Премиум удален у пользователя @{username} (ID: {user_id})...", 
-                    reply_markup=self.get_admin_premium_keyboard()
-                )
-            else:
-                await update.message.reply_text("Пользователь не имеет премиум...", reply_markup=self.get_admin_premium_keyboard())
-        
-        else:
-            found_users = find_user_by_username(user_input)
-            
-            if not found_users:
-                await update.message.reply_text(
-                    f"Пользователь с username '{user_input}' не найден...\n\n"
-                    f"Убедитесь, что пользователь хотя бы раз использовал бота...",
-                    reply_markup=self.get_admin_premium_keyboard()
-                )
-                return
-            
-            if len(found_users) > 1:
-                users_text = "Найдено несколько пользователей:\n\n"
-                for i, user in enumerate(found_users[:5], 1):
-                    has_premium = " 💎" if user['user_id'] in premium_users else ""
-                    users_text += f"{i}. @{user['username']}{has_premium} (ID: {user['user_id']})\n"
-                
-                users_text += "\nВведите ID пользователя для точного выбора..."
-                await update.message.reply_text(users_text, reply_markup=self.get_admin_premium_keyboard())
-                return
-            
-            user = found_users[0]
-            user_id = user['user_id']
-            
-            if user_id in premium_users:
-                del premium_users[user_id]
-                save_premium_users()
-                await update.message.reply_text(
-                    f"Премиум удален у пользователя @{user['username']} (ID: {user_id})...", 
-                    reply_markup=self.get_admin_premium_keyboard()
-                )
-            else:
-                await update.message.reply_text(
-                    f"Пользователь @{user['username']} не имеет премиум...", 
-                    reply_markup=self.get_admin_premium_keyboard()
-                )
-
-    async def show_premium_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать список премиум пользователей"""
-        if not premium_users:
-            await update.message.reply_text("Нет премиум пользователей...", reply_markup=self.get_admin_premium_keyboard())
-            return
-        
-        premium_text = "ПРЕМИУМ ПОЛЬЗОВАТЕЛИ:\n\n"
-        for i, (user_id, expiry) in enumerate(list(premium_users.items())[:20], 1):
-            stats = user_stats.get(user_id, {})
-            username = stats.get('username', 'Unknown')
-            expiry_date = datetime.datetime.fromtimestamp(expiry).strftime("%Y-%m-%d %H:%M:%S")
-            premium_text += f"{i}. @{username} (ID: {user_id})\n"
-            premium_text += f"   Действует до: {expiry_date}\n"
-            if stats:
-                premium_text += f"   Запросов: {stats.get('total_requests', 0)}\n"
-            premium_text += "\n"
-        
-        await update.message.reply_text(premium_text, reply_markup=self.get_admin_premium_keyboard())
-
-    async def block_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
-        """Блокировка пользователя"""
-        if not user_input:
-            await update.message.reply_text("Введите ID пользователя или @username...", reply_markup=self.get_admin_block_keyboard())
-            return
-        
-        user_input = user_input.strip()
-        
-        if user_input.isdigit():
-            user_id = int(user_input)
-            
-            if user_id in ADMIN_IDS:
-                await update.message.reply_text("Нельзя заблокировать администратора...", reply_markup=self.get_admin_block_keyboard())
-                return
-            
-            blocked_users.add(user_id)
-            save_blocked_users()
-            
-            username = user_stats.get(user_id, {}).get('username', 'Unknown')
-            await update.message.reply_text(
-                f"Пользователь {username} (ID: {user_id}) заблокирован...", 
-                reply_markup=self.get_admin_block_keyboard()
-            )
-        
-        else:
-            found_users = find_user_by_username(user_input)
-            
-            if not found_users:
-                await update.message.reply_text(
-                    f"Пользователь с username '{user_input}' не найден...",
-                    reply_markup=self.get_admin_block_keyboard()
-                )
-                return
-            
-            if len(found_users) > 1:
-                users_text = "Найдено несколько пользователей:\n\n"
-                for i, user in enumerate(found_users[:5], 1):
-                    users_text += f"{i}. @{user['username']} (ID: {user['user_id']})\n"
-                
-                users_text += "\nВведите ID пользователя для точного выбора..."
-                await update.message.reply_text(users_text, reply_markup=self.get_admin_block_keyboard())
-                return
-            
-            user = found_users[0]
-            user_id = user['user_id']
-            
-            if user_id in ADMIN_IDS:
-                await update.message.reply_text("Нельзя заблокировать администратора...", reply_markup=self.get_admin_block_keyboard())
-                return
-            
-            blocked_users.add(user_id)
-            save_blocked_users()
-            
-            await update.message.reply_text(
-                f"Пользователь @{user['username']} (ID: {user_id}) заблокирован...", 
-                reply_markup=self.get_admin_block_keyboard()
-            )
-
-    async def unblock_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
-        """Разблокировка пользователя"""
-        if not user_input:
-            await update.message.reply_text("Введите ID пользователя или @username...", reply_markup=self.get_admin_block_keyboard())
-            return
-        
-        user_input = user_input.strip()
-        
-        if user_input.isdigit():
-            user_id = int(user_input)
-            
-            if user_id in blocked_users:
-                blocked_users.remove(user_id)
-                save_blocked_users()
-                username = user_stats.get(user_id, {}).get('username', 'Unknown')
-                await update.message.reply_text(
-                    f"Пользователь {username} (ID: {user_id}) разблокирован!", 
-                    reply_markup=self.get_admin_block_keyboard()
-                )
-            else:
-                await update.message.reply_text("Пользователь не заблокирован...", reply_markup=self.get_admin_block_keyboard())
-        
-        else:
-            found_users = find_user_by_username(user_input)
-            
-            if not found_users:
-                await update.message.reply_text(
-                    f"Пользователь с username '{user_input}' не найден...",
-                    reply_markup=self.get_admin_block_keyboard()
-                )
-                return
-            
-            if len(found_users) > 1:
-                users_text = "Найдено несколько пользователей:\n\n"
-                for i, user in enumerate(found_users[:5], 1):
-                    is_blocked = " 🚫" if user['user_id'] in blocked_users else ""
-                    users_text += f"{i}. @{user['username']}{is_blocked} (ID: {user['user_id']})\n"
-                
-                users_text += "\nВведите ID пользователя для точного выбора..."
-                await update.message.reply_text(users_text, reply_markup=self.get_admin_block_keyboard())
-                return
-            
-            user = found_users[0]
-            user_id = user['user_id']
-            
-            if user_id in blocked_users:
-                blocked_users.remove(user_id)
-                save_blocked_users()
-                await update.message.reply_text(
-                    f"Пользователь @{user['username']} (ID: {user_id}) разблокирован!", 
-                    reply_markup=self.get_admin_block_keyboard()
-                )
-            else:
-                await update.message.reply_text(
-                    f"Пользователь @{user['username']} не заблокирован...", 
-                    reply_markup=self.get_admin_block_keyboard()
-                )
-
-    async def show_statistics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать общую статистику бота"""
-        total_users = len(user_stats)
-        total_videos = sum(stats.get('video_downloads', 0) for stats in user_stats.values())
-        total_audio = sum(stats.get('audio_downloads', 0) for stats in user_stats.values())
-        total_requests = sum(stats.get('total_requests', 0) for stats in user_stats.values())
-        success_rate = (sum(stats.get('successful_requests', 0) for stats in user_stats.values()) / total_requests * 100) if total_requests > 0 else 0
-        
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-        today_requests = sum(user_requests.get(today, {}).values()) if today in user_requests else 0
-        
-        stats_text = f"""
-ОБЩАЯ СТАТИСТИКА БОТА:
-
-Пользователей: {total_users}
-Премиум: {len(premium_users)}
-Видео скачано: {total_videos}
-Аудио скачано: {total_audio}
-Всего запросов: {total_requests}
-Запросов сегодня: {today_requests}
-Успешных: {success_rate:.1f}%
-Заблокировано: {len(blocked_users)}
-{'Бот включен' if bot_enabled else 'Бот выключен'}
-        """
-        await update.message.reply_text(stats_text, reply_markup=self.get_admin_keyboard())
-
-    async def show_general_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать общую статистику пользователей"""
-        total_users = len(user_stats)
-        active_today = len([stats for stats in user_stats.values() 
-                          if datetime.datetime.now().strftime("%Y-%m-%d") in stats.get('last_activity', '')])
-        
-        stats_text = f"""
-ОБЩАЯ СТАТИСТИКА:
-
-Всего пользователей: {total_users}
-Премиум пользователей: {len(premium_users)}
-Активных сегодня: {active_today}
-Заблокированных: {len(blocked_users)}
-Последняя активность: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}
-        """
-        await update.message.reply_text(stats_text, reply_markup=self.get_admin_users_keyboard())
-
-    async def show_top_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать топ пользователей по количеству запросов"""
-        if not user_stats:
-            await update.message.reply_text("Данных о пользователях пока нет...", reply_markup=self.get_admin_users_keyboard())
-            return
-        
-        top_users = sorted(user_stats.items(), key=lambda x: x[1].get('total_requests', 0), reverse=True)[:10]
-        
-        top_text = "ТОП-10 ПОЛЬЗОВАТЕЛЕЙ:\n\n"
-        for i, (user_id, stats) in enumerate(top_users, 1):
-            username = stats.get('username', 'Unknown')
-            videos = stats.get('video_downloads', 0)
-            audio = stats.get('audio_downloads', 0)
-            total = stats.get('total_requests', 0)
-            user_type = stats.get('user_type', 'free')
-            premium_badge = " 💎" if user_type == 'premium' else ""
-            
-            top_text += f"{i}. @{username}{premium_badge} (ID: {user_id})\n"
-            top_text += f"   Запросов: {total} (🎥{videos} 🎵{audio})\n"
-            top_text += f"   Последняя активность: {stats.get('last_activity', 'N/A')}\n\n"
-        
-        await update.message.reply_text(top_text, reply_markup=self.get_admin_users_keyboard())
-
-    async def search_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, search_query: str):
-        """Поиск пользователя по ID или username"""
-        found_users = []
-        
-        if search_query.isdigit():
-            user_id = int(search_query)
-            if user_id in user_stats:
-                found_users.append((user_id, user_stats[user_id]))
-        
-        for user_id, stats in user_stats.items():
-            if search_query.lower() in stats.get('username', '').lower():
-                found_users.append((user_id, stats))
-        
-        if not found_users:
-            await update.message.reply_text("Пользователь не найден...", reply_markup=self.get_admin_users_keyboard())
-            return
-        
-        user_text = "НАЙДЕННЫЕ ПОЛЬЗОВАТЕЛИ:\n\n"
-        for user_id, stats in found_users[:5]:
-            username = stats.get('username', 'Unknown')
-            videos = stats.get('video_downloads', 0)
-            audio = stats.get('audio_downloads', 0)
-            total = stats.get('total_requests', 0)
-            success = stats.get('successful_requests', 0)
-            failed = stats.get('failed_requests', 0)
-            user_type = stats.get('user_type', 'free')
-            blocked = "🚫" if self.is_user_blocked(user_id) else "✅"
-            premium_badge = " 💎" if user_type == 'premium' else ""
-            
-            user_text += f"{blocked} @{username}{premium_badge} (ID: {user_id})\n"
-            user_text += f"   Первый визит: {stats.get('first_seen', 'N/A')}\n"
-            user_text += f"   Последняя активность: {stats.get('last_activity', 'N/A')}\n"
-            user_text += f"   Статистика: {total} запросов ({success}✅/{failed}❌)\n"
-            user_text += f"   Загрузки: {videos} видео, {audio} аудио\n\n"
-        
-        await update.message.reply_text(user_text, reply_markup=self.get_admin_users_keyboard())
-
-    async def show_blocked_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать список заблокированных пользователей"""
-        if not blocked_users:
-            await update.message.reply_text("Нет заблокированных пользователей...", reply_markup=self.get_admin_block_keyboard())
-            return
-        
-        blocked_text = "ЗАБЛОКИРОВАННЫЕ ПОЛЬЗОВАТЕЛИ:\n\n"
-        for i, user_id in enumerate(list(blocked_users)[:20], 1):
-            stats = user_stats.get(user_id, {})
-            username = stats.get('username', 'Unknown')
-            blocked_text += f"{i}. @{username} (ID: {user_id})\n"
-            if stats:
-                blocked_text += f"   Последняя активность: {stats.get('last_activity', 'N/A')}\n"
-            blocked_text += "\n"
-        
-        await update.message.reply_text(blocked_text, reply_markup=self.get_admin_block_keyboard())
-
-    async def toggle_bot(self, update: Update, context: ContextTypes.DEFAULT_TYPE, enable: bool):
-        """Включение/выключение бота"""
-        global bot_enabled
-        bot_enabled = enable
-        save_bot_state()
-        
-        status_text = "включен" if enable else "выключен"
-        await update.message.reply_text(
-            f"Бот {status_text}!", 
-            reply_markup=self.get_admin_control_keyboard()
-        )
-
-    async def show_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать настройки бота"""
-        settings_text = f"""
-НАСТРОЙКИ БОТА:
-
-Статус: {'ВКЛЮЧЕН' if bot_enabled else 'ВЫКЛЮЧЕН'}
-Заблокированных: {len(blocked_users)}
-Всего пользователей: {len(user_stats)}
-Премиум пользователей: {len(premium_users)}
-Ошибок в логе: {len(error_log)}
-
-Используйте меню ниже для управления ботом...
-        """
-        await update.message.reply_text(settings_text, reply_markup=self.get_admin_keyboard())
-
-    async def show_error_logs(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать логи ошибок"""
-        if not error_log:
-            await update.message.reply_text("Логов ошибок нет...", reply_markup=self.get_admin_keyboard())
-            return
-        
-        error_text = "ПОСЛЕДНИЕ ОШИБКИ:\n\n"
-        for i, error in enumerate(error_log[-10:], 1):
-            error_text += f"{i}. {error['timestamp']}\n"
-            error_text += f"   👤 {error['username']} (ID: {error['user_id']})\n"
-            error_text += f"   🚨 {error['error_type']}\n"
-            error_text += f"   📝 {error['error_message'][:100]}...\n"
-            if error['url']:
-                error_text += f"   🔗 {error['url'][:50]}...\n"
-            error_text += "\n"
-        
-        await update.message.reply_text(error_text, reply_markup=self.get_admin_keyboard())
-
-    async def send_video_with_timeout(self, update: Update, file_path: str, caption: str, is_1080p: bool = False):
-        """Отправка видео с увеличенными таймаутами"""
-        if is_1080p:
-            return await update.message.reply_video(
-                video=open(file_path, 'rb'),
-                caption=caption,
-                supports_streaming=True,
-                read_timeout=600,
-                write_timeout=600,
-                connect_timeout=600,
-                pool_timeout=600
-            )
-        else:
-            return await update.message.reply_video(
-                video=open(file_path, 'rb'),
-                caption=caption,
-                supports_streaming=True,
-                read_timeout=600,
-                write_timeout=600,
-                connect_timeout=600,
-                pool_timeout=600
-            )
-
-    async def process_video_quality_download(self, update: Update, url: str, quality: str, user_id: int, username: str):
-        """Обработка загрузки видео с конкретным качеством"""
-        download_token = generate_download_token(user_id)
-        download_id = f"video_quality_{update.message.chat_id}_{update.message.message_id}"
-        status_message = await update.message.reply_text(f"Начинаю загрузку видео в {quality}p...")
-        
-        try:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                is_1080p = quality == '1080'
-                timeout = 600
-                
-                result = await self.run_process_download(
-                    download_video_worker,
-                    download_id,
-                    url, quality, temp_dir,
-                    timeout=timeout
-                )
-                
-                if result.get('error') == 'timeout':
-                    log_error(user_id, username, 'download_timeout', f'Video {quality}p timeout', url)
-                    update_user_stats(user_id, username, 'video', False)
-                    add_to_history(user_id, url, 'Таймаут', 'video', quality, False)
-                    await status_message.edit_text("Время загрузки истекло... Попробуйте позже!")
-                    await update.message.reply_text(
-                        "Попробуй выбрать другое качество или другое видео...",
-                        reply_markup=self.get_main_keyboard()
-                    )
-                    return
-                
-                if result['success']:
-                    if not validate_download_token(download_token, user_id):
-                        await status_message.edit_text("Ошибка безопасности... Попробуйте снова!")
-                        return
-                    
-                    if result.get('quality_reduced', False):
-                        await status_message.edit_text("Отправляю видео (качество автоматически понижено)...")
-                        
-                        caption = f"✅ {result['title']} {result['reduced_quality']}"
-                        
-                        is_reduced_1080p = result['reduced_quality'] == '1080p'
-                        await self.send_video_with_timeout(update, result['file_path'], caption, is_reduced_1080p)
-                        
-                        await status_message.delete()
-                        update_user_stats(user_id, username, 'video', True)
-                        add_to_history(user_id, url, result['title'], 'video', result['reduced_quality'], True)
-                        await update.message.reply_text(
-                            f"Качество автоматически понижено с {result['original_quality']} до {result['reduced_quality']} для соответствия ограничению размера файла 50MB...",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                    else:
-                        await status_message.edit_text("Отправляю видео...")
-                        
-                        caption = f"✅ {result['title']} {quality}p"
-                        
-                        await self.send_video_with_timeout(update, result['file_path'], caption, is_1080p)
-                        
-                        await status_message.delete()
-                        update_user_stats(user_id, username, 'video', True)
-                        add_to_history(user_id, url, result['title'], 'video', quality, True)
-                        await update.message.reply_text(
-                            "Видео успешно отправлено!",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                else:
-                    if result.get('error') == 'file_too_big':
-                        log_error(user_id, username, 'file_too_big', f'Video {quality}p too big', url)
-                        update_user_stats(user_id, username, 'video', False)
-                        add_to_history(user_id, url, 'Файл слишком большой', 'video', quality, False)
-                        await status_message.edit_text(f"Файл в {quality}p превышает 50MB... Пробую понизить качество...")
-                        
-                        reduced_result = await self.run_process_download(
-                            download_video_reduced_quality_worker,
-                            f"{download_id}_reduced",
-                            url, quality, temp_dir,
-                            timeout=600
-                        )
-                        
-                        if reduced_result['success']:
-                            if not validate_download_token(download_token, user_id):
-                                await status_message.edit_text("Ошибка безопасности... Попробуйте снова!")
-                                return
-                                
-                            await status_message.edit_text("Отправляю видео (качество автоматически понижено)...")
-                            
-                            caption = f"✅ {reduced_result['title']} {reduced_result['reduced_quality']}"
-                            
-                            is_reduced_1080p = reduced_result['reduced_quality'] == '1080p'
-                            await self.send_video_with_timeout(update, reduced_result['file_path'], caption, is_reduced_1080p)
-                            
-                            await status_message.delete()
-                            update_user_stats(user_id, username, 'video', True)
-                            add_to_history(user_id, url, reduced_result['title'], 'video', reduced_result['reduced_quality'], True)
-                            await update.message.reply_text(
-                                f"Качество автоматически понижено с {reduced_result['original_quality']} до {reduced_result['reduced_quality']} для соответствия ограничению размера файла 50MB...",
-                                reply_markup=self.get_main_keyboard()
-                            )
-                        else:
-                            log_error(user_id, username, 'no_suitable_quality', f'No suitable quality after reduction', url)
-                            update_user_stats(user_id, username, 'video', False)
-                            add_to_history(user_id, url, 'Нет подходящего качества', 'video', quality, False)
-                            await status_message.edit_text("Не удалось найти подходящее качество... Попробуй другое видео!")
-                            await update.message.reply_text(
-                                "Попробуй выбрать другое качество или другое видео...",
-                                reply_markup=self.get_main_keyboard()
-                            )
-                    else:
-                        log_error(user_id, username, 'video_download_error', str(result.get('error')), url)
-                        update_user_stats(user_id, username, 'video', False)
-                        add_to_history(user_id, url, 'Ошибка загрузки', 'video', quality, False)
-                        await status_message.edit_text("Произошла ошибка при загрузке видео...")
-                        await update.message.reply_text(
-                            "Попробуй выбрать другое качество или другое видео...",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                    
-        except Exception as e:
-            logger.error(f"Ошибка при обработке видео: {e}")
-            log_error(user_id, username, 'video_processing_error', str(e), url)
-            update_user_stats(user_id, username, 'video', False)
-            add_to_history(user_id, url, 'Ошибка обработки', 'video', quality, False)
-            await status_message.edit_text("Произошла ошибка при обработке видео...")
-            await update.message.reply_text(
-                "Попробуй еще раз или выбери другое качество...",
-                reply_markup=self.get_main_keyboard()
-            )
-
-    async def process_video_auto_download(self, update: Update, url: str, user_id: int, username: str):
-        """Обработка загрузки видео с автоматическим подбором качества"""
-        download_token = generate_download_token(user_id)
-        download_id = f"video_auto_{update.message.chat_id}_{update.message.message_id}"
-        status_message = await update.message.reply_text("Начинаю загрузку видео (авто качество)...")
-        
-        try:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                result = await self.run_process_download(
-                    download_video_worker,
-                    download_id,
-                    url, None, temp_dir,
-                    timeout=600
-                )
-                
-                if result.get('error') == 'timeout':
-                    log_error(user_id, username, 'download_timeout', 'Auto quality timeout', url)
-                    update_user_stats(user_id, username, 'video', False)
-                    add_to_history(user_id, url, 'Таймаут', 'video', 'auto', False)
-                    await status_message.edit_text("Время загрузки истекло... Попробуй позже!")
-                    await update.message.reply_text(
-                        "Попробуй выбрать другое качество или другое видео...",
-                        reply_markup=self.get_main_keyboard()
-                    )
-                    return
-                
-                if result['success']:
-                    if not validate_download_token(download_token, user_id):
-                        await status_message.edit_text("Ошибка безопасности... Попробуйте снова!")
-                        return
-                        
-                    await status_message.edit_text("Отправляю видео...")
-                    
-                    try:
-                        caption = f"✅ {result['title']} {result['quality']}"
-                        
-                        is_1080p = result['quality'] == '1080p'
-                        await self.send_video_with_timeout(update, result['file_path'], caption, is_1080p)
-                        
-                        await status_message.delete()
-                        update_user_stats(user_id, username, 'video', True)
-                        add_to_history(user_id, url, result['title'], 'video', result['quality'], True)
-                        await update.message.reply_text(
-                            f"Видео успешно отправлено в {result['quality']}!",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                    except asyncio.TimeoutError:
-                        log_error(user_id, username, 'send_timeout', 'Auto quality send timeout', url)
-                        update_user_stats(user_id, username, 'video', False)
-                        add_to_history(user_id, url, 'Таймаут отправки', 'video', 'auto', False)
-                        await status_message.edit_text("Время отправки истекло... Попробуй позже!")
-                        await update.message.reply_text(
-                            "Попробуй еще раз...",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                    except Exception as file_error:
-                        logger.error(f"Ошибка при отправке видео файла: {file_error}")
-                        log_error(user_id, username, 'video_send_error', str(file_error), url)
-                        update_user_stats(user_id, username, 'video', False)
-                        add_to_history(user_id, url, 'Ошибка отправки', 'video', 'auto', False)
-                        await status_message.edit_text("Ошибка при отправке видео...")
-                        await update.message.reply_text(
-                            "Попробуй еще раз...",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                else:
-                    if result.get('error') == 'no_suitable_quality':
-                        log_error(user_id, username, 'no_suitable_quality', 'No suitable quality found', url)
-                        update_user_stats(user_id, username, 'video', False)
-                        add_to_history(user_id, url, 'Нет подходящего качества', 'video', 'auto', False)
-                        await status_message.edit_text("Не удалось найти подходящее качество (все варианты превышают 50MB)...")
-                        await update.message.reply_text(
-                            "Попробуй другое видео...",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                    else:
-                        log_error(user_id, username, 'auto_video_download_error', str(result.get('error')), url)
-                        update_user_stats(user_id, username, 'video', False)
-                        add_to_history(user_id, url, 'Ошибка загрузки', 'video', 'auto', False)
-                        await status_message.edit_text("Произошла ошибка при загрузке видео...")
-                        await update.message.reply_text(
-                            "Попробуй выбрать другое качество или другое видео...",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                    
-        except Exception as e:
-            logger.error(f"Ошибка при обработке видео (авто): {e}")
-            log_error(user_id, username, 'auto_video_processing_error', str(e), url)
-            update_user_stats(user_id, username, 'video', False)
-            add_to_history(user_id, url, 'Ошибка обработки', 'video', 'auto', False)
-            await status_message.edit_text("Произошла ошибка при обработке видео...")
-            await update.message.reply_text(
-                "Попробуй еще раз или выбери другое качество...",
-                reply_markup=self.get_main_keyboard()
-            )
-
-    async def process_audio_download(self, update: Update, url: str, user_id: int, username: str):
-        """Обработка конвертации видео в аудио"""
-        download_token = generate_download_token(user_id)
-        download_id = f"audio_{update.message.chat_id}_{update.message.message_id}"
-        status_message = await update.message.reply_text("Начинаю конвертацию в аудио...")
-        
-        try:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                result = await self.run_process_download(
-                    download_audio_worker,
-                    download_id,
-                    url, temp_dir,
-                    timeout=600
-                )
-                
-                if result.get('error') == 'timeout':
-                    log_error(user_id, username, 'audio_timeout', 'Audio conversion timeout', url)
-                    update_user_stats(user_id, username, 'audio', False)
-                    add_to_history(user_id, url, 'Таймаут', 'audio', None, False)
-                    await status_message.edit_text("Время конвертации истекло... Попробуй позже!")
-                    await update.message.reply_text(
-                        "Попробуй другое видео...",
-                        reply_markup=self.get_main_keyboard()
-                    )
-                    return
-                
-                if result['success']:
-                    if not validate_download_token(download_token, user_id):
-                        await status_message.edit_text("Ошибка безопасности... Попробуйте снова!")
-                        return
-                        
-                    await status_message.edit_text("Отправляю аудио...")
-                    
-                    try:
-                        with open(result['file_path'], 'rb') as file:
-                            file_data = file.read()
-                        
-                        await update.message.reply_audio(
-                            audio=file_data,
-                            caption=f"🎵 {result['title']}",
-                            title=result['title'][:64],
-                            performer="YouTube",
-                            read_timeout=600,
-                            write_timeout=600,
-                            connect_timeout=600,
-                            pool_timeout=600
-                        )
-                        
-                        await status_message.delete()
-                        update_user_stats(user_id, username, 'audio', True)
-                        add_to_history(user_id, url, result['title'], 'audio', None, True)
-                        await update.message.reply_text(
-                            "Аудио успешно отправлено!",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                    except Exception as file_error:
-                        logger.error(f"Ошибка при отправке аудио файла: {file_error}")
-                        log_error(user_id, username, 'audio_send_error', str(file_error), url)
-                        update_user_stats(user_id, username, 'audio', False)
-                        add_to_history(user_id, url, 'Ошибка отправки', 'audio', None, False)
-                        await status_message.edit_text("Ошибка при отправке аудио...")
-                        await update.message.reply_text(
-                            "Попробуй еще раз...",
-                            reply_markup=self.get_main_keyboard()
-                        )
-                else:
-                    if result.get('error') == 'audio_too_big':
-                        log_error(user_id, username, 'audio_too_big', 'Audio file too big', url)
-                        update_user_stats(user_id, username, 'audio', False)
-                        add_to_history(user_id, url, 'Файл слишком большой', 'audio', None, False)
-                        await status_message.edit_text("Аудио файл слишком большой...")
-                    else:
-                        log_error(user_id, username, 'audio_download_error', str(result.get('error')), url)
-                        update_user_stats(user_id, username, 'audio', False)
-                        add_to_history(user_id, url, 'Ошибка конвертации', 'audio', None, False)
-                        await status_message.edit_text("Произошла ошибка при конвертации аудио...")
-                    await update.message.reply_text(
-                        "Попробуй другое видео...",
-                        reply_markup=self.get_main_keyboard()
-                    )
-                    
-        except Exception as e:
-            logger.error(f"Ошибка при обработке аудио: {e}")
-            log_error(user_id, username, 'audio_processing_error', str(e), url)
-            update_user_stats(user_id, username, 'audio', False)
-            add_to_history(user_id, url, 'Ошибка обработки', 'audio', None, False)
-            await status_message.edit_text("Произошла ошибка при обработке аудио...")
-            await update.message.reply_text(
-                "Попробуй еще раз с другим видео...",
-                reply_markup=self.get_main_keyboard()
-            )
-
-    def run(self):
-        """Запуск бота"""
-        logger.info("Бот запущен!")
-        print("Бот запущен! Нажмите Ctrl+C для остановки...")
-        print(f"Админ-панель доступна для: {ADMIN_IDS}")
-        print(f"Загружено пользователей: {len(user_stats)}")
-        print(f"Премиум пользователей: {len(premium_users)}")
-        print(f"Заблокированных: {len(blocked_users)}")
-        print(f"Статус бота: {'ВКЛЮЧЕН' if bot_enabled else 'ВЫКЛЮЧЕН'}")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
-
-if __name__ == "__main__":
-    if not BOT_TOKEN:
-        print("Токен бота не найден... Проверьте файл config.py")
-    else:
-        bot = YouTubeDownloaderBot(BOT_TOKEN)
+#Создано на Python 3
+#Telegram бот для скачивания видео и аудио с YouTube, TikTok, RUTube
+import os
+import sys
+import abc
+import socket
+import logging
+import tempfile
+import multiprocessing
+import multiprocessing.connection
+import asyncio
+import datetime
+import json
+import time
+import math
+import re
+import string
+import hashlib
+import secrets
+import collections
+import copy
+import shutil
+import subprocess
+import sqlite3
+import threading
+import contextlib
+import contextvars
+import pathlib
+from urllib.parse import urlparse, parse_qs, quote
+import httpx
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, Message, Chat
+from telegram.error import TelegramError, RetryAfter
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
+import yt_dlp
+try:
+    import psycopg2
+    import psycopg2.pool
+    import psycopg2.extras
+except ImportError:
+    psycopg2 = None
+from config import BOT_TOKEN, ADMIN_IDS, ADMIN_USERNAME, BLACKLISTED_DOMAINS, ALLOWED_EXTENSIONS
+from config import RATE_LIMITS, RATE_LIMIT_SWEEP_INTERVAL, MAX_CONCURRENT_UPDATES, HTTP_POOL_SIZE, DOWNLOAD_POOL_SIZE, WORKER_MAX_JOBS, PERSIST_INTERVAL
+from config import DELIVERY_CACHE_SIZE, SHORT_LINK_CACHE_SIZE, METADATA_CACHE_SIZE, METADATA_CACHE_TTL, METADATA_CACHE_DIR, MEDIA_CACHE_DIR, MEDIA_CACHE_SIZE
+from config import SCHEDULER_WEIGHTS, USER_MAX_ACTIVE_JOBS, QUOTA_WINDOW, STORAGE_BACKEND, SQLITE_DB_FILE, POSTGRES_DSN, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX, POSTGRES_BATCH_SIZE
+from config import TRANSCODE_ENABLED, TRANSCODE_PRESET, TRANSCODE_AUDIO_BITRATE, TRANSCODE_MIN_VIDEO_BITRATE, TRANSCODE_MAX_SOURCE_SIZE
+from config import DOWNLOAD_SPEED_ESTIMATE, TRANSCODE_SPEED_ESTIMATE
+from config import BOT_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN
+from config import JOB_JOURNAL_FILE, JOBS_DIR, JOB_RESUME_MAX_AGE, JOB_MAX_ATTEMPTS
+from config import WORKER_MODE, JOB_QUEUE_BACKEND, JOB_QUEUE_FILE, JOB_QUEUE_DSN, REMOTE_MAX_CONCURRENT_DOWNLOADS, WORKER_UPLOAD_CHAT_ID
+from config import WORKER_NODE_CONCURRENCY, WORKER_NODE_DIR, JOB_QUEUE_POLL_INTERVAL, WORKER_HEARTBEAT_INTERVAL, WORKER_LEASE_TIMEOUT
+from config import BOT_API_BASE_URL, BOT_API_BASE_FILE_URL, BOT_API_LOCAL_MODE, LOCAL_MODE_MAX_FILE_SIZE
+
+# Настройка логирования для отслеживания работы бота
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Глобальные переменные для хранения состояния бота
+active_processes = {}  # Активные процессы загрузки
+error_log = []  # Лог ошибок для диагностики
+bot_enabled = True  # Флаг включен/выключен бот
+blocked_users = set()  # Множество заблокированных пользователей
+user_stats = {}  # Статистика пользователей
+premium_users = {}  # Премиум пользователи и сроки подписки
+user_history = {}  # История загрузок пользователей
+download_tokens = {}  # Токены для безопасной загрузки
+delivery_cache = collections.OrderedDict()  # file_id уже отправленных файлов в порядке последнего использования
+delivery_cache_stats = {'hits': 0, 'misses': 0}  # Счетчики попаданий в кеш file_id
+media_cache_stats = {'hits': 0, 'misses': 0}  # Результаты загрузок, взятые из кеша файлов
+coalesce_stats = {'joined': 0, 'delivered': 0}  # Запросы, присоединившиеся к уже идущей загрузке того же видео, и получившие файл
+cancel_stats = {'cancelled': 0}  # Загрузки, отмененные пользователями
+current_job = contextvars.ContextVar('current_job', default=None)  # ID записи журнала для текущей загрузки
+update_latency = collections.deque(maxlen=1000)  # Задержка от отправки сообщения до его обработки в секундах
+download_progress = {}  # ID загрузки -> последний прогресс от процесса-загрузчика
+progress_channel = None  # В процессе-загрузчике: соединение с ботом для отправки прогресса
+upload_stats = {'uploads': 0, 'failed': 0, 'bytes': 0, 'seconds': 0.0, 'last_speed': 0.0}  # Отправка файлов в Telegram
+dirty_stores = {}  # Измененные хранилища: имя -> измененные ключи (None - хранилище целиком)
+# Приращения строк для SQL баз: имя хранилища -> {ключ строки: прирост счетчиков или новые записи истории}.
+# В общую базу нескольких процессов бота пишутся приращения, а не значения из памяти процесса
+store_deltas = {}
+flushing_changes = []  # Изменения, которые сейчас записываются в хранилище
+storage = None  # Активное хранилище данных (JSON файлы, SQLite или PostgreSQL)
+
+# Файлы для хранения данных
+BLOCKED_USERS_FILE = "blocked_users.json"
+USER_STATS_FILE = "user_stats.json"
+BOT_STATE_FILE = "bot_state.json"
+PREMIUM_USERS_FILE = "premium_users.json"
+USER_HISTORY_FILE = "user_history.json"
+USER_REQUESTS_FILE = "user_requests.json"
+QUOTA_ARCHIVE_FILE = "quota_archive.json"
+TOKENS_FILE = "download_tokens.json"
+DELIVERY_CACHE_FILE = "delivery_cache.json"
+
+# Лимиты запросов для разных типов пользователей
+REQUEST_LIMITS = {
+    'free': 5,      # Бесплатные пользователи - 5 запросов в день
+    'premium': 20,  # Премиум пользователи - 20 запросов в день  
+    'admin': 999999 # Администраторы - без ограничений
+}
+
+# Константы бота
+SUBSCRIPTION_PRICE = 200  # Цена премиум подписки
+# Максимальный размер файла в MB: своему серверу Bot API в локальном режиме файлы передаются по пути
+MAX_FILE_SIZE = LOCAL_MODE_MAX_FILE_SIZE if BOT_API_LOCAL_MODE else 50
+MAX_FILENAME_LENGTH = 100  # Максимальная длина имени файла
+MAX_URL_LENGTH = 500  # Максимальная длина URL
+MAX_HISTORY_ENTRIES = 50  # Записей в истории загрузок пользователя
+MAX_CONCURRENT_DOWNLOADS = 3  # Максимум одновременных загрузок
+PROCESS_POLL_INTERVAL = 1.0  # Интервал проверки завершения процесса загрузки в секундах
+READY_WAIT_SLICE = 0.5  # Шаг ожидания процесса в потоке пула, если цикл событий не следит за дескрипторами
+QUEUE_NOTIFY_INTERVAL = 5  # Минимальный интервал обновления позиции в очереди в секундах
+QUEUE_RECOUNT_INTERVAL = 1.0  # Минимальный интервал пересчета позиций всей очереди в секундах
+DEFAULT_JOB_DURATION = 60  # Оценка длительности загрузки в секундах, пока нет статистики
+TRANSCODE_SIZE_MARGIN = 0.92  # Доля лимита, под которую рассчитывается битрейт сжатия (запас на контейнер и колебания)
+AUDIO_MP3_BITRATE = 192  # Битрейт mp3 при извлечении аудио в кбит/с
+TRANSCODE_TIMEOUT = 900  # Таймаут загрузки и сжатия видео в секундах
+SPEED_SMOOTHING = 0.2  # Вес нового замера в скользящей оценке скорости загрузки и сжатия
+PROGRESS_SEND_INTERVAL = 1.0  # Минимальный интервал отправки прогресса из процесса-загрузчика в секундах
+PROGRESS_EDIT_INTERVAL = 3.0  # Минимальный интервал обновления статуса загрузки в одном чате в секундах
+
+# Скользящие оценки скорости для выбора между сжатием и повторной загрузкой
+media_speed = {'download': DOWNLOAD_SPEED_ESTIMATE, 'transcode': TRANSCODE_SPEED_ESTIMATE}
+FFMPEG_PATH = shutil.which('ffmpeg')
+
+def to_int_keys(data: dict) -> dict:
+    """Преобразование строковых ключей JSON обратно в числовые ID пользователей"""
+    return {int(key) if isinstance(key, str) and key.lstrip('-').isdigit() else key: value for key, value in data.items()}
+
+class JsonStorage:
+    """Хранение данных в JSON файлах (каждое хранилище перезаписывается целиком)"""
+    
+    full_snapshot = True  # Хранилищу нужны полные снимки данных, а не отдельные строки
+    
+    def load(self) -> dict:
+        """Загрузка всех данных из JSON файлов"""
+        data = {}
+        for name, (file_path, _) in STORES.items():
+            try:
+                if os.path.exists(file_path):
+                    with open(file_path, 'r') as f:
+                        data[name] = json.load(f)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки {name}: {e}")
+        
+        # JSON сохраняет числовые ключи строками - восстанавливаем ID пользователей
+        for name in ('user_stats', 'premium_users', 'user_history'):
+            if name in data:
+                data[name] = to_int_keys(data[name])
+        if 'blocked_users' in data:
+            data['blocked_users'] = set(data['blocked_users'])
+        return data
+    
+    def write(self, changes: dict) -> list:
+        """Запись измененных хранилищ, возвращает имена незаписанных"""
+        failed = []
+        for name, change in changes.items():
+            try:
+                write_file_atomic(STORES[name][0], change['full'])
+            except Exception as e:
+                logger.error(f"Ошибка сохранения {name}: {e}")
+                failed.append(name)
+        return failed
+    
+    def close(self):
+        """Закрытие хранилища"""
+        pass
+
+class SqlStorage(abc.ABC):
+    """Общая логика SQL хранилищ: загрузка и построчная запись изменений пакетами"""
+    
+    full_snapshot = False  # Изменения пишутся отдельными строками
+    placeholder = '?'  # Плейсхолдер параметров в запросах драйвера
+    SCHEMA = []  # Запросы создания таблиц, задаются в наследниках
+    
+    USER_COLUMNS = ['username', 'first_seen', 'last_activity', 'video_downloads', 'audio_downloads',
+                    'total_requests', 'successful_requests', 'failed_requests', 'user_type']
+    COUNTER_COLUMNS = ['video_downloads', 'audio_downloads', 'total_requests', 'successful_requests', 'failed_requests']
+    HISTORY_COLUMNS = ['timestamp', 'url', 'title', 'type', 'quality', 'success']
+    DELIVERY_COLUMNS = ['file_id', 'title', 'quality', 'created']
+    
+    # Таблицы, которые очищаются перед полной перезаписью хранилища
+    STORE_TABLES = {
+        'blocked_users': 'blocked_users',
+        'user_stats': 'users',
+        'bot_state': 'bot_state',
+        'premium_users': 'premium',
+        'user_history': 'history',
+        'download_tokens': 'tokens',
+        'delivery_cache': 'delivery_cache',
+        'quota_archive': 'quota_archive',
+    }
+    
+    @abc.abstractmethod
+    def transaction(self):
+        """Контекстный менеджер транзакции, возвращает курсор"""
+    
+    def sql(self, statement: str) -> str:
+        """Подстановка плейсхолдера драйвера в запрос"""
+        return statement.replace('?', self.placeholder)
+    
+    def query(self, cur, statement: str, params: tuple = ()) -> list:
+        """Выполнение запроса с получением всех строк"""
+        cur.execute(self.sql(statement), params)
+        return cur.fetchall()
+    
+    def insert_many(self, cur, table: str, columns: list, rows: list, conflict: str = ""):
+        """Пакетная вставка строк"""
+        if not rows:
+            return
+        placeholders = ', '.join('?' for _ in columns)
+        cur.executemany(
+            self.sql(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) {conflict}"),
+            rows
+        )
+    
+    def delete_many(self, cur, table: str, column: str, values: list):
+        """Пакетное удаление строк по значению столбца"""
+        if not values:
+            return
+        cur.executemany(self.sql(f"DELETE FROM {table} WHERE {column} = ?"), [(value,) for value in values])
+    
+    def init_schema(self):
+        """Создание таблиц и индексов"""
+        with self.transaction() as cur:
+            for statement in self.SCHEMA:
+                cur.execute(statement)
+    
+    def load(self) -> dict:
+        """Загрузка данных из базы (счетчики запросов - только за текущий и предыдущий день)"""
+        yesterday = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        data = {}
+        with self.transaction() as cur:
+            data['blocked_users'] = {row[0] for row in self.query(cur, "SELECT user_id FROM blocked_users")}
+            
+            data['user_stats'] = {}
+            for row in self.query(cur, f"SELECT user_id, {', '.join(self.USER_COLUMNS)} FROM users"):
+                data['user_stats'][row[0]] = dict(zip(self.USER_COLUMNS, row[1:]))
+            
+            state = dict(self.query(cur, "SELECT key, value FROM bot_state"))
+            if 'enabled' in state:
+                data['bot_state'] = {'enabled': state['enabled'] == '1'}
+            
+            data['premium_users'] = dict(self.query(cur, "SELECT user_id, expiry FROM premium"))
+            
+            data['user_history'] = {}
+            for row in self.query(cur, f"SELECT user_id, {', '.join(self.HISTORY_COLUMNS)} FROM history ORDER BY user_id, id"):
+                entry = dict(zip(self.HISTORY_COLUMNS, row[1:]))
+                entry['success'] = bool(entry['success'])
+                data['user_history'].setdefault(row[0], []).append(entry)
+            
+            data['user_requests'] = {}
+            for day, user_id, count in self.query(cur, "SELECT day, user_id, count FROM daily_quotas WHERE day >= ?", (yesterday,)):
+                data['user_requests'].setdefault(day, {})[str(user_id)] = count
+            
+            self.compact_quotas(cur, yesterday)
+            data['quota_archive'] = {}
+            for day, users, requests in self.query(cur, "SELECT day, users, requests FROM quota_archive"):
+                data['quota_archive'][day] = {'users': users, 'requests': requests}
+            
+            data['download_tokens'] = {}
+            for token, user_id, expiry in self.query(cur, "SELECT token, user_id, expiry FROM tokens"):
+                data['download_tokens'][token] = {'user_id': user_id, 'expiry': expiry}
+            
+            data['delivery_cache'] = collections.OrderedDict()
+            for row in self.query(cur, f"SELECT cache_key, {', '.join(self.DELIVERY_COLUMNS)} FROM delivery_cache ORDER BY last_used"):
+                data['delivery_cache'][row[0]] = dict(zip(self.DELIVERY_COLUMNS, row[1:]))
+        return data
+    
+    def compact_quotas(self, cur, before_day: str):
+        """Свертка построчных счетчиков запросов за старые дни в агрегаты архива"""
+        cur.execute(self.sql(
+            "INSERT INTO quota_archive (day, users, requests) "
+            "SELECT day, COUNT(*), SUM(count) FROM daily_quotas WHERE day < ? GROUP BY day "
+            "ON CONFLICT (day) DO NOTHING"
+        ), (before_day,))
+        cur.execute(self.sql("DELETE FROM daily_quotas WHERE day < ?"), (before_day,))
+    
+    def load_user(self, user_id: int, days: list) -> dict:
+        """Блокировка, срок подписки и счетчики запросов пользователя за указанные сутки"""
+        with self.transaction() as cur:
+            blocked = bool(self.query(cur, "SELECT 1 FROM blocked_users WHERE user_id = ?", (user_id,)))
+            premium = self.query(cur, "SELECT expiry FROM premium WHERE user_id = ?", (user_id,))
+            requests = {}
+            if days:
+                placeholders = ', '.join('?' for _ in days)
+                requests = dict(self.query(
+                    cur, f"SELECT day, count FROM daily_quotas WHERE user_id = ? AND day IN ({placeholders})", (user_id, *days)
+                ))
+        return {'blocked': blocked, 'premium': premium[0][0] if premium else None, 'requests': requests}
+    
+    def is_empty(self) -> bool:
+        """Проверка что в базе еще нет данных"""
+        with self.transaction() as cur:
+            row = self.query(cur, "SELECT (SELECT COUNT(*) FROM users) + (SELECT COUNT(*) FROM bot_state)")[0]
+        return row[0] == 0
+    
+    def write(self, changes: dict) -> list:
+        """Построчная запись изменений в одной транзакции, возвращает имена незаписанных"""
+        try:
+            with self.transaction() as cur:
+                for name, change in changes.items():
+                    rows = change.get('rows')
+                    if rows is None:
+                        rows = self.rows_from_snapshot(name, json.loads(change['full']))
+                        # Счетчики запросов не очищаются - в памяти только двое суток, старые сворачивает архив;
+                        # снимок заменяет счетчики своих суток, а не прибавляется к ним
+                        if name in self.STORE_TABLES:
+                            cur.execute(f"DELETE FROM {self.STORE_TABLES[name]}")
+                        elif name == 'user_requests':
+                            self.delete_many(cur, 'daily_quotas', 'day', sorted({day for day, _ in rows}))
+                    getattr(self, f"write_{name}")(cur, rows)
+            return []
+        except Exception as e:
+            logger.error(f"Ошибка сохранения в {type(self).__name__}: {e}")
+            return list(changes)
+    
+    def rows_from_snapshot(self, name: str, snapshot) -> dict:
+        """Преобразование полного снимка хранилища в набор строк"""
+        if name == 'blocked_users':
+            return {user_id: True for user_id in snapshot}
+        if name == 'bot_state':
+            return snapshot
+        if name == 'user_requests':
+            return {(day, user_id): count for day, counts in snapshot.items() for user_id, count in counts.items()}
+        if name in ('download_tokens', 'delivery_cache', 'quota_archive'):
+            return snapshot
+        return to_int_keys(snapshot)
+    
+    def write_blocked_users(self, cur, rows: dict):
+        self.insert_many(cur, 'blocked_users', ['user_id'],
+                         [(int(user_id),) for user_id, value in rows.items() if value],
+                         "ON CONFLICT DO NOTHING")
+        self.delete_many(cur, 'blocked_users', 'user_id',
+                         [int(user_id) for user_id, value in rows.items() if not value])
+    
+    def write_user_stats(self, cur, rows: dict):
+        # Счетчики приходят приращениями и прибавляются к значениям в базе; first_seen не перезаписывается
+        updates = ', '.join(f"{column} = users.{column} + excluded.{column}" if column in self.COUNTER_COLUMNS
+                            else f"{column} = excluded.{column}"
+                            for column in self.USER_COLUMNS if column != 'first_seen')
+        self.insert_many(cur, 'users', ['user_id'] + self.USER_COLUMNS,
+                         [(int(user_id), *(stats.get(column) for column in self.USER_COLUMNS))
+                          for user_id, stats in rows.items() if stats is not None],
+                         f"ON CONFLICT (user_id) DO UPDATE SET {updates}")
+    
+    def write_bot_state(self, cur, rows: dict):
+        self.insert_many(cur, 'bot_state', ['key', 'value'],
+                         [(key, '1' if value else '0') for key, value in rows.items()],
+                         "ON CONFLICT (key) DO UPDATE SET value = excluded.value")
+    
+    def write_premium_users(self, cur, rows: dict):
+        self.insert_many(cur, 'premium', ['user_id', 'expiry'],
+                         [(int(user_id), expiry) for user_id, expiry in rows.items() if expiry is not None],
+                         "ON CONFLICT (user_id) DO UPDATE SET expiry = excluded.expiry")
+        self.delete_many(cur, 'premium', 'user_id',
+                         [int(user_id) for user_id, expiry in rows.items() if expiry is None])
+    
+    def write_user_history(self, cur, rows: dict):
+        # Приходят только новые записи; старые сверх MAX_HISTORY_ENTRIES удаляются в базе
+        self.insert_many(cur, 'history', ['user_id'] + self.HISTORY_COLUMNS,
+                         [(int(user_id), *(int(entry.get(column)) if column == 'success' else entry.get(column)
+                                           for column in self.HISTORY_COLUMNS))
+                          for user_id, entries in rows.items() if entries for entry in entries])
+        cur.executemany(
+            self.sql("DELETE FROM history WHERE user_id = ? AND id NOT IN "
+                     "(SELECT id FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?)"),
+            [(int(user_id), int(user_id), MAX_HISTORY_ENTRIES) for user_id in rows]
+        )
+    
+    def write_user_requests(self, cur, rows: dict):
+        # Приходит прирост счетчика с прошлой записи - запросы всех процессов бота суммируются
+        self.insert_many(cur, 'daily_quotas', ['day', 'user_id', 'count'],
+                         [(day, int(user_id), count) for (day, user_id), count in rows.items() if count],
+                         "ON CONFLICT (day, user_id) DO UPDATE SET count = daily_quotas.count + excluded.count")
+        # Запросы, записанные после смены суток, уточняют итоги этих суток в архиве
+        cur.executemany(self.sql(
+            "UPDATE quota_archive SET "
+            "users = (SELECT COUNT(*) FROM daily_quotas WHERE daily_quotas.day = quota_archive.day), "
+            "requests = (SELECT SUM(count) FROM daily_quotas WHERE daily_quotas.day = quota_archive.day) "
+            "WHERE day = ?"
+        ), [(day,) for day in sorted({day for day, _ in rows})])
+    
+    def write_quota_archive(self, cur, rows: dict):
+        self.insert_many(cur, 'quota_archive', ['day', 'users', 'requests'],
+                         [(day, totals['users'], totals['requests']) for day, totals in rows.items() if totals is not None],
+                         "ON CONFLICT (day) DO NOTHING")
+        # Итоги суток с построчными счетчиками считаются по базе: в памяти процесса только его часть запросов
+        cur.executemany(self.sql(
+            "INSERT INTO quota_archive (day, users, requests) "
+            "SELECT day, COUNT(*), SUM(count) FROM daily_quotas WHERE day = ? GROUP BY day "
+            "ON CONFLICT (day) DO UPDATE SET users = excluded.users, requests = excluded.requests"
+        ), [(day,) for day in rows])
+        # Построчные счетчики нужны только за последние двое суток, остальное уже есть в архиве
+        if rows:
+            cur.execute(self.sql("DELETE FROM daily_quotas WHERE day < ?"), (max(rows),))
+    
+    def write_download_tokens(self, cur, rows: dict):
+        self.insert_many(cur, 'tokens', ['token', 'user_id', 'expiry'],
+                         [(token, data['user_id'], data['expiry']) for token, data in rows.items() if data is not None],
+                         "ON CONFLICT (token) DO UPDATE SET user_id = excluded.user_id, expiry = excluded.expiry")
+        self.delete_many(cur, 'tokens', 'token', [token for token, data in rows.items() if data is None])
+    
+    def write_delivery_cache(self, cur, rows: dict):
+        now = time.time()
+        updates = ', '.join(f"{column} = excluded.{column}" for column in self.DELIVERY_COLUMNS + ['last_used'])
+        self.insert_many(cur, 'delivery_cache', ['cache_key'] + self.DELIVERY_COLUMNS + ['last_used'],
+                         [(key, *(entry.get(column) for column in self.DELIVERY_COLUMNS), now)
+                          for key, entry in rows.items() if entry is not None],
+                         f"ON CONFLICT (cache_key) DO UPDATE SET {updates}")
+        self.delete_many(cur, 'delivery_cache', 'cache_key', [key for key, entry in rows.items() if entry is None])
+    
+    def close(self):
+        """Закрытие соединений с базой"""
+        pass
+
+class SqliteStorage(SqlStorage):
+    """Хранение данных в SQLite (режим WAL, построчные upsert вместо перезаписи файлов)"""
+    
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_seen TEXT,
+            last_activity TEXT,
+            video_downloads INTEGER NOT NULL DEFAULT 0,
+            audio_downloads INTEGER NOT NULL DEFAULT 0,
+            total_requests INTEGER NOT NULL DEFAULT 0,
+            successful_requests INTEGER NOT NULL DEFAULT 0,
+            failed_requests INTEGER NOT NULL DEFAULT 0,
+            user_type TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
+        """CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp TEXT,
+            url TEXT,
+            title TEXT,
+            type TEXT,
+            quality TEXT,
+            success INTEGER NOT NULL DEFAULT 1
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_history_user ON history(user_id, id)",
+        """CREATE TABLE IF NOT EXISTS daily_quotas (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS quota_archive (
+            day TEXT PRIMARY KEY,
+            users INTEGER NOT NULL,
+            requests INTEGER NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS premium (
+            user_id INTEGER PRIMARY KEY,
+            expiry REAL NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS tokens (
+            token TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            expiry REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_tokens_expiry ON tokens(expiry)",
+        "CREATE TABLE IF NOT EXISTS blocked_users (user_id INTEGER PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value TEXT)",
+        """CREATE TABLE IF NOT EXISTS delivery_cache (
+            cache_key TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            title TEXT,
+            quality TEXT,
+            created REAL,
+            last_used REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_delivery_cache_last_used ON delivery_cache(last_used)",
+    ]
+    
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        # Запись идет из пула потоков, поэтому доступ к соединению сериализуется блокировкой
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.init_schema()
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """Транзакция на общем соединении под блокировкой"""
+        with self.lock, self.conn:
+            yield self.conn.cursor()
+    
+    def close(self):
+        """Закрытие соединения с базой"""
+        with self.lock:
+            self.conn.close()
+
+class PostgresStorage(SqlStorage):
+    """Хранение данных в PostgreSQL через пул соединений (общая база для нескольких процессов бота)"""
+    
+    placeholder = '%s'
+    
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_seen TEXT,
+            last_activity TEXT,
+            video_downloads INTEGER NOT NULL DEFAULT 0,
+            audio_downloads INTEGER NOT NULL DEFAULT 0,
+            total_requests INTEGER NOT NULL DEFAULT 0,
+            successful_requests INTEGER NOT NULL DEFAULT 0,
+            failed_requests INTEGER NOT NULL DEFAULT 0,
+            user_type TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
+        """CREATE TABLE IF NOT EXISTS history (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            timestamp TEXT,
+            url TEXT,
+            title TEXT,
+            type TEXT,
+            quality TEXT,
+            success INTEGER NOT NULL DEFAULT 1
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_history_user ON history(user_id, id)",
+        """CREATE TABLE IF NOT EXISTS daily_quotas (
+            day TEXT NOT NULL,
+            user_id BIGINT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS quota_archive (
+            day TEXT PRIMARY KEY,
+            users INTEGER NOT NULL,
+            requests INTEGER NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS premium (
+            user_id BIGINT PRIMARY KEY,
+            expiry DOUBLE PRECISION NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS tokens (
+            token TEXT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            expiry DOUBLE PRECISION NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_tokens_expiry ON tokens(expiry)",
+        "CREATE TABLE IF NOT EXISTS blocked_users (user_id BIGINT PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value TEXT)",
+        """CREATE TABLE IF NOT EXISTS delivery_cache (
+            cache_key TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            title TEXT,
+            quality TEXT,
+            created DOUBLE PRECISION,
+            last_used DOUBLE PRECISION
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_delivery_cache_last_used ON delivery_cache(last_used)",
+    ]
+    
+    def __init__(self, dsn: str, min_connections: int, max_connections: int):
+        if psycopg2 is None:
+            raise RuntimeError("Для STORAGE_BACKEND = 'postgres' нужен пакет psycopg2-binary")
+        self.pool = psycopg2.pool.ThreadedConnectionPool(min_connections, max_connections, dsn)
+        self.init_schema()
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """Транзакция на соединении из пула"""
+        conn = self.pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    yield cur
+        finally:
+            self.pool.putconn(conn)
+    
+    def insert_many(self, cur, table: str, columns: list, rows: list, conflict: str = ""):
+        """Пакетная вставка строк одним запросом на страницу"""
+        if not rows:
+            return
+        psycopg2.extras.execute_values(
+            cur,
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s {conflict}",
+            rows,
+            page_size=POSTGRES_BATCH_SIZE
+        )
+    
+    def delete_many(self, cur, table: str, column: str, values: list):
+        """Пакетное удаление строк одним запросом"""
+        if not values:
+            return
+        cur.execute(f"DELETE FROM {table} WHERE {column} = ANY(%s)", (values,))
+    
+    def close(self):
+        """Закрытие всех соединений пула"""
+        self.pool.closeall()
+
+def create_storage():
+    """Создание хранилища данных согласно настройке STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'postgres':
+        return PostgresStorage(POSTGRES_DSN, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX)
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteStorage(SQLITE_DB_FILE)
+    return JsonStorage()
+
+def migrate_json_to_storage(target) -> bool:
+    """Одноразовый перенос данных из JSON файлов в пустую базу данных"""
+    if not target.is_empty():
+        return False
+    if not any(os.path.exists(file_path) for file_path, _ in STORES.values()):
+        return False
+    
+    data = JsonStorage().load()
+    changes = {name: {'full': json.dumps(list(value) if name == 'blocked_users' else value)}
+               for name, value in data.items()}
+    failed = target.write(changes)
+    if failed:
+        logger.error(f"Не удалось перенести из JSON: {failed}")
+        return False
+    logger.info(f"Данные перенесены из JSON файлов: {', '.join(changes)}")
+    return True
+
+def load_data():
+    """Загрузка всех данных бота из хранилища при запуске"""
+    global storage, blocked_users, user_stats, bot_enabled, premium_users, user_history, download_tokens, delivery_cache
+    
+    if storage is None:
+        storage = create_storage()
+        if not storage.full_snapshot:
+            try:
+                migrate_json_to_storage(storage)
+            except Exception as e:
+                logger.error(f"Ошибка переноса данных из JSON: {e}")
+    
+    data = storage.load()
+    
+    blocked_users = data.get('blocked_users', blocked_users)
+    user_stats = data.get('user_stats', user_stats)
+    bot_enabled = data.get('bot_state', {}).get('enabled', bot_enabled)
+    user_history = data.get('user_history', user_history)
+    quota_store.load(data.get('user_requests', {}), data.get('quota_archive', {}))
+    download_tokens = data.get('download_tokens', download_tokens)
+    delivery_cache = collections.OrderedDict(data.get('delivery_cache', delivery_cache))
+    
+    # Загружаем только премиум подписки, срок которых не истек
+    now = datetime.datetime.now().timestamp()
+    premium_users = {user_id: expiry for user_id, expiry in data.get('premium_users', {}).items() if now < expiry}
+
+# Файл и функция получения данных для каждого хранилища
+STORES = {
+    'blocked_users': (BLOCKED_USERS_FILE, lambda: list(blocked_users)),
+    'user_stats': (USER_STATS_FILE, lambda: user_stats),
+    'bot_state': (BOT_STATE_FILE, lambda: {'enabled': bot_enabled}),
+    'premium_users': (PREMIUM_USERS_FILE, lambda: premium_users),
+    'user_history': (USER_HISTORY_FILE, lambda: user_history),
+    'user_requests': (USER_REQUESTS_FILE, lambda: quota_store.snapshot()),
+    'quota_archive': (QUOTA_ARCHIVE_FILE, lambda: quota_store.archive),
+    'download_tokens': (TOKENS_FILE, lambda: download_tokens),
+    'delivery_cache': (DELIVERY_CACHE_FILE, lambda: delivery_cache),
+}
+
+def get_store_value(name: str, key):
+    """Текущее значение строки хранилища (None - строка удалена)"""
+    if name == 'blocked_users':
+        return True if key in blocked_users else None
+    if name == 'bot_state':
+        return bot_enabled
+    value = STORES[name][1]().get(key)
+    return copy.deepcopy(value)
+
+def mark_dirty(name: str, key=None):
+    """Пометка хранилища (или отдельной строки) как измененного"""
+    if key is None:
+        dirty_stores[name] = None
+    elif name not in dirty_stores:
+        dirty_stores[name] = {key}
+    elif dirty_stores[name] is not None:
+        dirty_stores[name].add(key)
+
+def add_delta(name: str, key, delta):
+    """Учет приращения строки: число, словарь счетчиков или список новых записей"""
+    deltas = store_deltas.setdefault(name, {})
+    current = deltas.get(key)
+    if current is None:
+        deltas[key] = list(delta) if isinstance(delta, list) else dict(delta) if isinstance(delta, dict) else delta
+    elif isinstance(delta, list):
+        current.extend(delta)
+    elif isinstance(delta, dict):
+        for column, value in delta.items():
+            current[column] = current.get(column, 0) + value
+    else:
+        deltas[key] = current + delta
+    mark_dirty(name, key)
+
+def unsaved_delta(name: str, key) -> int:
+    """Приращение счетчика, еще не записанное в хранилище (включая записываемое сейчас)"""
+    total = store_deltas.get(name, {}).get(key, 0)
+    for changes in flushing_changes:
+        total += changes.get(name, {}).get('deltas', {}).get(key, 0)
+    return total
+
+def is_unsaved(name: str, key) -> bool:
+    """Есть ли у строки изменения, еще не записанные в хранилище"""
+    if name in dirty_stores and (dirty_stores[name] is None or key in dirty_stores[name]):
+        return True
+    return any(name in changes and ('full' in changes[name] or key in changes[name]['rows'])
+               for changes in flushing_changes)
+
+def write_file_atomic(file_path: str, content: str):
+    """Атомарная запись файла: запись во временный файл и переименование"""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def delta_rows(name: str, keys: set, deltas: dict) -> dict:
+    """Строки хранилища с приращениями: счетчики статистики - приростом, история и запросы - только новым"""
+    if name == 'user_stats':
+        rows = {}
+        for key in keys:
+            stats = get_store_value(name, key)
+            if stats is not None:
+                counts = deltas.get(key, {})
+                rows[key] = dict(stats, **{column: counts.get(column, 0) for column in SqlStorage.COUNTER_COLUMNS})
+        return rows
+    return {key: deltas[key] for key in keys if key in deltas}
+
+def collect_changes() -> dict:
+    """Сбор изменений для записи: полные снимки или отдельные строки в зависимости от хранилища"""
+    changes = {}
+    all_deltas = dict(store_deltas)
+    store_deltas.clear()
+    for name, keys in list(dirty_stores.items()):
+        try:
+            if keys is None or storage.full_snapshot:
+                changes[name] = {'full': json.dumps(STORES[name][1]())}
+            elif name in ('user_stats', 'user_history', 'user_requests'):
+                deltas = all_deltas.get(name, {})
+                changes[name] = {'rows': delta_rows(name, keys, deltas), 'deltas': deltas}
+            else:
+                changes[name] = {'rows': {key: get_store_value(name, key) for key in keys}}
+        except Exception as e:
+            logger.error(f"Ошибка сериализации {name}: {e}")
+    dirty_stores.clear()
+    return changes
+
+def restore_changes(changes: dict, failed: list):
+    """Возврат незаписанных изменений: строки снова помечаются измененными, приращения не теряются"""
+    for name in failed:
+        change = changes[name]
+        if 'rows' not in change:
+            mark_dirty(name)
+            continue
+        for key in change['rows']:
+            mark_dirty(name, key)
+        for key, delta in change.get('deltas', {}).items():
+            add_delta(name, key, delta)
+
+def flush_data():
+    """Синхронное сохранение всех измененных данных (при остановке бота)"""
+    if storage is None:
+        return
+    changes = collect_changes()
+    restore_changes(changes, storage.write(changes))
+
+async def flush_data_async():
+    """Сохранение измененных данных: сбор изменений в цикле событий, запись в пуле потоков"""
+    changes = collect_changes()
+    if not changes:
+        return
+    loop = asyncio.get_running_loop()
+    flushing_changes.append(changes)
+    try:
+        failed = await loop.run_in_executor(None, storage.write, changes)
+    finally:
+        flushing_changes.remove(changes)
+    restore_changes(changes, failed)
+
+def save_blocked_users(user_id: int = None):
+    """Сохранение списка заблокированных пользователей"""
+    mark_dirty('blocked_users', user_id)
+
+def save_user_stats(user_id: int = None, counts: dict = None):
+    """Сохранение статистики пользователей (counts - прирост счетчиков пользователя)"""
+    if counts:
+        add_delta('user_stats', user_id, counts)
+    else:
+        mark_dirty('user_stats', user_id)
+
+def save_bot_state():
+    """Сохранение состояния бота"""
+    mark_dirty('bot_state')
+
+def save_premium_users(user_id: int = None):
+    """Сохранение списка премиум пользователей"""
+    mark_dirty('premium_users', user_id)
+
+def save_user_history(user_id: int = None, entry: dict = None):
+    """Сохранение истории загрузок пользователей (entry - новая запись пользователя)"""
+    if entry is not None:
+        add_delta('user_history', user_id, [entry])
+    else:
+        mark_dirty('user_history', user_id)
+
+def save_user_requests(day: str = None, user_id: int = None):
+    """Сохранение счетчиков запросов пользователей (с day - один новый запрос пользователя)"""
+    if day:
+        add_delta('user_requests', (day, str(user_id)), 1)
+    else:
+        mark_dirty('user_requests')
+
+def save_quota_archive(day: str = None):
+    """Сохранение агрегатов запросов за прошедшие дни"""
+    mark_dirty('quota_archive', day)
+
+def save_tokens(token: str = None):
+    """Сохранение токенов для загрузки"""
+    mark_dirty('download_tokens', token)
+
+def save_delivery_cache(key: str = None):
+    """Сохранение кеша file_id отправленных файлов"""
+    mark_dirty('delivery_cache', key)
+
+# Домены платформ (вместе с поддоменами) -> платформа
+PLATFORM_HOSTS = {
+    'youtube.com': 'youtube', 'youtu.be': 'youtube', 'youtube-nocookie.com': 'youtube',
+    'tiktok.com': 'tiktok',
+    'rutube.ru': 'rutube',
+}
+# Короткие ссылки, ID видео в которых можно узнать только по перенаправлению
+SHORT_LINK_HOSTS = {'vm.tiktok.com', 'vt.tiktok.com'}
+VIDEO_ID_PATTERNS = {
+    'youtube': re.compile(r'^/(?:shorts|embed|live|v|e)/([A-Za-z0-9_-]{11})(?:[/?#]|$)'),
+    'tiktok': re.compile(r'^/(?:@[^/]+/video|v|embed(?:/v2)?|video)/(\d+)'),
+    'rutube': re.compile(r'^/(?:video|shorts|play/embed)/([0-9a-f]{32})(?:[/?#]|$)'),
+}
+RUTUBE_PRIVATE_RE = re.compile(r'^/video/private/([0-9a-f]{32})(?:/|$)')
+YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+CANONICAL_URLS = {
+    'youtube': 'https://www.youtube.com/watch?v={}',
+    'tiktok': 'https://www.tiktok.com/@/video/{}',
+    'rutube': 'https://rutube.ru/video/{}/',
+}
+short_link_cache = collections.OrderedDict()  # Короткая ссылка -> ссылка после перенаправлений
+
+def split_host(url: str) -> tuple:
+    """Разбор ссылки: хост в нижнем регистре без порта и результат urlparse"""
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or '').rstrip('.')
+    return host, parsed
+
+def is_short_link(url: str) -> bool:
+    """Ссылка, которую нужно раскрыть перенаправлением, чтобы узнать ID видео"""
+    try:
+        host, parsed = split_host(url)
+    except ValueError:
+        return False
+    return host in SHORT_LINK_HOSTS or (host in ('tiktok.com', 'www.tiktok.com') and parsed.path.startswith('/t/'))
+
+def normalize_url(url: str) -> tuple:
+    """Платформа и ID видео по ссылке без обращения к сети, (None, None) если формат неизвестен"""
+    try:
+        host, parsed = split_host(url)
+    except ValueError:
+        return None, None
+    platform, _ = lookup_domain(host)
+    if platform is None:
+        return None, None
+    
+    path = parsed.path
+    if host == 'youtu.be':
+        video_id = path.strip('/').split('/')[0]
+        return (platform, video_id) if YOUTUBE_ID_RE.match(video_id) else (None, None)
+    if platform == 'youtube' and path in ('/watch', '/watch/'):
+        # Параметр v может стоять где угодно среди меток отслеживания
+        for param in parsed.query.split('&'):
+            if param.startswith('v=') and YOUTUBE_ID_RE.match(param[2:]):
+                return platform, param[2:]
+        return None, None
+    if platform == 'rutube':
+        # Закрытое видео открывается только по ключу доступа p: путь и ключ входят в ID видео
+        match = RUTUBE_PRIVATE_RE.match(path)
+        if match:
+            access_key = parse_qs(parsed.query).get('p', [''])[0]
+            return platform, f"private/{match.group(1)}/" + (f"?p={quote(access_key, safe='')}" if access_key else "")
+    
+    match = VIDEO_ID_PATTERNS[platform].match(path)
+    if match:
+        return platform, match.group(1)
+    return None, None
+
+def canonical_url(url: str) -> str:
+    """Единая ссылка на видео без меток отслеживания (исходная ссылка, если формат неизвестен)"""
+    url = short_link_cache.get(url, url)
+    platform, video_id = normalize_url(url)
+    if platform is None:
+        return url.strip()
+    if platform == 'rutube' and video_id.startswith('private/'):
+        return f"https://rutube.ru/video/{video_id}"
+    return CANONICAL_URLS[platform].format(video_id)
+
+def remember_short_link(short_url: str, resolved_url: str):
+    """Запоминание раскрытой короткой ссылки с вытеснением самых старых записей"""
+    short_link_cache[short_url] = resolved_url
+    short_link_cache.move_to_end(short_url)
+    while len(short_link_cache) > SHORT_LINK_CACHE_SIZE:
+        short_link_cache.popitem(last=False)
+
+def get_video_key(url: str) -> str:
+    """Ключ видео по ссылке: платформа и ID видео для известных форматов ссылок, иначе сама ссылка"""
+    platform, video_id = normalize_url(short_link_cache.get(url, url))
+    if platform is None:
+        return url.split('#')[0].strip().lower()
+    return f"{platform}:{video_id}"
+
+def get_delivery_key(url: str, download_type: str, quality: str = None) -> str:
+    """Ключ кеша file_id: видео, тип загрузки и запрошенное качество"""
+    return f"{get_video_key(url)}|{download_type}|{quality or 'auto'}"
+
+def get_cached_delivery(url: str, download_type: str, quality: str = None, count_hit: bool = True) -> dict:
+    """Поиск ранее отправленного файла в кеше file_id (count_hit - учитывать поиск в статистике кеша)"""
+    key = get_delivery_key(url, download_type, quality)
+    entry = delivery_cache.get(key)
+    if entry is None:
+        if count_hit:
+            delivery_cache_stats['misses'] += 1
+        return None
+    
+    if count_hit:
+        delivery_cache_stats['hits'] += 1
+    delivery_cache.move_to_end(key)
+    save_delivery_cache(key)
+    return entry
+
+def store_delivery(url: str, download_type: str, quality: str, file_id: str, title: str, sent_quality: str = None):
+    """Сохранение file_id отправленного файла для повторных запросов"""
+    key = get_delivery_key(url, download_type, quality)
+    delivery_cache[key] = {
+        'file_id': file_id,
+        'title': title,
+        'quality': sent_quality,
+        'created': time.time()
+    }
+    delivery_cache.move_to_end(key)
+    save_delivery_cache(key)
+    
+    # Вытесняем давно не использовавшиеся записи
+    while len(delivery_cache) > DELIVERY_CACHE_SIZE:
+        old_key, _ = delivery_cache.popitem(last=False)
+        save_delivery_cache(old_key)
+
+def drop_delivery(url: str, download_type: str, quality: str = None):
+    """Удаление записи из кеша file_id (например, если file_id перестал работать)"""
+    key = get_delivery_key(url, download_type, quality)
+    if delivery_cache.pop(key, None) is not None:
+        save_delivery_cache(key)
+
+def get_user_type(user_id: int) -> str:
+    """Определение типа пользователя по ID"""
+    if user_id in ADMIN_IDS:
+        return 'admin'
+    elif user_id in premium_users:
+        return 'premium'
+    else:
+        return 'free'
+
+class QuotaStore:
+    """Дневные счетчики запросов: в памяти только текущие и предыдущие сутки, прошлые дни - агрегатами"""
+    
+    def __init__(self, rolling: bool):
+        self.rolling = rolling  # Скользящие 24 часа вместо календарных суток
+        self.day = None  # Текущие сутки (YYYY-MM-DD)
+        self.counts = {}  # ID пользователя (строкой) -> запросов за текущие сутки
+        self.total = 0  # Сумма counts, чтобы смена суток и статистика не требовали обхода
+        self.prev_day = None
+        self.prev_counts = {}  # Счетчики предыдущих суток (для скользящего окна)
+        self.window_start = 0.0
+        self.window_end = 0.0  # Полночь, после которой начинаются новые сутки
+        self.archive = {}  # Сутки -> {'users': пользователей, 'requests': запросов}
+    
+    def start_window(self, now: float):
+        """Границы суток, в которые попадает момент now (по местному времени)"""
+        start = datetime.datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.day = start.strftime("%Y-%m-%d")
+        self.window_start = start.timestamp()
+        self.window_end = (start + datetime.timedelta(days=1)).timestamp()
+    
+    def roll(self, now: float):
+        """Смена суток: текущие счетчики становятся предыдущими, итоги уходят в архив"""
+        if now < self.window_end:
+            return
+        finished_day, finished_counts, finished_end = self.day, self.counts, self.window_end
+        if finished_day is not None:
+            self.archive[finished_day] = {'users': len(finished_counts), 'requests': self.total}
+            save_quota_archive(finished_day)
+        
+        self.start_window(now)
+        # Если сутки пропущены целиком (бот не работал), предыдущих счетчиков нет
+        consecutive = finished_day is not None and self.window_start == finished_end
+        self.prev_day, self.prev_counts = (finished_day, finished_counts) if consecutive else (None, {})
+        self.counts = {}
+        self.total = 0
+    
+    def used(self, user_id: int) -> float:
+        """Использованные запросы в текущем окне; скользящее окно оценивается по доле предыдущих суток"""
+        now = time.time()
+        self.roll(now)
+        used = self.counts.get(str(user_id), 0)
+        if self.rolling and self.prev_counts:
+            previous = self.prev_counts.get(str(user_id), 0)
+            if previous:
+                used += previous * (self.window_end - now) / (self.window_end - self.window_start)
+        return used
+    
+    def increment(self, user_id: int):
+        """Учет одного запроса пользователя"""
+        self.roll(time.time())
+        key = str(user_id)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.total += 1
+        save_user_requests(self.day, user_id)
+    
+    def apply(self, user_id: int, stored: dict):
+        """Счетчики пользователя из общей базы плюс запросы этого процесса, еще не записанные в нее"""
+        self.roll(time.time())
+        key = str(user_id)
+        for day, counts in ((self.day, self.counts), (self.prev_day, self.prev_counts)):
+            if day is None:
+                continue
+            count = stored.get(day, 0) + unsaved_delta('user_requests', (day, key))
+            previous = counts.pop(key, 0)
+            if count:
+                counts[key] = count
+            if counts is self.counts:
+                self.total += count - previous
+    
+    def snapshot(self) -> dict:
+        """Построчные счетчики для сохранения: сутки -> {ID пользователя: запросов}"""
+        data = {self.day: self.counts}
+        if self.prev_day is not None:
+            data[self.prev_day] = self.prev_counts
+        return data
+    
+    def load(self, days: dict, archive: dict):
+        """Восстановление счетчиков при запуске; более старые сутки сворачиваются в архив"""
+        self.archive = dict(archive)
+        self.start_window(time.time())
+        self.prev_day = (datetime.datetime.fromtimestamp(self.window_start) - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        self.counts = dict(days.get(self.day, {}))
+        self.total = sum(self.counts.values())
+        self.prev_counts = dict(days.get(self.prev_day, {}))
+        
+        # Итоги всех завершившихся суток (включая вчерашние, закончившиеся до запуска) попадают в архив
+        for day, counts in days.items():
+            if day < self.day and day not in self.archive:
+                self.archive[day] = {'users': len(counts), 'requests': sum(counts.values())}
+                save_quota_archive(day)
+        if any(day < self.prev_day for day in days):
+            # Старые сутки больше не хранятся построчно - файл счетчиков перезаписывается без них
+            save_user_requests()
+
+quota_store = QuotaStore(QUOTA_WINDOW == 'rolling')
+
+def apply_user_state(user_id: int, state: dict):
+    """Блокировка, подписка и счетчики пользователя из общей базы других процессов бота"""
+    # Строки с еще не записанными изменениями этого процесса не перезаписываются
+    if not is_unsaved('blocked_users', user_id):
+        if state['blocked']:
+            blocked_users.add(user_id)
+        else:
+            blocked_users.discard(user_id)
+    if not is_unsaved('premium_users', user_id):
+        if state['premium'] is not None and time.time() < state['premium']:
+            premium_users[user_id] = state['premium']
+        else:
+            premium_users.pop(user_id, None)
+    quota_store.apply(user_id, state['requests'])
+
+def can_make_request(user_id: int) -> bool:
+    """Проверка может ли пользователь сделать запрос (не превышен лимит)"""
+    user_type = get_user_type(user_id)
+    if user_type == 'admin':
+        return True
+    # Округление как в get_remaining_requests: доля вчерашних запросов скользящего окна считается целым запросом
+    return math.ceil(quota_store.used(user_id)) < REQUEST_LIMITS[user_type]
+
+def increment_request_count(user_id: int):
+    """Увеличение счетчика запросов пользователя"""
+    quota_store.increment(user_id)
+
+def get_remaining_requests(user_id: int) -> int:
+    """Получение количества оставшихся запросов пользователя"""
+    user_type = get_user_type(user_id)
+    if user_type == 'admin':
+        return 999999
+    return max(0, REQUEST_LIMITS[user_type] - math.ceil(quota_store.used(user_id)))
+
+def add_to_history(user_id: int, url: str, title: str, download_type: str, quality: str = None, success: bool = True):
+    """Добавление записи в историю загрузок пользователя"""
+    if user_id not in user_history:
+        user_history[user_id] = []
+    
+    history_entry = {
+        'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'url': url,
+        'title': title,
+        'type': download_type,
+        'quality': quality,
+        'success': success
+    }
+    
+    # Добавляем запись и ограничиваем историю последними загрузками
+    user_history[user_id].append(history_entry)
+    if len(user_history[user_id]) > MAX_HISTORY_ENTRIES:
+        user_history[user_id].pop(0)
+    
+    save_user_history(user_id, history_entry)
+
+def update_user_stats(user_id: int, username: str, action: str, success: bool = True):
+    """Обновление статистики пользователя"""
+    if user_id not in user_stats:
+        user_stats[user_id] = {
+            'username': username,
+            'first_seen': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'last_activity': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'video_downloads': 0,
+            'audio_downloads': 0,
+            'total_requests': 0,
+            'successful_requests': 0,
+            'failed_requests': 0,
+            'user_type': get_user_type(user_id)
+        }
+    else:
+        user_stats[user_id]['username'] = username
+    
+    # Обновляем время последней активности и тип пользователя
+    user_stats[user_id]['last_activity'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    user_stats[user_id]['user_type'] = get_user_type(user_id)
+    
+    # Обновляем счетчики в зависимости от успешности операции
+    counts = {'total_requests': 1}
+    if success:
+        counts['successful_requests'] = 1
+        if action in ('video', 'audio'):
+            counts[f"{action}_downloads"] = 1
+    else:
+        counts['failed_requests'] = 1
+    for column, value in counts.items():
+        user_stats[user_id][column] += value
+    
+    save_user_stats(user_id, counts)
+
+def log_error(user_id: int, username: str, error_type: str, error_message: str, url: str = ""):
+    """Логирование ошибок для последующего анализа"""
+    error_entry = {
+        'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'user_id': user_id,
+        'username': username,
+        'error_type': error_type,
+        'error_message': error_message,
+        'url': url
+    }
+    error_log.append(error_entry)
+    # Ограничиваем лог 100 последними ошибками
+    if len(error_log) > 100:
+        error_log.pop(0)
+
+def is_safe_filename(filename: str) -> bool:
+    """Проверка безопасности имени файла"""
+    if len(filename) > MAX_FILENAME_LENGTH:
+        return False
+    dangerous_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|', '..']
+    return all(char not in filename for char in dangerous_chars)
+
+# Результат проверки ссылки: valid, платформа и причина отказа
+UrlCheck = collections.namedtuple('UrlCheck', ['valid', 'platform', 'reason'])
+BLOCKED_DOMAIN = ''  # Отметка домена из черного списка в таблице доменов
+# Домен -> платформа или BLOCKED_DOMAIN; совпадение по точному домену или его поддомену
+DOMAIN_RULES = {**PLATFORM_HOSTS, **{domain.lower(): BLOCKED_DOMAIN for domain in BLACKLISTED_DOMAINS}}
+# Ищется по ссылке в нижнем регистре: с IGNORECASE поиск по альтернативам в несколько раз медленнее
+SUSPICIOUS_URL_RE = re.compile(r'javascript:|data:|vbscript:|</?script>|onload=|onerror=|onclick=|%3c/?script%3e')
+
+def lookup_domain(host: str) -> tuple:
+    """Платформа хоста и признак черного списка по всем суффиксам хоста (a.b.c -> c, b.c, a.b.c)"""
+    platform = None
+    index = len(host)
+    while index > 0:
+        index = host.rfind('.', 0, index)
+        rule = DOMAIN_RULES.get(host[index + 1:])
+        if rule == BLOCKED_DOMAIN:
+            return None, True
+        if rule:
+            platform = rule
+    return platform, False
+
+def validate_url(url: str) -> UrlCheck:
+    """Проверка ссылки за один разбор: схема, хост, черный список, платформа и подозрительные паттерны"""
+    if len(url) > MAX_URL_LENGTH:
+        return UrlCheck(False, None, 'too_long')
+    try:
+        parsed = urlparse(url.strip())
+        host = (parsed.hostname or '').rstrip('.')
+    except ValueError:
+        return UrlCheck(False, None, 'invalid')
+    if parsed.scheme not in ('http', 'https') or not host:
+        return UrlCheck(False, None, 'invalid')
+    
+    platform, blocked = lookup_domain(host)
+    if blocked:
+        return UrlCheck(False, None, 'blacklisted')
+    if platform is None:
+        return UrlCheck(False, None, 'unsupported')
+    if SUSPICIOUS_URL_RE.search(url.lower()):
+        return UrlCheck(False, platform, 'suspicious')
+    return UrlCheck(True, platform, None)
+
+def sanitize_filename(filename: str) -> str:
+    """Очистка имени файла от опасных символов"""
+    valid_chars = f"-_.() {string.ascii_letters}{string.digits}"
+    sanitized = ''.join(c for c in filename if c in valid_chars)
+    return sanitized[:MAX_FILENAME_LENGTH]
+
+class RateLimiter:
+    """Ограничение частоты сообщений: ведро токенов на пользователя, хранящее одно число"""
+    
+    def __init__(self, limits: dict, sweep_interval: float):
+        self.limits = limits  # Тип пользователя -> сообщений в минуту (0 - без ограничений)
+        self.sweep_interval = sweep_interval
+        # ID пользователя -> момент, когда ведро снова станет полным (GCRA);
+        # пользователи с полным ведром не хранятся
+        self.full_at = {}
+        self.last_sweep = time.monotonic()
+        self.rejected = 0
+    
+    def allow(self, user_id: int, user_type: str) -> bool:
+        """Проверка и расход одного токена за O(1)"""
+        limit = self.limits.get(user_type, 0)
+        if not limit:
+            return True
+        now = time.monotonic()
+        if now - self.last_sweep >= self.sweep_interval:
+            self.sweep(now)
+        
+        # Ведро вмещает limit токенов и пополняется на один токен каждые 60 / limit секунд
+        interval = 60 / limit
+        full_at = max(self.full_at.get(user_id, now), now)
+        if full_at + interval - now > limit * interval:
+            self.rejected += 1
+            return False
+        self.full_at[user_id] = full_at + interval
+        return True
+    
+    def sweep(self, now: float = None):
+        """Удаление пользователей, чье ведро уже пополнилось (для них нет отличий от нового пользователя)"""
+        now = time.monotonic() if now is None else now
+        self.full_at = {user_id: full_at for user_id, full_at in self.full_at.items() if full_at > now}
+        self.last_sweep = now
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_SWEEP_INTERVAL)
+
+def check_rate_limit(user_id: int) -> bool:
+    """Проверка ограничения частоты запросов пользователя"""
+    return rate_limiter.allow(user_id, get_user_type(user_id))
+
+def generate_download_token(user_id: int) -> str:
+    """Генерация токена для безопасной загрузки"""
+    token = secrets.token_urlsafe(32)
+    expiry = datetime.datetime.now() + datetime.timedelta(minutes=10)
+    download_tokens[token] = {
+        'user_id': user_id,
+        'expiry': expiry.timestamp()
+    }
+    save_tokens(token)
+    return token
+
+def validate_download_token(token: str, user_id: int) -> bool:
+    """Валидация токена загрузки"""
+    if token not in download_tokens:
+        return False
+    
+    token_data = download_tokens[token]
+    if token_data['user_id'] != user_id:
+        return False
+    
+    # Проверяем не истек ли токен
+    if datetime.datetime.now().timestamp() > token_data['expiry']:
+        del download_tokens[token]
+        save_tokens(token)
+        return False
+    
+    # Удаляем использованный токен
+    del download_tokens[token]
+    save_tokens(token)
+    return True
+
+def calculate_file_hash(file_path: str) -> str:
+    """Вычисление хеша файла для проверки целостности"""
+    try:
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(4096), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    except Exception as e:
+        logger.error(f"Ошибка вычисления хеша файла: {e}")
+        return ""
+
+def validate_file_extension(file_path: str) -> bool:
+    """Проверка разрешенного расширения файла"""
+    _, ext = os.path.splitext(file_path)
+    return ext.lower() in ALLOWED_EXTENSIONS
+
+def clean_temp_files():
+    """Очистка временных файлов"""
+    try:
+        # Файлы загрузок из журнала и кеш файлов не трогаем, даже если они лежат во временном каталоге
+        keep = {os.path.abspath(path) for path in (JOBS_DIR, MEDIA_CACHE_DIR) if path}
+        for root, dirs, files in os.walk(tempfile.gettempdir()):
+            dirs[:] = [name for name in dirs if os.path.abspath(os.path.join(root, name)) not in keep]
+            for file in files:
+                if file.startswith('tmp') or file.endswith(('.mp4', '.mp3', '.webm', '.mkv')):
+                    try:
+                        file_path = os.path.join(root, file)
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
+                    except:
+                        continue
+    except Exception as e:
+        logger.error(f"Ошибка очистки временных файлов: {e}")
+
+class MetadataCache:
+    """Кеш метаданных видео с TTL и вытеснением давно не использовавшихся записей (опционально на диске)"""
+    
+    def __init__(self, max_entries: int, ttl: float, cache_dir: str = ""):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.entries = collections.OrderedDict()  # ключ -> (время истечения, метаданные)
+        self.lock = threading.Lock()  # Кеш используется из пула потоков
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.purge_disk()
+    
+    def disk_path(self, key: str) -> str:
+        """Путь к файлу записи на диске"""
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+    
+    def get(self, key: str) -> dict:
+        """Получение метаданных из кеша (None - нет или истекли)"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+        
+        info = self.get_from_disk(key, now)
+        with self.lock:
+            if info is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return info
+    
+    def get_from_disk(self, key: str, now: float) -> dict:
+        """Чтение записи с диска с подъемом в память"""
+        if not self.cache_dir:
+            return None
+        path = self.disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if entry.get('key') != key or entry.get('expires', 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        
+        self.store_in_memory(key, entry['expires'], entry['info'])
+        return entry['info']
+    
+    def put(self, key: str, info: dict):
+        """Сохранение метаданных в кеш"""
+        expires = time.time() + self.ttl
+        self.store_in_memory(key, expires, info)
+        if self.cache_dir:
+            try:
+                write_file_atomic(self.disk_path(key), json.dumps({'key': key, 'expires': expires, 'info': info}))
+            except Exception as e:
+                logger.error(f"Ошибка записи метаданных на диск: {e}")
+    
+    def store_in_memory(self, key: str, expires: float, info: dict):
+        """Сохранение записи в памяти с вытеснением старых"""
+        with self.lock:
+            self.entries[key] = (expires, info)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def purge_disk(self):
+        """Удаление истекших записей с диска"""
+        now = time.time()
+        for file in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, file)
+            try:
+                if os.path.getmtime(path) + self.ttl < now:
+                    os.remove(path)
+            except OSError:
+                continue
+
+metadata_cache = MetadataCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL, METADATA_CACHE_DIR)
+
+class MediaCache:
+    """Кеш скачанных файлов на диске по (экстрактор, id видео, формат) с вытеснением давно не использованных по бюджету размера.
+    Общий для процессов пула: состояние хранится только в файловой системе, время использования - в mtime"""
+    
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+    
+    def make_key(self, info: dict, variant: str) -> str:
+        """Ключ записи (None - кеширование невозможно)"""
+        if not self.cache_dir or not info or not variant:
+            return None
+        extractor = info.get('extractor_key') or info.get('extractor')
+        video_id = info.get('id')
+        if not extractor or not video_id:
+            return None
+        return hashlib.sha256(f"{extractor}:{video_id}:{variant}".encode()).hexdigest()
+    
+    def entry_path(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}{ext}")
+    
+    def fetch(self, key: str, ext: str, target: str) -> bool:
+        """Копия файла из кеша в target (жесткая ссылка, если возможно); False - файла в кеше нет"""
+        if not key:
+            return False
+        path = self.entry_path(key, ext)
+        try:
+            try:
+                # Ссылка переживает вытеснение записи, пока файл отправляется
+                os.link(path, target)
+            except FileNotFoundError:
+                return False
+            except OSError:
+                shutil.copyfile(path, target)
+            os.utime(path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(target)
+            return False
+        return True
+    
+    def store(self, key: str, ext: str, source: str):
+        """Атомарная публикация готового файла в кеше"""
+        if not key:
+            return
+        path = self.entry_path(key, ext)
+        # Недописанный файл лежит под временным именем и не виден при поиске
+        temp_path = f"{path}.tmp-{os.getpid()}-{secrets.token_hex(4)}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(source, temp_path)
+            except OSError:
+                shutil.copyfile(source, temp_path)
+            # yt-dlp ставит файлу mtime из Last-Modified - для вытеснения нужно время публикации
+            os.utime(temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить файл в кеш: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            return
+        self.evict()
+    
+    def scan(self) -> list:
+        """Записи кеша: (время использования, размер, путь)"""
+        entries = []
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return entries
+        for root, dirs, files in os.walk(self.cache_dir):
+            for file in files:
+                if '.tmp-' in file:
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+    
+    def evict(self):
+        """Удаление давно не использованных файлов, пока кеш не уложится в бюджет"""
+        entries = self.scan()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+    
+    def cleanup_partial(self):
+        """Удаление недописанных файлов, оставшихся после аварийной остановки (только при запуске бота)"""
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+        for root, dirs, files in os.walk(self.cache_dir):
+            for file in files:
+                if '.tmp-' in file:
+                    with contextlib.suppress(OSError):
+                        os.remove(os.path.join(root, file))
+        self.evict()
+    
+    def usage(self) -> tuple:
+        """Количество файлов и занятый объем в байтах"""
+        entries = self.scan()
+        return len(entries), sum(size for _, size, _ in entries)
+
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_SIZE * 1024 * 1024)
+
+def fetch_video_metadata(url: str) -> dict:
+    """Извлечение метаданных видео без загрузки (форматы, длительность, название)"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+        }
+    }
+    
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        # Убираем служебные поля, чтобы по метаданным можно было повторно выбрать формат и скачать
+        return ydl.sanitize_info(info, remove_private_keys=True)
+
+def get_video_metadata(url: str) -> dict:
+    """Метаданные видео из кеша или одним извлечением с сохранением в кеш"""
+    key = get_video_key(url)
+    info = metadata_cache.get(key)
+    if info is None:
+        info = fetch_video_metadata(url)
+        metadata_cache.put(key, info)
+    return info
+
+def get_video_info(url: str) -> dict:
+    """Получение информации о видео без загрузки"""
+    try:
+        info = get_video_metadata(url)
+        
+        # Форматирование длительности видео
+        duration_seconds = int(info.get('duration') or 0)
+        hours = duration_seconds // 3600
+        minutes = (duration_seconds % 3600) // 60
+        seconds = duration_seconds % 60
+        
+        if hours > 0:
+            duration_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+        else:
+            duration_str = f"{minutes:02d}:{seconds:02d}"
+        
+        return {
+            'success': True,
+            'title': info.get('title', 'Неизвестно'),
+            'author': info.get('uploader', 'Неизвестно'),
+            'duration': duration_str,
+            'views': info.get('view_count', 0),
+            'upload_date': info.get('upload_date', 'Неизвестно'),
+            'description': info.get('description', '')[:200] + '...' if info.get('description') else 'Нет описания',
+            'thumbnail': info.get('thumbnail', '')
+        }
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def extract_with_metadata(ydl, url: str, info: dict = None) -> dict:
+    """Загрузка по готовым метаданным без повторного извлечения (или полное извлечение по ссылке)"""
+    if info:
+        return ydl.process_ie_result(copy.deepcopy(info), download=True)
+    return ydl.extract_info(url, download=True)
+
+QUALITY_LADDER = ['1080', '720', '480', '360', '240']
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.webm')
+
+def send_progress(progress: dict):
+    """Отправка прогресса задачи боту из процесса-загрузчика"""
+    if progress_channel is None:
+        return
+    try:
+        progress_channel.send(('progress', progress))
+    except (OSError, ValueError):
+        pass
+
+class ProgressReporter:
+    """Progress-hook, пересылающий байты, скорость и ETA боту не чаще раза в PROGRESS_SEND_INTERVAL"""
+    
+    def __init__(self):
+        self.sent_at = 0.0
+        self.parent_pid = os.getppid()
+    
+    def __call__(self, status: dict):
+        if os.getppid() != self.parent_pid:
+            # Бот упал - докачивать будет перезапущенный бот, эта загрузка не должна писать в тот же файл
+            raise BotStopped()
+        if status.get('status') == 'finished':
+            send_progress({'stage': 'processing'})
+            return
+        if status.get('status') != 'downloading':
+            return
+        now = time.monotonic()
+        if now - self.sent_at < PROGRESS_SEND_INTERVAL:
+            return
+        self.sent_at = now
+        send_progress({
+            'stage': 'downloading',
+            'downloaded': status.get('downloaded_bytes') or 0,
+            'total': status.get('total_bytes') or status.get('total_bytes_estimate'),
+            'speed': status.get('speed'),
+            'eta': status.get('eta')
+        })
+
+def format_progress(progress: dict) -> str:
+    """Строка прогресса загрузки для статусного сообщения"""
+    if progress.get('stage') == 'processing':
+        return "Обработка файла..."
+    if progress.get('stage') == 'encoding':
+        return "Сжатие видео..."
+    
+    downloaded = progress.get('downloaded', 0) / (1024 * 1024)
+    total = progress.get('total')
+    if total:
+        parts = [f"Загружено {downloaded:.1f} из {total / (1024 * 1024):.1f} MB ({min(downloaded * 1024 * 1024 / total, 1) * 100:.0f}%)"]
+    else:
+        parts = [f"Загружено {downloaded:.1f} MB"]
+    if progress.get('speed'):
+        parts.append(f"{progress['speed'] / (1024 * 1024):.1f} MB/s")
+    if progress.get('eta') is not None:
+        parts.append(f"осталось ~{int(progress['eta'])} сек")
+    return ", ".join(parts)
+
+class DownloadSizeExceeded(yt_dlp.utils.DownloadCancelled):
+    """Загрузка прервана: файл превысил лимит размера"""
+    msg = 'Файл превысил допустимый размер'
+
+class BotStopped(yt_dlp.utils.DownloadCancelled):
+    """Загрузка прервана: процесс бота, запустивший загрузчик, завершился"""
+    msg = 'Процесс бота завершился'
+
+class DownloadSizeGuard:
+    """Progress-hook, прерывающий загрузку, как только счетчик байт превысил лимит"""
+    
+    def __init__(self, max_bytes: int, audio_only: bool = False):
+        self.max_bytes = max_bytes
+        self.audio_only = audio_only  # Ограничивать только загрузку аудиодорожки без видео
+        self.downloaded = 0
+        self.exceeded = False
+    
+    def __call__(self, status: dict):
+        if status.get('status') != 'downloading':
+            return
+        if self.audio_only and status.get('info_dict', {}).get('vcodec') != 'none':
+            return
+        # total_bytes известен заранее не всегда - для потоков без размера смотрим на счетчик
+        self.downloaded = status.get('downloaded_bytes') or 0
+        total = status.get('total_bytes') or 0
+        if self.downloaded > self.max_bytes or total > self.max_bytes:
+            self.exceeded = True
+            raise DownloadSizeExceeded()
+
+class DownloadLogger:
+    """Логгер yt-dlp, замечающий отказ от загрузки по max_filesize (yt-dlp сообщает об этом только в лог)"""
+    
+    def __init__(self):
+        self.too_big = False
+    
+    def debug(self, message: str):
+        if 'larger than max-filesize' in message:
+            self.too_big = True
+    
+    def info(self, message: str):
+        pass
+    
+    def warning(self, message: str):
+        logger.debug(f"yt-dlp: {message}")
+    
+    def error(self, message: str):
+        logger.warning(f"yt-dlp: {message}")
+
+def remove_partial_files(temp_dir: str, prefix: str):
+    """Удаление недокачанных файлов загрузки (включая .part)"""
+    for file in os.listdir(temp_dir):
+        if file.startswith(f'{prefix}.'):
+            try:
+                os.remove(os.path.join(temp_dir, file))
+            except OSError:
+                pass
+
+def estimate_format_size(fmt: dict, duration) -> float:
+    """Оценка размера формата в байтах: filesize, filesize_approx или битрейт на длительность (None - неизвестно)"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return float(size)
+    tbr = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if tbr and duration:
+        # tbr в Кбит/с
+        return tbr * 1000 / 8 * duration
+    return None
+
+def rank_video_formats(info: dict, max_height: int) -> list:
+    """Форматы с видео и звуком не выше max_height, от лучшего к худшему, с оценкой размера"""
+    duration = info.get('duration')
+    # Одиночное видео без списка форматов описывается самим info
+    formats = info.get('formats') or [info]
+    ranked = []
+    for index, fmt in enumerate(formats):
+        height = fmt.get('height')
+        if not height or height > max_height:
+            continue
+        if fmt.get('vcodec') == 'none' or fmt.get('acodec') == 'none':
+            continue
+        if f".{fmt.get('ext')}" not in VIDEO_EXTENSIONS:
+            continue
+        # yt-dlp отдает форматы от худшего к лучшему - индекс разрешает ничьи по высоте
+        ranked.append((height, index, fmt, estimate_format_size(fmt, duration)))
+    ranked.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [(fmt, estimate) for _, _, fmt, estimate in ranked]
+
+def select_video_formats(info: dict, max_height: int) -> list:
+    """Кандидаты на загрузку: форматы, которые по оценке укладываются в лимит (неизвестный размер - проверяется загрузкой)"""
+    max_bytes = MAX_FILE_SIZE * 1024 * 1024
+    return [(fmt, estimate) for fmt, estimate in rank_video_formats(info, max_height)
+            if estimate is None or estimate <= max_bytes]
+
+def download_video_format(url: str, info: dict, fmt: dict, temp_dir: str, max_size: float = None,
+                          keep_partial: bool = False, resume: bool = False) -> dict:
+    """Однократная загрузка выбранного формата с проверкой файла и лимита размера (в MB).
+    keep_partial оставляет прерванную по лимиту загрузку на диске, resume продолжает ее"""
+    max_size = max_size or MAX_FILE_SIZE
+    # Имя зависит от формата: недокачанный файл с тем же именем (после прерывания по лимиту
+    # или перезапуска бота) - тот же формат, и yt-dlp продолжает его, а не качает заново
+    prefix = f"video_{fmt.get('height')}p_{re.sub(r'[^A-Za-z0-9_-]', '_', str(fmt.get('format_id')))}"
+    max_bytes = max_size * 1024 * 1024
+    size_guard = DownloadSizeGuard(max_bytes)
+    size_logger = DownloadLogger()
+    ydl_opts = {
+        'format': fmt.get('format_id') or 'best',
+        'outtmpl': os.path.join(temp_dir, f'{prefix}.%(ext)s'),
+        # Файл с известным Content-Length сверх лимита даже не начинает качаться
+        'max_filesize': max_bytes,
+        'progress_hooks': [ProgressReporter(), size_guard],
+        'logger': size_logger,
+        'quiet': True,
+        'noprogress': True,
+        'no_warnings': False,
+        'ignoreerrors': True,
+        'nooverwrites': True,
+        'noplaylist': True,
+        'restrictfilenames': True,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+        }
+    }
+    
+    cache_key = media_cache.make_key(info, fmt.get('format_id'))
+    cache_ext = f".{fmt.get('ext')}"
+    from_cache = not resume and media_cache.fetch(cache_key, cache_ext, os.path.join(temp_dir, f'{prefix}{cache_ext}'))
+    
+    started_at = time.monotonic()
+    if from_cache:
+        downloaded = info
+    else:
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                downloaded = extract_with_metadata(ydl, url, info)
+        except DownloadSizeExceeded:
+            if keep_partial:
+                return {'success': False, 'error': 'file_too_big',
+                        'partial_format': fmt.get('format_id'), 'partial_bytes': size_guard.downloaded}
+            remove_partial_files(temp_dir, prefix)
+            return {'success': False, 'error': 'file_too_big'}
+        if size_logger.too_big:
+            return {'success': False, 'error': 'file_too_big'}
+    # Взятый из кеша файл не должен искажать оценку скорости загрузки
+    download_time = 0.0 if from_cache else time.monotonic() - started_at
+    if not downloaded:
+        return {'success': False, 'error': 'no_video_info'}
+    video_title = sanitize_filename(downloaded.get('title', 'video'))
+    
+    for file in os.listdir(temp_dir):
+        if not (is_safe_filename(file) and file.startswith(f'{prefix}.') and file.endswith(VIDEO_EXTENSIONS)):
+            continue
+        media_file = os.path.join(temp_dir, file)
+        
+        if not validate_file_extension(media_file):
+            os.remove(media_file)
+            continue
+            
+        file_hash = calculate_file_hash(media_file)
+        if not file_hash:
+            os.remove(media_file)
+            continue
+            
+        file_size = os.path.getsize(media_file) / (1024 * 1024)
+        
+        if file_size <= max_size:
+            # В кеш попадают только файлы, которые можно отправить (исходники для сжатия - нет)
+            if not from_cache and file_size <= MAX_FILE_SIZE:
+                media_cache.store(cache_key, cache_ext, media_file)
+            return {
+                'success': True,
+                'file_path': media_file,
+                'title': video_title,
+                'quality': f"{fmt.get('height')}p",
+                'file_size': file_size,
+                'quality_reduced': False,
+                'file_hash': file_hash,
+                'download_time': download_time,
+                'from_cache': from_cache
+            }
+        os.remove(media_file)
+        return {'success': False, 'error': 'file_too_big'}
+    
+    return {'success': False, 'error': 'no_video_info'}
+
+def download_first_fitting(url: str, info: dict, candidates: list, temp_dir: str) -> dict:
+    """Загрузка лучшего кандидата; следующий пробуется, только если оценка размера не оправдалась"""
+    for fmt, estimate in candidates:
+        try:
+            result = download_video_format(url, info, fmt, temp_dir)
+        except yt_dlp.utils.DownloadCancelled:
+            # Бот остановлен - следующий кандидат начинать нельзя
+            raise
+        except Exception:
+            continue
+        if result['success']:
+            return result
+    return {'success': False, 'error': 'no_suitable_quality'}
+
+def download_video_worker(url: str, quality: str, temp_dir: str, info: dict = None) -> dict:
+    """Воркер для загрузки видео в отдельном процессе"""
+    try:
+        if not info:
+            info = fetch_video_metadata(url)
+        
+        if not quality:
+            # Автоматический подбор качества - лучший формат, укладывающийся в лимит, качается один раз
+            return download_first_fitting(url, info, select_video_formats(info, int(QUALITY_LADDER[0])), temp_dir)
+        
+        # Загрузка с конкретным качеством - только лучшая доступная высота не выше запрошенной
+        ranked = rank_video_formats(info, int(quality))
+        if not ranked:
+            return {'success': False, 'error': 'no_video_info'}
+        best_height = ranked[0][0]['height']
+        candidates = [(fmt, estimate) for fmt, estimate in select_video_formats(info, best_height)
+                      if fmt['height'] == best_height]
+        
+        # Если по оценке ни один формат не влезает, сразу переходим к пониженному качеству без загрузки
+        if not candidates:
+            return {'success': False, 'error': 'file_too_big'}
+        
+        too_big = None
+        for fmt, estimate in candidates:
+            try:
+                result = download_video_format(url, info, fmt, temp_dir, keep_partial=True)
+            except yt_dlp.utils.DownloadCancelled:
+                raise
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            if result['success']:
+                return result
+            if result['error'] == 'file_too_big' and too_big is None:
+                too_big = result
+        # Прерванная загрузка остается на диске - сжатие продолжит ее, а не начнет заново;
+        # остальные ошибки (сеть, извлечение) не выдаются за превышение размера
+        return too_big or result
+            
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def download_video_reduced_quality_worker(url: str, original_quality: str, temp_dir: str, info: dict = None) -> dict:
+    """Воркер для загрузки видео с пониженным качеством"""
+    try:
+        # Определяем, с какого качества начинать подбор
+        if original_quality in QUALITY_LADDER:
+            lower_qualities = QUALITY_LADDER[QUALITY_LADDER.index(original_quality) + 1:]
+        else:
+            lower_qualities = QUALITY_LADDER
+        if not lower_qualities:
+            return {'success': False, 'error': 'no_suitable_quality'}
+        
+        if not info:
+            info = fetch_video_metadata(url)
+        
+        result = download_first_fitting(url, info, select_video_formats(info, int(lower_qualities[0])), temp_dir)
+        if result['success']:
+            result.update({
+                'quality_reduced': True,
+                'original_quality': f"{original_quality}p",
+                'reduced_quality': result['quality']
+            })
+        return result
+        
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def compute_transcode_bitrate(duration) -> int:
+    """Битрейт видео (Кбит/с), при котором сжатый файл уложится в лимит (None - сжатие не имеет смысла)"""
+    if not duration:
+        return None
+    total_kbps = MAX_FILE_SIZE * 1024 * 1024 * 8 * TRANSCODE_SIZE_MARGIN / duration / 1000
+    video_kbps = int(total_kbps - TRANSCODE_AUDIO_BITRATE)
+    if video_kbps < TRANSCODE_MIN_VIDEO_BITRATE:
+        return None
+    return video_kbps
+
+def transcode_video_worker(url: str, quality: str, temp_dir: str, info: dict = None, resume_format: str = None) -> dict:
+    """Воркер для сжатия видео до лимита размера: одна загрузка исходника и перекодирование через ffmpeg"""
+    try:
+        if not FFMPEG_PATH:
+            return {'success': False, 'error': 'ffmpeg_not_found'}
+        if not info:
+            info = fetch_video_metadata(url)
+        
+        video_kbps = compute_transcode_bitrate(info.get('duration'))
+        if not video_kbps:
+            return {'success': False, 'error': 'transcode_not_viable'}
+        
+        ranked = rank_video_formats(info, int(quality))
+        if not ranked:
+            return {'success': False, 'error': 'no_video_info'}
+        fmt = ranked[0][0]
+        
+        output_file = os.path.join(temp_dir, f"compressed_{fmt['height']}p.mp4")
+        cache_key = media_cache.make_key(info, f"{fmt.get('format_id')}-x264-{video_kbps}k")
+        from_cache = media_cache.fetch(cache_key, '.mp4', output_file)
+        source = {'title': sanitize_filename(info.get('title', 'video')), 'download_time': 0.0, 'file_size': None}
+        encode_time = 0.0
+        
+        if not from_cache:
+            source = download_video_format(url, info, fmt, temp_dir, max_size=TRANSCODE_MAX_SOURCE_SIZE,
+                                           resume=fmt.get('format_id') == resume_format)
+            if not source['success']:
+                return source
+            
+            command = [
+                FFMPEG_PATH, '-y', '-hide_banner', '-loglevel', 'error',
+                '-i', source['file_path'],
+                '-c:v', 'libx264', '-preset', TRANSCODE_PRESET,
+                '-b:v', f'{video_kbps}k', '-maxrate', f'{video_kbps}k', '-bufsize', f'{video_kbps * 2}k',
+                '-c:a', 'aac', '-b:a', f'{TRANSCODE_AUDIO_BITRATE}k',
+                '-movflags', '+faststart',
+                output_file
+            ]
+            send_progress({'stage': 'encoding'})
+            started_at = time.monotonic()
+            try:
+                completed = subprocess.run(command, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+            finally:
+                os.remove(source['file_path'])
+            encode_time = time.monotonic() - started_at
+            
+            if completed.returncode != 0 or not os.path.exists(output_file):
+                return {'success': False, 'error': 'transcode_failed'}
+        
+        file_hash = calculate_file_hash(output_file)
+        if not file_hash:
+            os.remove(output_file)
+            return {'success': False, 'error': 'transcode_failed'}
+        
+        file_size = os.path.getsize(output_file) / (1024 * 1024)
+        if file_size > MAX_FILE_SIZE:
+            os.remove(output_file)
+            return {'success': False, 'error': 'file_too_big'}
+        
+        if not from_cache:
+            media_cache.store(cache_key, '.mp4', output_file)
+        
+        return {
+            'success': True,
+            'file_path': output_file,
+            'title': source['title'],
+            'quality': f"{fmt['height']}p",
+            'file_size': file_size,
+            'quality_reduced': True,
+            'transcoded': True,
+            'original_quality': f"{quality}p",
+            'reduced_quality': f"{fmt['height']}p (сжато)",
+            'file_hash': file_hash,
+            'download_time': source['download_time'],
+            'source_size': source['file_size'],
+            'encode_time': encode_time,
+            'duration': info.get('duration'),
+            'from_cache': from_cache
+        }
+        
+    except subprocess.TimeoutExpired:
+        return {'success': False, 'error': 'timeout'}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def record_media_speed(result: dict):
+    """Уточнение оценок скорости загрузки и сжатия по результату воркера"""
+    if not result.get('success'):
+        return
+    download_time = result.get('download_time')
+    if download_time and download_time > 0:
+        size = result.get('source_size') or result['file_size']
+        media_speed['download'] += SPEED_SMOOTHING * (size / download_time - media_speed['download'])
+    encode_time = result.get('encode_time')
+    if encode_time and encode_time > 0 and result.get('duration'):
+        media_speed['transcode'] += SPEED_SMOOTHING * (result['duration'] / encode_time - media_speed['transcode'])
+
+def choose_size_reduction(info: dict, quality: str, failed: dict) -> str:
+    """Выбор способа уложиться в лимит: 'transcode' (сжать исходник) или 'redownload' (скачать качество ниже) - что быстрее"""
+    if not TRANSCODE_ENABLED or not FFMPEG_PATH or not info:
+        return 'redownload'
+    duration = info.get('duration')
+    if not compute_transcode_bitrate(duration):
+        return 'redownload'
+    
+    ranked = rank_video_formats(info, int(quality))
+    source_size = ranked[0][1] if ranked else None
+    if not source_size or source_size > TRANSCODE_MAX_SOURCE_SIZE * 1024 * 1024:
+        return 'redownload'
+    
+    # Уже скачанная до прерывания часть исходника не качается повторно
+    if failed.get('partial_format') == ranked[0][0].get('format_id'):
+        source_size = max(source_size - (failed.get('partial_bytes') or 0), 0)
+    
+    download_speed = media_speed['download'] * 1024 * 1024
+    transcode_time = source_size / download_speed + duration / media_speed['transcode']
+    
+    lower_qualities = QUALITY_LADDER[QUALITY_LADDER.index(quality) + 1:] if quality in QUALITY_LADDER else QUALITY_LADDER
+    candidates = select_video_formats(info, int(lower_qualities[0])) if lower_qualities else []
+    if not candidates:
+        # Ниже качества нет - остается только сжатие
+        return 'transcode'
+    lower_size = candidates[0][1]
+    if lower_size is None:
+        return 'redownload'
+    redownload_time = lower_size / download_speed
+    
+    return 'transcode' if transcode_time < redownload_time else 'redownload'
+
+def download_audio_worker(url: str, temp_dir: str, info: dict = None) -> dict:
+    """Воркер для конвертации видео в аудио"""
+    try:
+        max_bytes = MAX_FILE_SIZE * 1024 * 1024
+        # mp3 постоянного битрейта: его размер известен по длительности еще до загрузки
+        duration = (info or {}).get('duration')
+        if duration and duration * AUDIO_MP3_BITRATE * 1000 / 8 > max_bytes:
+            return {'success': False, 'error': 'audio_too_big'}
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
+            # Аудиодорожку сверх лимита прерываем сразу: у площадок она не выше 160 кбит/с, и mp3 будет не меньше.
+            # Видео без отдельной дорожки (TikTok, HLS RuTube) может быть больше лимита - проверяется итоговый mp3
+            'progress_hooks': [ProgressReporter(), DownloadSizeGuard(max_bytes, audio_only=True)],
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': str(AUDIO_MP3_BITRATE),
+            }],
+            'quiet': True,
+            'noprogress': True,
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+                'Accept-Language': 'en-US,en;q=0.5',
+                'Accept-Encoding': 'gzip, deflate',
+                'DNT': '1',
+                'Connection': 'keep-alive',
+                'Upgrade-Insecure-Requests': '1',
+            }
+        }
+        
+        # Ключ включает параметры конвертации: другой битрейт - другой файл
+        cache_key = media_cache.make_key(info, f'mp3-{AUDIO_MP3_BITRATE}')
+        from_cache = media_cache.fetch(cache_key, '.mp3', os.path.join(temp_dir, 'audio.mp3'))
+        if from_cache:
+            video_title = info.get('title', 'audio')
+        else:
+            try:
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    downloaded = extract_with_metadata(ydl, url, info)
+                    video_title = downloaded.get('title', 'audio')
+            except DownloadSizeExceeded:
+                remove_partial_files(temp_dir, 'audio')
+                return {'success': False, 'error': 'audio_too_big'}
+        safe_title = "".join(c for c in video_title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+            
+        for file in os.listdir(temp_dir):
+            if file.endswith('.mp3'):
+                media_file = os.path.join(temp_dir, file)
+                
+                if not validate_file_extension(media_file):
+                    os.remove(media_file)
+                    continue
+                    
+                file_hash = calculate_file_hash(media_file)
+                if not file_hash:
+                    os.remove(media_file)
+                    continue
+                    
+                file_size = os.path.getsize(media_file) / (1024 * 1024)
+                
+                if file_size <= MAX_FILE_SIZE:
+                    if not from_cache:
+                        media_cache.store(cache_key, '.mp3', media_file)
+                    return {
+                        'success': True,
+                        'file_path': media_file,
+                        'title': safe_title,
+                        'file_size': file_size,
+                        'file_hash': file_hash,
+                        'from_cache': from_cache
+                    }
+                else:
+                    os.remove(media_file)
+        
+        return {'success': False, 'error': 'audio_too_big'}
+        
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+# Воркеры, которые узел-загрузчик выполняет по имени из задачи общей очереди
+WORKER_FUNCTIONS = {func.__name__: func for func in (
+    download_video_worker, download_video_reduced_quality_worker, transcode_video_worker, download_audio_worker
+)}
+
+def find_user_by_username(username: str) -> list:
+    """Поиск пользователей по username"""
+    found_users = []
+    username_lower = username.lower().replace('@', '').strip()
+    
+    if not username_lower:
+        return found_users
+    
+    # Поиск по всем пользователям в статистике
+    for user_id, stats in user_stats.items():
+        current_username = stats.get('username', '')
+        if not current_username or current_username == 'Unknown':
+            continue
+            
+        current_username_lower = current_username.lower().replace('@', '')
+        
+        if username_lower == current_username_lower or username_lower in current_username_lower:
+            found_users.append({
+                'user_id': user_id,
+                'username': current_username,
+                'stats': stats
+            })
+    
+    return found_users
+
+def download_pool_worker(conn):
+    """Основной цикл постоянного процесса-загрузчика: получает задачи и возвращает результаты"""
+    global progress_channel
+    # Прогресс идет по тому же соединению, что и результат: ('progress', данные) до ('result', данные)
+    progress_channel = conn
+    parent_pid = os.getppid()
+    while True:
+        try:
+            # Копии соединений бота унаследованы при fork, поэтому падение бота не закрывает канал -
+            # осиротевший процесс замечает это по смене родителя
+            if not conn.poll(PROCESS_POLL_INTERVAL):
+                if os.getppid() != parent_pid:
+                    break
+                continue
+            task = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            break
+        
+        # None - сигнал к завершению процесса
+        if task is None:
+            break
+        
+        worker_func, args, kwargs = task
+        try:
+            result = worker_func(*args, **kwargs)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        
+        try:
+            conn.send(('result', result))
+        except (OSError, ValueError):
+            break
+
+async def wait_for_process(process: multiprocessing.Process, timeout: float) -> bool:
+    """Ожидание завершения процесса без блокировки цикла событий"""
+    return bool(await wait_for_ready([process.sentinel], timeout))
+
+async def wait_for_ready(objects: list, timeout: float) -> list:
+    """Ожидание готовности соединений или sentinel процессов без блокировки цикла событий"""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    
+    def on_ready():
+        if not ready.done():
+            ready.set_result(None)
+    
+    # Дескрипторы отслеживает сам цикл событий: идущая загрузка не занимает поток пула,
+    # общего с метаданными, сохранением данных и очередью задач
+    descriptors = []
+    try:
+        for obj in objects:
+            descriptor = obj if isinstance(obj, int) else obj.fileno()
+            loop.add_reader(descriptor, on_ready)
+            descriptors.append(descriptor)
+        await asyncio.wait_for(ready, timeout)
+    except NotImplementedError:
+        # Цикл событий без add_reader (Proactor в Windows) - ждем в пуле потоков
+        return await wait_for_ready_in_executor(objects, timeout)
+    except asyncio.TimeoutError:
+        return []
+    finally:
+        for descriptor in descriptors:
+            loop.remove_reader(descriptor)
+    return multiprocessing.connection.wait(objects, 0)
+
+async def wait_for_ready_in_executor(objects: list, timeout: float) -> list:
+    """Ожидание готовности в пуле потоков короткими отрезками, чтобы отмена не держала поток до таймаута"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = max(0.0, deadline - loop.time())
+        ready = await loop.run_in_executor(None, multiprocessing.connection.wait, objects, min(READY_WAIT_SLICE, remaining))
+        if ready or remaining <= READY_WAIT_SLICE:
+            return ready
+
+async def stop_process(process: multiprocessing.Process):
+    """Принудительная остановка процесса без блокировки цикла событий"""
+    if not process.is_alive():
+        return
+    
+    process.terminate()
+    if not await wait_for_process(process, 5):
+        process.kill()
+        await wait_for_process(process, 5)
+    process.join(0)
+
+class DownloadWorkerPool:
+    """Пул постоянных процессов для загрузок с перезапуском процессов после N задач"""
+    
+    def __init__(self, size: int, max_jobs_per_worker: int):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.idle_workers = None  # Очередь свободных процессов, создается в цикле событий
+        self.workers = []  # Все запущенные процессы пула
+        self.recycled = 0  # Количество перезапущенных процессов
+    
+    def spawn_worker(self) -> dict:
+        """Запуск нового процесса-загрузчика"""
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=download_pool_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        worker = {'process': process, 'conn': parent_conn, 'jobs': 0}
+        self.workers.append(worker)
+        return worker
+    
+    async def start(self):
+        """Запуск всех процессов пула"""
+        loop = asyncio.get_running_loop()
+        self.idle_workers = asyncio.Queue()
+        for _ in range(self.size):
+            worker = await loop.run_in_executor(None, self.spawn_worker)
+            self.idle_workers.put_nowait(worker)
+        logger.info(f"Пул загрузчиков запущен: {self.size} процессов")
+    
+    async def stop(self):
+        """Остановка всех процессов пула"""
+        for worker in list(self.workers):
+            try:
+                worker['conn'].send(None)
+            except (OSError, ValueError):
+                pass
+        
+        for worker in list(self.workers):
+            if not await wait_for_process(worker['process'], 5):
+                await stop_process(worker['process'])
+            worker['conn'].close()
+        self.workers.clear()
+    
+    async def replace_worker(self, worker: dict):
+        """Остановка процесса и запуск замены для него"""
+        await stop_process(worker['process'])
+        worker['conn'].close()
+        if worker in self.workers:
+            self.workers.remove(worker)
+        self.recycled += 1
+        
+        loop = asyncio.get_running_loop()
+        new_worker = await loop.run_in_executor(None, self.spawn_worker)
+        self.idle_workers.put_nowait(new_worker)
+    
+    async def submit(self, worker_func, *args, timeout: float = 600, download_id: str = None, on_progress=None, **kwargs) -> dict:
+        """Выполнение задачи в свободном процессе пула с жестким таймаутом (on_progress получает прогресс задачи)"""
+        worker = await self.idle_workers.get()
+        healthy = False
+        try:
+            if not worker['process'].is_alive():
+                return {'success': False, 'error': 'worker_died'}
+            
+            worker['conn'].send((worker_func, args, kwargs))
+            worker['jobs'] += 1
+            if download_id:
+                active_processes[download_id] = worker['process']
+            
+            deadline = asyncio.get_running_loop().time() + timeout
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                ready = await wait_for_ready([worker['conn'], worker['process'].sentinel], remaining) if remaining > 0 else []
+                if not ready:
+                    return {'success': False, 'error': 'timeout'}
+                
+                if worker['conn'] not in ready and not worker['conn'].poll():
+                    return {'success': False, 'error': 'worker_died'}
+                
+                try:
+                    kind, payload = worker['conn'].recv()
+                except (EOFError, TypeError, ValueError):
+                    return {'success': False, 'error': 'worker_died'}
+                
+                if kind == 'progress':
+                    if on_progress is not None:
+                        on_progress(payload)
+                    continue
+                
+                healthy = True
+                if isinstance(payload, dict) and 'success' in payload:
+                    return payload
+                return {'success': False, 'error': 'unknown_error'}
+        finally:
+            if download_id in active_processes:
+                del active_processes[download_id]
+            
+            # Процесс возвращается в пул только после успешного обмена;
+            # при таймауте, отмене или падении процесс убивается и заменяется
+            if healthy and worker['jobs'] < self.max_jobs_per_worker:
+                self.idle_workers.put_nowait(worker)
+            else:
+                await asyncio.shield(self.replace_worker(worker))
+
+class JobQueue(abc.ABC):
+    """Общая очередь задач узлов-загрузчиков: бот ставит задачи и забирает результат, узлы выполняют задачи"""
+    
+    placeholder = '?'  # Плейсхолдер параметров в запросах драйвера
+    claim_lock = ''  # Блокировка строки при захвате задачи, задается в наследниках
+    SCHEMA = []  # Запросы создания таблиц, задаются в наследниках
+    
+    TASK_COLUMNS = ['task_id', 'func', 'args', 'workdir', 'media_type', 'timeout', 'attempts']
+    FINISHED_STATES = ('done', 'failed', 'cancelled')
+    
+    @abc.abstractmethod
+    def transaction(self):
+        """Контекстный менеджер транзакции, возвращает курсор"""
+    
+    def sql(self, statement: str) -> str:
+        """Подстановка плейсхолдера драйвера в запрос"""
+        return statement.replace('?', self.placeholder)
+    
+    def execute(self, statement: str, params: tuple = ()) -> tuple:
+        """Выполнение запроса в отдельной транзакции: строки результата и количество измененных строк"""
+        with self.transaction() as cur:
+            cur.execute(self.sql(statement), params)
+            rows = cur.fetchall() if cur.description else []
+            return rows, cur.rowcount
+    
+    def init_schema(self):
+        """Создание таблицы задач"""
+        with self.transaction() as cur:
+            for statement in self.SCHEMA:
+                cur.execute(statement)
+    
+    def push(self, task_id: str, func_name: str, args: tuple, kwargs: dict, workdir: str, media_type: str, timeout: float):
+        """Постановка задачи; задача с тем же ID, которая еще выполняется или уже готова, не перезапускается
+        (после перезапуска бот получает ее результат вместо повторной загрузки)"""
+        now = time.time()
+        self.execute(
+            "INSERT INTO worker_tasks (task_id, state, func, args, workdir, media_type, timeout, created, updated) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (task_id) DO UPDATE SET state = 'queued', func = excluded.func, args = excluded.args, "
+            "workdir = excluded.workdir, media_type = excluded.media_type, timeout = excluded.timeout, node = NULL, "
+            "attempts = 0, progress = NULL, result = NULL, created = excluded.created, updated = excluded.updated "
+            "WHERE worker_tasks.state IN ('failed', 'cancelled')",
+            (task_id, func_name, json.dumps({'args': args, 'kwargs': kwargs}, default=str), workdir, media_type, timeout, now, now)
+        )
+    
+    def claim(self, node: str) -> dict:
+        """Захват самой старой задачи из очереди узлом; None - очередь пуста"""
+        now = time.time()
+        rows, _ = self.execute(
+            "UPDATE worker_tasks SET state = 'running', node = ?, attempts = attempts + 1, heartbeat = ?, updated = ? "
+            "WHERE task_id = (SELECT task_id FROM worker_tasks WHERE state = 'queued' "
+            f"ORDER BY created LIMIT 1{self.claim_lock}) "
+            f"RETURNING {', '.join(self.TASK_COLUMNS)}",
+            (node, now, now)
+        )
+        if not rows:
+            return None
+        task = dict(zip(self.TASK_COLUMNS, rows[0]))
+        task.update(json.loads(task['args']))
+        return task
+    
+    def heartbeat(self, task_id: str, node: str, progress: dict) -> bool:
+        """Отметка выполняемой задачи с ее прогрессом; False - задача отменена ботом или передана другому узлу"""
+        now = time.time()
+        _, changed = self.execute(
+            "UPDATE worker_tasks SET heartbeat = ?, progress = ?, updated = ? WHERE task_id = ? AND node = ? AND state = 'running'",
+            (now, json.dumps(progress) if progress else None, now, task_id, node)
+        )
+        return changed > 0
+    
+    def finish(self, task_id: str, node: str, result: dict) -> bool:
+        """Запись результата задачи; False - задача уже отменена ботом или передана другому узлу"""
+        _, changed = self.execute(
+            "UPDATE worker_tasks SET state = ?, result = ?, updated = ? WHERE task_id = ? AND node = ? AND state = 'running'",
+            ('done' if result.get('success') else 'failed', json.dumps(result, default=str), time.time(), task_id, node)
+        )
+        return changed > 0
+    
+    def status(self, task_id: str) -> tuple:
+        """Состояние, прогресс и результат задачи (None - задачи нет)"""
+        rows, _ = self.execute("SELECT state, progress, result FROM worker_tasks WHERE task_id = ?", (task_id,))
+        if not rows:
+            return None, None, None
+        state, progress, result = rows[0]
+        return state, progress, json.loads(result) if result else None
+    
+    def cancel(self, task_id: str):
+        """Отмена задачи ботом: узел замечает ее при следующей отметке и останавливает загрузку"""
+        self.execute(
+            "UPDATE worker_tasks SET state = 'cancelled', updated = ? WHERE task_id = ? AND state IN ('queued', 'running')",
+            (time.time(), task_id)
+        )
+    
+    def requeue_stale(self, lease_timeout: float, max_attempts: int) -> int:
+        """Возврат в очередь задач упавших узлов; задача, которая уже роняла узлы max_attempts раз, завершается ошибкой"""
+        now = time.time()
+        self.execute(
+            "UPDATE worker_tasks SET state = 'failed', result = ?, updated = ? WHERE state = 'running' AND heartbeat < ? AND attempts >= ?",
+            (json.dumps({'success': False, 'error': 'worker_died'}), now, now - lease_timeout, max_attempts)
+        )
+        _, requeued = self.execute(
+            "UPDATE worker_tasks SET state = 'queued', node = NULL, updated = ? WHERE state = 'running' AND heartbeat < ?",
+            (now, now - lease_timeout)
+        )
+        return requeued
+    
+    def release_node(self, node: str):
+        """Возврат в очередь задач останавливаемого узла без учета попытки"""
+        self.execute(
+            "UPDATE worker_tasks SET state = 'queued', node = NULL, attempts = attempts - 1, updated = ? WHERE node = ? AND state = 'running'",
+            (time.time(), node)
+        )
+    
+    def prune(self, max_age: float):
+        """Удаление давно завершенных задач"""
+        placeholders = ', '.join('?' for _ in self.FINISHED_STATES)
+        self.execute(f"DELETE FROM worker_tasks WHERE state IN ({placeholders}) AND updated < ?",
+                     (*self.FINISHED_STATES, time.time() - max_age))
+    
+    def get_metrics(self) -> dict:
+        """Количество задач в очереди и в работе и число узлов, выполняющих задачи"""
+        rows, _ = self.execute(
+            "SELECT state, COUNT(*), COUNT(DISTINCT node) FROM worker_tasks WHERE state IN ('queued', 'running') GROUP BY state"
+        )
+        metrics = {'queued': 0, 'running': 0, 'nodes': 0}
+        for state, count, nodes in rows:
+            metrics[state] = count
+            if state == 'running':
+                metrics['nodes'] = nodes
+        return metrics
+    
+    def close(self):
+        """Закрытие соединений с базой"""
+        pass
+
+class SqliteJobQueue(JobQueue):
+    """Очередь в SQLite: бот и узлы на одном сервере работают с общим файлом базы (захват задачи - один UPDATE
+    под блокировкой записи базы)"""
+    
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS worker_tasks (
+            task_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            func TEXT NOT NULL,
+            args TEXT NOT NULL,
+            workdir TEXT,
+            media_type TEXT NOT NULL,
+            timeout REAL NOT NULL,
+            node TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            progress TEXT,
+            result TEXT,
+            heartbeat REAL,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_worker_tasks_state ON worker_tasks(state, created)",
+    ]
+    
+    def __init__(self, db_file: str):
+        # Запросы идут из пула потоков, поэтому доступ к соединению сериализуется блокировкой;
+        # другие процессы пишут в ту же базу - при занятой базе ждем, а не падаем
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.init_schema()
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """Транзакция на общем соединении под блокировкой"""
+        with self.lock, self.conn:
+            yield self.conn.cursor()
+    
+    def close(self):
+        """Закрытие соединения с базой"""
+        with self.lock:
+            self.conn.close()
+
+class PostgresJobQueue(JobQueue):
+    """Очередь в PostgreSQL для узлов на разных серверах: узлы захватывают задачи через FOR UPDATE SKIP LOCKED,
+    не дожидаясь друг друга"""
+    
+    placeholder = '%s'
+    claim_lock = ' FOR UPDATE SKIP LOCKED'
+    
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS worker_tasks (
+            task_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            func TEXT NOT NULL,
+            args TEXT NOT NULL,
+            workdir TEXT,
+            media_type TEXT NOT NULL,
+            timeout DOUBLE PRECISION NOT NULL,
+            node TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            progress TEXT,
+            result TEXT,
+            heartbeat DOUBLE PRECISION,
+            created DOUBLE PRECISION NOT NULL,
+            updated DOUBLE PRECISION NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_worker_tasks_state ON worker_tasks(state, created)",
+    ]
+    
+    def __init__(self, dsn: str, min_connections: int, max_connections: int):
+        if psycopg2 is None:
+            raise RuntimeError("Для JOB_QUEUE_BACKEND = 'postgres' нужен пакет psycopg2-binary")
+        self.pool = psycopg2.pool.ThreadedConnectionPool(min_connections, max_connections, dsn)
+        self.init_schema()
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """Транзакция на соединении из пула"""
+        conn = self.pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    yield cur
+        finally:
+            self.pool.putconn(conn)
+    
+    def close(self):
+        """Закрытие всех соединений пула"""
+        self.pool.closeall()
+
+def create_job_queue():
+    """Создание общей очереди задач согласно настройке JOB_QUEUE_BACKEND"""
+    if JOB_QUEUE_BACKEND == 'postgres':
+        return PostgresJobQueue(JOB_QUEUE_DSN or POSTGRES_DSN, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX)
+    return SqliteJobQueue(JOB_QUEUE_FILE)
+
+class RemoteWorkerPool:
+    """Выполнение загрузок на узлах-загрузчиках через общую очередь (тот же интерфейс, что у DownloadWorkerPool)"""
+    
+    def __init__(self, queue: JobQueue, poll_interval: float):
+        self.queue = queue
+        self.poll_interval = poll_interval
+    
+    async def start(self):
+        """Удаление давно завершенных задач очереди"""
+        await asyncio.get_running_loop().run_in_executor(None, self.queue.prune, JOB_RESUME_MAX_AGE)
+        logger.info("Загрузки выполняются узлами-загрузчиками из общей очереди")
+    
+    async def stop(self):
+        """Закрытие очереди"""
+        self.queue.close()
+    
+    async def get_metrics(self) -> dict:
+        """Состояние общей очереди для статистики"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.queue.get_metrics)
+    
+    async def submit(self, worker_func, *args, timeout: float = 600, download_id: str = None, on_progress=None,
+                     temp_dir: str = None, info: dict = None, **kwargs) -> dict:
+        """Постановка задачи в общую очередь и ожидание результата узла (on_progress получает прогресс задачи);
+        вместо пути к файлу результат содержит file_id файла, отправленного узлом"""
+        loop = asyncio.get_running_loop()
+        task_id = download_id or secrets.token_hex(8)
+        # Каталог загрузки передается узлу по имени: узел подставляет свой каталог с тем же именем.
+        # Метаданные не передаются: ссылки на форматы привязаны к адресу сервера бота, узел извлекает их сам
+        media_type = 'audio' if worker_func is download_audio_worker else 'video'
+        await loop.run_in_executor(None, self.queue.push, task_id, worker_func.__name__, args, kwargs, temp_dir, media_type, timeout)
+        
+        finished = False
+        started = False
+        last_progress = None
+        # Пока задача ждет свободный узел - не дольше таймаута, после захвата узлом - таймаут узла и время на отметку
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                state, progress, result = await loop.run_in_executor(None, self.queue.status, task_id)
+                if state in ('done', 'failed'):
+                    finished = True
+                    if isinstance(result, dict) and 'success' in result:
+                        return result
+                    return {'success': False, 'error': 'unknown_error'}
+                if state not in ('queued', 'running'):
+                    return {'success': False, 'error': 'worker_died'}
+                if state == 'running' and not started:
+                    started = True
+                    deadline = loop.time() + timeout + WORKER_LEASE_TIMEOUT
+                if progress and progress != last_progress:
+                    last_progress = progress
+                    if on_progress is not None:
+                        on_progress(json.loads(progress))
+                if loop.time() > deadline:
+                    return {'success': False, 'error': 'timeout'}
+        finally:
+            # Таймаут или отмена загрузки - узел останавливает задачу при следующей отметке
+            if not finished:
+                await asyncio.shield(loop.run_in_executor(None, self.queue.cancel, task_id))
+
+async def post_media(client: httpx.AsyncClient, base_url: str, media_type: str, data: dict, file_path: str = None) -> dict:
+    """Отправка видео или аудио через Bot API: файл с диска потоком (по частям, без чтения в память),
+    по локальному пути своему серверу Bot API или уже заданный в data file_id; возвращает отправленное сообщение"""
+    method = 'sendVideo' if media_type == 'video' else 'sendAudio'
+    if file_path is None:
+        response = await client.post(f"{base_url}/{method}", data=data)
+    elif BOT_API_LOCAL_MODE:
+        # Свой сервер Bot API читает файл с диска сам - байты не проходят через бота
+        response = await client.post(f"{base_url}/{method}", data=dict(data, **{media_type: pathlib.Path(file_path).absolute().as_uri()}))
+    else:
+        with open(file_path, 'rb') as media_file:
+            response = await client.post(
+                f"{base_url}/{method}",
+                data=data,
+                files={media_type: (os.path.basename(file_path), media_file)}
+            )
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {'ok': False, 'description': f'HTTP {response.status_code}'}
+    if not payload.get('ok'):
+        retry_after = payload.get('parameters', {}).get('retry_after')
+        if retry_after:
+            raise RetryAfter(retry_after)
+        raise TelegramError(payload.get('description', f'HTTP {response.status_code}'))
+    return payload['result']
+
+class WorkerNode:
+    """Узел-загрузчик: берет задачи из общей очереди, выполняет их в своем пуле процессов
+    и отправляет готовые файлы в WORKER_UPLOAD_CHAT_ID, возвращая боту file_id"""
+    
+    def __init__(self, queue: JobQueue, node_id: str, concurrency: int, work_dir: str):
+        self.queue = queue
+        self.node_id = node_id
+        self.concurrency = concurrency
+        self.work_dir = work_dir
+        self.pool = DownloadWorkerPool(concurrency, WORKER_MAX_JOBS)
+        self.client = None
+        self.base_url = f"{BOT_API_BASE_URL or 'https://api.telegram.org/bot'}{BOT_TOKEN}"
+        self.maintained_at = 0.0
+    
+    async def run(self):
+        """Запуск пула процессов и циклов получения задач до остановки узла"""
+        loop = asyncio.get_running_loop()
+        os.makedirs(self.work_dir, exist_ok=True)
+        await self.pool.start()
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(600))
+        logger.info(f"Узел-загрузчик {self.node_id} запущен: {self.concurrency} задач одновременно")
+        try:
+            await asyncio.gather(*(self.work_loop() for _ in range(self.concurrency)))
+        finally:
+            # Прерванные задачи сразу возвращаются в очередь, не дожидаясь WORKER_LEASE_TIMEOUT
+            await loop.run_in_executor(None, self.queue.release_node, self.node_id)
+            await self.pool.stop()
+            await self.client.aclose()
+            self.queue.close()
+    
+    async def work_loop(self):
+        """Получение и выполнение задач по одной"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                task = await loop.run_in_executor(None, self.queue.claim, self.node_id)
+            except Exception as e:
+                logger.error(f"Не удалось получить задачу из очереди: {e}")
+                task = None
+            if task is None:
+                await self.maintain()
+                await asyncio.sleep(JOB_QUEUE_POLL_INTERVAL)
+                continue
+            logger.info(f"Задача {task['task_id']} ({task['func']}, попытка {task['attempts']})")
+            await self.execute(task)
+    
+    async def maintain(self):
+        """Возврат в очередь задач упавших узлов и удаление старых каталогов задач (не чаще раза в WORKER_LEASE_TIMEOUT)"""
+        now = time.time()
+        if now - self.maintained_at < WORKER_LEASE_TIMEOUT:
+            return
+        self.maintained_at = now
+        loop = asyncio.get_running_loop()
+        try:
+            requeued = await loop.run_in_executor(None, self.queue.requeue_stale, WORKER_LEASE_TIMEOUT, JOB_MAX_ATTEMPTS)
+            if requeued:
+                logger.warning(f"Возвращено в очередь задач упавших узлов: {requeued}")
+        except Exception as e:
+            logger.error(f"Ошибка проверки задач упавших узлов: {e}")
+        for name in os.listdir(self.work_dir):
+            job_dir = os.path.join(self.work_dir, name)
+            with contextlib.suppress(OSError):
+                if now - os.path.getmtime(job_dir) > JOB_RESUME_MAX_AGE:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+    
+    async def execute(self, task: dict):
+        """Выполнение задачи с отметками в очереди; отмена задачи ботом останавливает загрузку"""
+        loop = asyncio.get_running_loop()
+        progress = {}
+        job = asyncio.create_task(self.run_task(task, progress))
+        try:
+            owned = True
+            while owned and not job.done():
+                await asyncio.wait({job}, timeout=WORKER_HEARTBEAT_INTERVAL)
+                if not job.done():
+                    try:
+                        owned = await loop.run_in_executor(None, self.queue.heartbeat, task['task_id'], self.node_id, dict(progress))
+                    except Exception as e:
+                        logger.error(f"Не удалось отметить задачу {task['task_id']}: {e}")
+            if not job.done():
+                logger.info(f"Задача {task['task_id']} отменена ботом")
+                return
+            try:
+                result = job.result()
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            if not await loop.run_in_executor(None, self.queue.finish, task['task_id'], self.node_id, result):
+                logger.info(f"Результат задачи {task['task_id']} больше не нужен боту")
+        except Exception as e:
+            logger.error(f"Ошибка записи результата задачи {task['task_id']}: {e}")
+        finally:
+            if not job.done():
+                job.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await job
+    
+    async def run_task(self, task: dict, progress: dict) -> dict:
+        """Загрузка в пуле процессов узла и отправка готового файла в WORKER_UPLOAD_CHAT_ID"""
+        worker_func = WORKER_FUNCTIONS.get(task['func'])
+        if worker_func is None:
+            return {'success': False, 'error': f"unknown_worker: {task['func']}"}
+        
+        # Каталога бота на узле нет - подставляем свой с тем же именем, чтобы следующая задача
+        # того же запроса (сжатие, продолжение после перезапуска) нашла уже скачанные файлы
+        args, kwargs = task['args'], task['kwargs']
+        job_dir = None
+        if task['workdir']:
+            job_dir = os.path.join(self.work_dir, os.path.basename(task['workdir']))
+            os.makedirs(job_dir, exist_ok=True)
+            kwargs['temp_dir'] = job_dir
+        # Метаданные из кеша узла - следующие задачи того же видео не извлекают их заново;
+        # при ошибке воркер извлечет их сам и вернет ошибку загрузки
+        try:
+            kwargs['info'] = await asyncio.get_running_loop().run_in_executor(None, get_video_metadata, args[0])
+        except Exception as e:
+            logger.warning(f"Не удалось получить метаданные задачи {task['task_id']}: {e}")
+        
+        def on_progress(payload: dict):
+            progress.clear()
+            progress.update(payload)
+        
+        result = await self.pool.submit(worker_func, *args, timeout=task['timeout'], download_id=task['task_id'],
+                                        on_progress=on_progress, **kwargs)
+        if not result.get('success') or not result.get('file_path'):
+            return result
+        
+        on_progress({'stage': 'processing'})
+        data = {'chat_id': WORKER_UPLOAD_CHAT_ID, 'disable_notification': 'true'}
+        if task['media_type'] == 'video':
+            data['supports_streaming'] = 'true'
+        try:
+            message = await post_media(self.client, self.base_url, task['media_type'], data, result['file_path'])
+        except Exception as e:
+            return {'success': False, 'error': f"upload_error: {e}"}
+        media = message.get(task['media_type']) or message.get('document')
+        if job_dir:
+            # Файл уже в Telegram - каталог задачи больше не нужен
+            shutil.rmtree(job_dir, ignore_errors=True)
+        return dict(result, file_path=None, file_id=media['file_id'])
+
+def run_worker_node():
+    """Запуск узла-загрузчика (python main.py worker)"""
+    if not WORKER_UPLOAD_CHAT_ID:
+        print("Не задан WORKER_UPLOAD_CHAT_ID... Проверьте файл config.py")
+        return
+    node = WorkerNode(create_job_queue(), f"{socket.gethostname()}:{os.getpid()}", WORKER_NODE_CONCURRENCY, WORKER_NODE_DIR)
+    print(f"Узел-загрузчик {node.node_id} запущен! Нажмите Ctrl+C для остановки...")
+    try:
+        asyncio.run(node.run())
+    except KeyboardInterrupt:
+        pass
+
+class DownloadScheduler:
+    """Очередь загрузок на стороне бота: общее ограничение задач и справедливая очередь между пользователями
+    
+    Очереди пользователей обходятся по кругу (deficit round robin): за круг пользователь получает
+    столько запусков, каков вес его типа, и не больше USER_MAX_ACTIVE_JOBS задач одновременно.
+    """
+    
+    def __init__(self, max_concurrent: int, weights: dict, user_caps: dict):
+        self.max_concurrent = max_concurrent
+        self.weights = weights  # Тип пользователя -> запусков за круг
+        self.user_caps = user_caps  # Тип пользователя -> одновременных задач
+        self.active = 0  # Количество выполняющихся задач
+        self.user_active = {}  # ID пользователя -> выполняющихся задач
+        # ID пользователя -> {'jobs': очередь задач, 'deficit': доступные запуски, 'user_type': тип};
+        # порядок словаря - порядок обхода по кругу
+        self.queues = collections.OrderedDict()
+        self.queued = 0  # Задач в очередях всех пользователей
+        self.job_durations = collections.deque(maxlen=50)  # Длительность последних задач для оценки ожидания
+        self.metrics = {
+            'total_jobs': 0,
+            'queued_jobs': 0,
+            'max_queue_depth': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0
+        }
+        self.wait_by_type = {}  # Тип пользователя -> [задач, суммарное ожидание, максимальное ожидание]
+        self.recount_handle = None  # Запланированный пересчет позиций
+        self.recounted_at = 0.0  # Время последнего пересчета позиций
+    
+    def estimate_wait(self, position: int) -> float:
+        """Оценка времени ожидания в секундах для позиции в очереди"""
+        if self.job_durations:
+            avg_duration = sum(self.job_durations) / len(self.job_durations)
+        else:
+            avg_duration = DEFAULT_JOB_DURATION
+        rounds = (position + self.max_concurrent - 1) // self.max_concurrent
+        return rounds * avg_duration
+    
+    def has_capacity(self, user_id, user_type: str) -> bool:
+        """Может ли пользователь запустить еще одну задачу"""
+        return self.user_active.get(user_id, 0) < self.user_caps.get(user_type, 1)
+    
+    def expected_order(self) -> list:
+        """Ожидаемый порядок запуска задач из очереди (обход по кругу с весами, без учета ограничений)"""
+        order = []
+        cursors = [[state['jobs'], 0, state['deficit'], self.weights.get(state['user_type'], 1)]
+                   for state in self.queues.values()]
+        while cursors:
+            remaining = []
+            for cursor in cursors:
+                jobs, index, deficit, weight = cursor
+                if deficit < 1:
+                    deficit += weight
+                while deficit >= 1 and index < len(jobs):
+                    order.append(jobs[index])
+                    index += 1
+                    deficit -= 1
+                if index < len(jobs):
+                    remaining.append([jobs, index, deficit, weight])
+            cursors = remaining
+        return order
+    
+    def schedule_positions(self):
+        """Отложенный пересчет позиций: при потоке задач очередь обходится не чаще QUEUE_RECOUNT_INTERVAL"""
+        if self.recount_handle is not None:
+            return
+        delay = max(0.0, self.recounted_at + QUEUE_RECOUNT_INTERVAL - time.monotonic())
+        self.recount_handle = asyncio.get_running_loop().call_later(delay, self.notify_positions)
+    
+    def notify_positions(self):
+        """Уведомление ожидающих задач об изменении позиции в очереди"""
+        self.recount_handle = None
+        now = time.monotonic()
+        self.recounted_at = now
+        for position, job in enumerate(self.expected_order(), 1):
+            callback = job['on_position']
+            if not callback or job['position'] == position:
+                continue
+            # Новая задача узнает позицию сразу, остальные - не чаще QUEUE_NOTIFY_INTERVAL
+            if job['position'] and now - job['notified_at'] < QUEUE_NOTIFY_INTERVAL:
+                continue
+            job['position'] = position
+            job['notified_at'] = now
+            asyncio.create_task(callback(position, self.estimate_wait(position)))
+    
+    def next_job(self) -> dict:
+        """Следующая задача по кругу пользователей; None, если все ожидающие упираются в свой лимит"""
+        for _ in range(2 * len(self.queues)):
+            user_id, state = next(iter(self.queues.items()))
+            jobs = state['jobs']
+            while jobs and jobs[0]['future'].done():
+                jobs.popleft()
+                self.queued -= 1
+            if not jobs:
+                del self.queues[user_id]
+                if not self.queues:
+                    return None
+                continue
+            if not self.has_capacity(user_id, state['user_type']):
+                # Пропускает круг и не копит запуски, пока выполняются его задачи
+                state['deficit'] = 0.0
+                self.queues.move_to_end(user_id)
+                continue
+            if state['deficit'] < 1:
+                state['deficit'] += self.weights.get(state['user_type'], 1)
+            state['deficit'] -= 1
+            job = jobs.popleft()
+            self.queued -= 1
+            if not jobs:
+                del self.queues[user_id]
+            elif state['deficit'] < 1:
+                self.queues.move_to_end(user_id)
+            return job
+        return None
+    
+    def start(self, job: dict):
+        """Занятие слота задачей"""
+        self.active += 1
+        self.user_active[job['user_id']] = self.user_active.get(job['user_id'], 0) + 1
+    
+    def dispatch(self):
+        """Выдача освободившихся слотов задачам из очередей пользователей"""
+        while self.active < self.max_concurrent and self.queues:
+            job = self.next_job()
+            if job is None:
+                break
+            self.start(job)
+            job['future'].set_result(True)
+        if self.queued:
+            self.schedule_positions()
+    
+    def record_start(self, job: dict):
+        """Учет метрик ожидания при старте задачи"""
+        wait_time = time.monotonic() - job['enqueued_at']
+        job['started_at'] = time.monotonic()
+        self.metrics['total_jobs'] += 1
+        self.metrics['total_wait'] += wait_time
+        self.metrics['max_wait'] = max(self.metrics['max_wait'], wait_time)
+        by_type = self.wait_by_type.setdefault(job['user_type'], [0, 0.0, 0.0])
+        by_type[0] += 1
+        by_type[1] += wait_time
+        by_type[2] = max(by_type[2], wait_time)
+    
+    async def acquire(self, on_position=None, user_id=None, user_type: str = 'free') -> dict:
+        """Ожидание свободного слота для загрузки"""
+        loop = asyncio.get_running_loop()
+        job = {
+            'future': loop.create_future(),
+            'user_id': user_id,
+            'user_type': user_type,
+            'enqueued_at': time.monotonic(),
+            'started_at': None,
+            'on_position': on_position,
+            'position': 0,
+            'notified_at': 0.0
+        }
+        
+        if self.active < self.max_concurrent and not self.queued and self.has_capacity(user_id, user_type):
+            self.start(job)
+            self.record_start(job)
+            return job
+        
+        state = self.queues.get(user_id)
+        if state is None:
+            state = self.queues[user_id] = {'jobs': collections.deque(), 'deficit': 0.0, 'user_type': user_type}
+        state['jobs'].append(job)
+        self.queued += 1
+        self.metrics['queued_jobs'] += 1
+        self.metrics['max_queue_depth'] = max(self.metrics['max_queue_depth'], self.queued)
+        # Слот может быть свободен, если очередь стоит только из-за лимитов других пользователей
+        self.dispatch()
+        
+        try:
+            await job['future']
+        except asyncio.CancelledError:
+            state = self.queues.get(user_id)
+            if state is not None and job in state['jobs']:
+                state['jobs'].remove(job)
+                self.queued -= 1
+                if not state['jobs']:
+                    del self.queues[user_id]
+                self.schedule_positions()
+            elif job['future'].done() and not job['future'].cancelled():
+                # Слот уже был выдан, но задача отменена - освобождаем его
+                self.release(job)
+            raise
+        
+        self.record_start(job)
+        return job
+    
+    def release(self, job: dict):
+        """Освобождение слота после завершения загрузки"""
+        if job['started_at'] is not None:
+            self.job_durations.append(time.monotonic() - job['started_at'])
+        self.active = max(0, self.active - 1)
+        user_id = job['user_id']
+        if self.user_active.get(user_id, 0) <= 1:
+            self.user_active.pop(user_id, None)
+        else:
+            self.user_active[user_id] -= 1
+        self.dispatch()
+    
+    def get_metrics(self) -> dict:
+        """Текущие метрики очереди загрузок"""
+        total_jobs = self.metrics['total_jobs']
+        return {
+            'active': self.active,
+            'queue_depth': self.queued,
+            'queued_users': len(self.queues),
+            'max_queue_depth': self.metrics['max_queue_depth'],
+            'total_jobs': total_jobs,
+            'queued_jobs': self.metrics['queued_jobs'],
+            'avg_wait': self.metrics['total_wait'] / total_jobs if total_jobs else 0.0,
+            'max_wait': self.metrics['max_wait'],
+            'wait_by_type': {user_type: (jobs, total / jobs, longest)
+                             for user_type, (jobs, total, longest) in self.wait_by_type.items()}
+        }
+
+class JobJournal:
+    """Журнал загрузок в SQLite: состояние каждой загрузки пишется сразу, чтобы пережить падение бота"""
+    
+    ACTIVE_STATES = ('queued', 'downloading', 'uploading')
+    COLUMNS = ['job_id', 'state', 'chat_id', 'user_id', 'username', 'url', 'download_type', 'quality',
+               'message', 'attempts', 'created', 'updated']
+    
+    def __init__(self, db_file: str, jobs_dir: str):
+        self.jobs_dir = jobs_dir
+        # Запись идет из пула потоков, поэтому доступ к соединению сериализуется блокировкой
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                username TEXT,
+                url TEXT NOT NULL,
+                download_type TEXT NOT NULL,
+                quality TEXT,
+                message TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state)")
+    
+    def add(self, job_id: str, update: Update, url: str, download_type: str, quality: str, user_id: int, username: str):
+        """Запись новой загрузки (исходное сообщение сохраняется, чтобы ответить на него после перезапуска)"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (job_id, state, chat_id, user_id, username, url, download_type, quality, message, created, updated) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id) DO UPDATE SET state = 'queued', attempts = attempts + 1, updated = excluded.updated",
+                (job_id, update.message.chat_id, user_id, username, url, download_type, quality,
+                 json.dumps(update.message.to_dict()), now, now)
+            )
+    
+    def set_state(self, job_id: str, state: str):
+        """Смена состояния загрузки"""
+        if job_id is None:
+            return
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE job_id = ?", (state, time.time(), job_id))
+    
+    async def add_async(self, job_id: str, update: Update, url: str, download_type: str, quality: str, user_id: int, username: str):
+        """Запись новой загрузки в пуле потоков, чтобы коммит SQLite не задерживал цикл событий"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.add, job_id, update, url, download_type, quality, user_id, username)
+    
+    async def set_state_async(self, job_id: str, state: str):
+        """Смена состояния загрузки в пуле потоков"""
+        if job_id is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self.set_state, job_id, state)
+    
+    def pending(self) -> list:
+        """Незавершенные загрузки в порядке поступления"""
+        placeholders = ', '.join('?' for _ in self.ACTIVE_STATES)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE state IN ({placeholders}) ORDER BY created",
+                self.ACTIVE_STATES
+            ).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+    
+    def prune(self, max_age: float):
+        """Удаление давно завершенных записей и каталогов загрузок, которых нет среди незавершенных"""
+        placeholders = ', '.join('?' for _ in self.ACTIVE_STATES)
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM jobs WHERE state NOT IN ({placeholders}) AND updated < ?",
+                              (*self.ACTIVE_STATES, time.time() - max_age))
+        active = {job['job_id'] for job in self.pending()}
+        if os.path.isdir(self.jobs_dir):
+            for name in os.listdir(self.jobs_dir):
+                if name not in active:
+                    shutil.rmtree(os.path.join(self.jobs_dir, name), ignore_errors=True)
+    
+    @contextlib.contextmanager
+    def directory(self):
+        """Каталог файлов текущей загрузки: для записи журнала - постоянный (остается при падении бота), иначе временный"""
+        job_id = current_job.get()
+        if job_id is None:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                yield temp_dir
+            return
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        try:
+            yield job_dir
+        finally:
+            # Загрузка завершена, отменена или упала с ошибкой - файлы больше не нужны
+            shutil.rmtree(job_dir, ignore_errors=True)
+    
+    def close(self):
+        """Закрытие базы журнала"""
+        with self.lock:
+            self.conn.close()
+
+def format_queue_message(position: int, eta: float) -> str:
+    """Текст сообщения о позиции в очереди загрузок"""
+    minutes = max(1, round(eta / 60))
+    return (
+        f"Все загрузчики заняты... Вы в очереди: позиция {position}\n"
+        f"Примерное ожидание: ~{minutes} мин."
+    )
+
+class YouTubeDownloaderBot:
+    """Основной класс бота для скачивания видео и аудио"""
+    
+    def __init__(self, token):
+        # Настройка HTTP запросов с увеличенными таймаутами для больших файлов
+        request = HTTPXRequest(
+            connection_pool_size=HTTP_POOL_SIZE,
+            read_timeout=600,
+            write_timeout=600,
+            connect_timeout=600,
+            pool_timeout=600
+        )
+        # Обновления обрабатываются параллельно, чтобы долгая загрузка одного
+        # пользователя не блокировала ответы остальным
+        builder = (
+            Application.builder()
+            .token(token)
+            .request(request)
+            .concurrent_updates(MAX_CONCURRENT_UPDATES)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        if BOT_API_BASE_URL:
+            builder = builder.base_url(BOT_API_BASE_URL)
+        if BOT_API_BASE_FILE_URL:
+            builder = builder.base_file_url(BOT_API_BASE_FILE_URL)
+        if BOT_API_LOCAL_MODE:
+            builder = builder.local_mode(True)
+        self.application = builder.build()
+        if WORKER_MODE == 'remote':
+            # Загрузки выполняют узлы-загрузчики, бот только распределяет задачи и пересылает file_id
+            self.download_pool = RemoteWorkerPool(create_job_queue(), JOB_QUEUE_POLL_INTERVAL)
+            max_concurrent = REMOTE_MAX_CONCURRENT_DOWNLOADS
+        else:
+            self.download_pool = DownloadWorkerPool(DOWNLOAD_POOL_SIZE, WORKER_MAX_JOBS)
+            max_concurrent = MAX_CONCURRENT_DOWNLOADS
+        self.download_scheduler = DownloadScheduler(max_concurrent, SCHEDULER_WEIGHTS, USER_MAX_ACTIVE_JOBS)
+        self.persist_task = None
+        self.persist_stop = None
+        self.upload_client = None
+        self.link_client = None
+        self.inflight = {}  # Ключ кеша file_id -> Future идущей загрузки
+        self.user_jobs = {}  # ID пользователя -> {ID записи журнала: задача загрузки, которую можно отменить}
+        self.status_messages = {}  # ID записи журнала -> статусное сообщение загрузки
+        self.user_cancelled = set()  # Задачи, отмененные самим пользователем
+        self.resumed_tasks = set()  # Загрузки, продолжаемые после перезапуска
+        self.progress_edited_at = {}  # ID чата -> время последнего обновления прогресса
+        self.setup_handlers()
+        load_data()
+        clean_temp_files()
+        media_cache.cleanup_partial()
+        self.journal = JobJournal(JOB_JOURNAL_FILE, JOBS_DIR)
+        self.journal.prune(JOB_RESUME_MAX_AGE)
+
+    async def post_init(self, application: Application):
+        """Действия после инициализации приложения: запуск пула загрузчиков и сохранения данных"""
+        await self.download_pool.start()
+        # Отдельный клиент для отправки файлов: multipart читается с диска по частям
+        self.upload_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(600),
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE)
+        )
+        # Клиент для раскрытия коротких ссылок: перенаправления разбираются вручную, страницы не скачиваются
+        self.link_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10),
+            headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+        )
+        self.persist_stop = asyncio.Event()
+        self.persist_task = asyncio.create_task(self.persist_loop())
+        await self.resume_jobs()
+
+    async def post_shutdown(self, application: Application):
+        """Действия при остановке приложения: остановка пула загрузчиков и сохранение данных"""
+        if self.persist_task:
+            # Дожидаемся окончания текущей записи, чтобы она не перезаписала финальное сохранение
+            self.persist_stop.set()
+            await self.persist_task
+        await self.download_pool.stop()
+        if self.upload_client is not None:
+            await self.upload_client.aclose()
+        if self.link_client is not None:
+            await self.link_client.aclose()
+        flush_data()
+        if storage is not None:
+            storage.close()
+        self.journal.close()
+
+    async def persist_loop(self):
+        """Периодическое сохранение измененных данных на диск"""
+        while not self.persist_stop.is_set():
+            try:
+                await asyncio.wait_for(self.persist_stop.wait(), timeout=PERSIST_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await flush_data_async()
+            except Exception as e:
+                logger.error(f"Ошибка периодического сохранения данных: {e}")
+
+    def setup_handlers(self):
+        """Настройка обработчиков команд и сообщений"""
+        # Группы -2 и -1 выполняются перед остальными обработчиками и не мешают им
+        self.application.add_handler(TypeHandler(Update, self.refresh_user_state), group=-2)
+        self.application.add_handler(TypeHandler(Update, self.track_update_latency), group=-1)
+        self.application.add_handler(CommandHandler("start", self.show_welcome))
+        self.application.add_handler(CommandHandler("help", self.help_command))
+        self.application.add_handler(CommandHandler("admin", self.admin_panel))
+        self.application.add_handler(CommandHandler("premium", self.premium_info))
+        self.application.add_handler(CommandHandler("history", self.show_history))
+        self.application.add_handler(CommandHandler("info", self.video_info_command))
+        self.application.add_handler(CommandHandler("stats", self.user_stats_command))
+        self.application.add_handler(CommandHandler("cancel", self.cancel_command))
+        self.application.add_handler(CallbackQueryHandler(self.cancel_button, pattern="^cancel"))
+        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+
+    async def refresh_user_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Блокировка, подписка и лимит пользователя из общей SQL базы перед проверками в обработчиках"""
+        # Несколько процессов бота с одной базой меняют эти данные независимо друг от друга
+        user = update.effective_user
+        if user is None or storage is None or storage.full_snapshot:
+            return
+        quota_store.roll(time.time())
+        days = [day for day in (quota_store.day, quota_store.prev_day) if day is not None]
+        try:
+            state = await asyncio.get_running_loop().run_in_executor(None, storage.load_user, user.id, days)
+        except Exception as e:
+            logger.error(f"Ошибка чтения данных пользователя {user.id}: {e}")
+            return
+        apply_user_state(user.id, state)
+
+    async def track_update_latency(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Замер задержки доставки обновления: от времени сообщения до начала обработки"""
+        # Нажатия кнопок несут дату исходного сообщения бота - учитываются только новые сообщения
+        message = update.message
+        if message is not None and message.date is not None:
+            update_latency.append(max(0.0, time.time() - message.date.timestamp()))
+
+    def get_main_keyboard(self):
+        """Клавиатура главного меню"""
+        keyboard = [
+            [KeyboardButton("Скачать видео"), KeyboardButton("Скачать аудио")],
+            [KeyboardButton("Информация о видео"), KeyboardButton("История загрузок")],
+            [KeyboardButton("Помощь"), KeyboardButton("Премиум"), KeyboardButton("Главное меню")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def get_cancel_keyboard(self, job_id: str = None):
+        """Кнопка отмены под статусом загрузки: отменяет только свою загрузку (по умолчанию - текущую)"""
+        job_id = job_id or current_job.get() or ""
+        return InlineKeyboardMarkup([[InlineKeyboardButton("Отменить", callback_data=f"cancel:{job_id}")]])
+
+    def get_welcome_keyboard(self):
+        """Клавиатура приветственного сообщения"""
+        keyboard = [
+            [KeyboardButton("Поздороваться")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def get_quality_keyboard(self):
+        """Клавиатура выбора качества видео"""
+        keyboard = [
+            [KeyboardButton("Авто качество"), KeyboardButton("1080p"), KeyboardButton("720p")],
+            [KeyboardButton("480p"), KeyboardButton("360p"), KeyboardButton("240p")],
+            [KeyboardButton("Назад")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def get_admin_keyboard(self):
+        """Клавиатура админ-панели"""
+        keyboard = [
+            [KeyboardButton("Статистика"), KeyboardButton("Пользователи")],
+            [KeyboardButton("Блокировка"), KeyboardButton("Настройки")],
+            [KeyboardButton("Логи ошибок"), KeyboardButton("Управление ботом")],
+            [KeyboardButton("Управление премиум"), KeyboardButton("Рассылка"), KeyboardButton("Выйти из админки")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def get_admin_users_keyboard(self):
+        """Клавиатура управления пользователями в админ-панели"""
+        keyboard = [
+            [KeyboardButton("Общая статистика"), KeyboardButton("Поиск пользователя")],
+            [KeyboardButton("Топ пользователей"), KeyboardButton("В админ-панель")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def get_admin_block_keyboard(self):
+        """Клавиатура управления блокировками"""
+        keyboard = [
+            [KeyboardButton("Заблокировать"), KeyboardButton("Разблокировать")],
+            [KeyboardButton("Список заблокированных"), KeyboardButton("В админ-панель")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def get_admin_control_keyboard(self):
+        """Клавиатура управления ботом"""
+        bot_status = "ВКЛ" if bot_enabled else "ВЫКЛ"
+        keyboard = [
+            [KeyboardButton(f"{bot_status} Бот"), KeyboardButton("Перезагрузить данные")],
+            [KeyboardButton("Очистить логи"), KeyboardButton("В админ-панель")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def get_admin_premium_keyboard(self):
+        """Клавиатура управления премиум подписками"""
+        keyboard = [
+            [KeyboardButton("Выдать премиум"), KeyboardButton("Забрать премиум")],
+            [KeyboardButton("Список премиум"), KeyboardButton("В админ-панель")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def get_admin_broadcast_keyboard(self):
+        """Клавиатура рассылки сообщений"""
+        keyboard = [
+            [KeyboardButton("Всем пользователям"), KeyboardButton("Только премиум")],
+            [KeyboardButton("Обычным пользователям"), KeyboardButton("В админ-панель")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    def is_admin(self, user_id: int) -> bool:
+        """Проверка является ли пользователь администратором"""
+        return user_id in ADMIN_IDS
+
+    def is_user_blocked(self, user_id: int) -> bool:
+        """Проверка заблокирован ли пользователь"""
+        return user_id in blocked_users
+
+    def is_premium(self, user_id: int) -> bool:
+        """Проверка является ли пользователь премиум"""
+        return user_id in premium_users
+
+    def is_valid_youtube_url(self, url: str) -> bool:
+        """Проверка, что ссылка ведет на видео поддерживаемой платформы и безопасна"""
+        return validate_url(url).valid
+
+    async def resolve_url(self, url: str) -> str:
+        """Приведение ссылки к единому виду, короткие ссылки раскрываются по перенаправлениям"""
+        url = url.strip()
+        if url in short_link_cache or not is_short_link(url) or self.link_client is None:
+            return canonical_url(url)
+        
+        location = url
+        try:
+            # Идем по Location до ссылки с ID видео, не загружая саму страницу
+            for _ in range(5):
+                response = await self.link_client.head(location)
+                if not response.is_redirect:
+                    break
+                location = str(response.url.join(response.headers['location']))
+                if normalize_url(location)[0] is not None:
+                    remember_short_link(url, location)
+                    break
+        except (httpx.HTTPError, KeyError) as e:
+            logger.warning(f"Не удалось раскрыть короткую ссылку {url}: {e}")
+        return canonical_url(url)
+
+    async def show_welcome(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать приветственное сообщение"""
+        welcome_text = "Привет! Нажми кнопку 'Поздороваться' чтобы начать общение..."
+        await update.message.reply_text(welcome_text, reply_markup=self.get_welcome_keyboard())
+
+    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка команды /start"""
+        user_id = update.message.from_user.id
+        username = update.message.from_user.username or "Unknown"
+        
+        if self.is_user_blocked(user_id):
+            await update.message.reply_text("К сожалению, вы заблокированы и не можете использовать бота...")
+            return
+        
+        if not bot_enabled:
+            await update.message.reply_text("Бот временно отключен... Попробуйте позже!")
+            return
+        
+        user_type = get_user_type(user_id)
+        remaining = get_remaining_requests(user_id)
+        
+        welcome_text = f"""
+Добро пожаловать в UwU botyk!
+
+Здесь ты можешь:
+Скачать видео с YouTube, TikTok, RUTube
+Конвертировать видео в MP3
+Получить информацию о видео
+Посмотреть историю загрузок
+Получить премиум-статус!
+
+Твой статус: {user_type.upper()}
+Осталось запросов сегодня: {remaining}
+
+Выбирай нужную опцию из меню ниже...
+        """
+        context.user_data['greeted'] = True
+        update_user_stats(user_id, username, 'start')
+        await update.message.reply_text(welcome_text, reply_markup=self.get_main_keyboard())
+
+    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка команды /help"""
+        help_text = f"""
+Как пользоваться ботом:
+
+1 Нажми «Скачать видео» или «Скачать аудио»
+2 Выбери качество для видео...
+3 Отправь ссылку на видео
+4 Жди загрузки файла!
+
+Поддерживаемые платформы:
+• YouTube (youtube.com, youtu.be)
+• TikTok (tiktok.com, vm.tiktok.com)  
+• RUTube (rutube.ru)
+
+Ограничения:
+• Максимальный размер файла {MAX_FILE_SIZE}MB
+• Время обработки до 10 минут
+• Автоматическое понижение качества
+
+Передумал? /cancel или кнопка «Отменить» остановит загрузку.
+В любой момент можно вернуться в главное меню!
+        """
+        await update.message.reply_text(help_text, reply_markup=self.get_main_keyboard())
+
+    async def premium_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Информация о премиум подписке"""
+        user_id = update.message.from_user.id
+        user_type = get_user_type(user_id)
+        
+        if user_type == 'premium':
+            expiry_timestamp = premium_users[user_id]
+            expiry_date = datetime.datetime.fromtimestamp(expiry_timestamp).strftime("%Y-%m-%d %H:%M:%S")
+            premium_text = f"""
+ВЫ ПРЕМИУМ ПОЛЬЗОВАТЕЛЬ!
+
+Ваши преимущества:
+• 20 запросов в день (вместо 5)!
+• Приоритетная обработка
+• Специальная поддержка
+• Доступ к будущим функциям...
+
+Премиум действует до: {expiry_date}
+
+Спасибо за поддержку!
+            """
+        else:
+            premium_text = f"""
+ПРЕМИУМ ПОДПИСКА
+
+Всего {SUBSCRIPTION_PRICE} руб/мес!
+
+Преимущества:
+• 20 запросов в день (вместо 5)!
+• Приоритетная обработка
+• Специальная поддержка
+• Доступ к будущим функциям...
+
+Сейчас у вас: {REQUEST_LIMITS['free']} запросов/день
+С премиум: {REQUEST_LIMITS['premium']} запросов/день
+
+Для приобретения премиум обратитесь к администратору:
+{ADMIN_USERNAME}
+            """
+        
+        await update.message.reply_text(premium_text, reply_markup=self.get_main_keyboard())
+
+    async def show_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать историю загрузок пользователя"""
+        user_id = update.message.from_user.id
+        
+        if user_id not in user_history or not user_history[user_id]:
+            await update.message.reply_text("История загрузок пуста... Попробуйте что-нибудь скачать!", reply_markup=self.get_main_keyboard())
+            return
+        
+        history_entries = user_history[user_id][-10:]
+        history_text = "ПОСЛЕДНИЕ ЗАГРУЗКИ:\n\n"
+        
+        for i, entry in enumerate(reversed(history_entries), 1):
+            status = "✅" if entry['success'] else "❌"
+            type_icon = "🎥" if entry['type'] == 'video' else "🎵"
+            quality = f" ({entry['quality']})" if entry['quality'] else ""
+            
+            history_text += f"{i}. {status} {type_icon} {entry['title']}{quality}\n"
+            history_text += f"   📅 {entry['timestamp']}\n"
+            history_text += f"   🔗 {entry['url'][:30]}...\n\n"
+        
+        await update.message.reply_text(history_text, reply_markup=self.get_main_keyboard())
+
+    async def video_info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Получение информации о видео"""
+        user_id = update.message.from_user.id
+        username = update.message.from_user.username or "Unknown"
+        
+        if not can_make_request(user_id):
+            remaining = get_remaining_requests(user_id)
+            await update.message.reply_text(
+                f"Лимит запросов исчерпан... Осталось: {remaining}\n"
+                f"Приобретите премиум для увеличения лимита!",
+                reply_markup=self.get_main_keyboard()
+            )
+            return
+        
+        context.user_data['awaiting_info_url'] = True
+        increment_request_count(user_id)
+        update_user_stats(user_id, username, 'info')
+        
+        await update.message.reply_text(
+            "Отправьте ссылку на видео для получения информации...",
+            reply_markup=self.get_main_keyboard()
+        )
+
+    async def user_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать статистику пользователя"""
+        user_id = update.message.from_user.id
+        username = update.message.from_user.username or "Unknown"
+        
+        if user_id not in user_stats:
+            await update.message.reply_text(
+                "У вас еще нет статистики... Начните использовать бота!",
+                reply_markup=self.get_main_keyboard()
+            )
+            return
+        
+        stats = user_stats[user_id]
+        user_type = get_user_type(user_id)
+        remaining = get_remaining_requests(user_id)
+        
+        stats_text = f"""
+ВАША СТАТИСТИКА:
+
+Статус: {user_type.upper()}
+Осталось запросов сегодня: {remaining}
+
+Всего запросов: {stats['total_requests']}
+Успешных: {stats['successful_requests']}
+Неудачных: {stats['failed_requests']}
+
+Видео скачано: {stats['video_downloads']}
+Аудио скачано: {stats['audio_downloads']}
+
+Первое использование: {stats['first_seen']}
+Последняя активность: {stats['last_activity']}
+        """
+        
+        await update.message.reply_text(stats_text, reply_markup=self.get_main_keyboard())
+
+    async def admin_panel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Панель администратора"""
+        if not self.is_admin(update.message.from_user.id):
+            await update.message.reply_text("У вас нет доступа к админ-панели...")
+            return
+        
+        admin_text = f"""
+АДМИН-ПАНЕЛЬ:
+
+Статистика - общая статистика бота
+Пользователи - управление пользователями
+Блокировка - блокировка/разблокировка
+Настройки - настройки бота
+Логи ошибок - просмотр ошибок
+Управление ботом - включение/выключение
+Управление премиум - премиум подписки
+Рассылка - отправка сообщений пользователям
+
+Статус: {'ВКЛЮЧЕН' if bot_enabled else 'ВЫКЛЮЧЕН'}
+Пользователей: {len(user_stats)}
+Премиум: {len(premium_users)}
+Загрузок: {self.download_scheduler.active} активно, {self.download_scheduler.queued} в очереди
+        """
+        if download_progress:
+            admin_text += "\nАктивные загрузки:\n"
+            for download_id, progress in list(download_progress.items())[:10]:
+                admin_text += f"• {download_id}: {format_progress(progress)}\n"
+        await update.message.reply_text(admin_text, reply_markup=self.get_admin_keyboard())
+
+    async def prefetch_metadata(self, url: str) -> dict:
+        """Получение метаданных видео из кеша или в пуле потоков (None - воркер извлечет их сам)"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, get_video_metadata, url)
+        except Exception as e:
+            logger.warning(f"Не удалось получить метаданные видео: {e}")
+            return None
+
+    async def run_process_download(self, worker_func, download_id, *args, timeout=600, status_message=None, user_id=None, **kwargs):
+        """Запуск загрузки через очередь и пул процессов с таймаутом без блокировки цикла событий
+        (каталог temp_dir и метаданные info передаются воркеру именованными аргументами)"""
+        original_text = status_message.text if status_message else None
+        
+        async def on_position(position: int, eta: float):
+            try:
+                await status_message.edit_text(format_queue_message(position, eta), reply_markup=self.get_cancel_keyboard())
+            except Exception as e:
+                logger.debug(f"Не удалось обновить позицию в очереди: {e}")
+        
+        progress_edits = []
+        
+        def on_progress(progress: dict):
+            download_progress[download_id] = dict(progress, updated_at=time.time())
+            if not status_message:
+                return
+            # Смена этапа показывается сразу, байты - не чаще раза в PROGRESS_EDIT_INTERVAL на чат
+            now = time.monotonic()
+            chat_id = status_message.chat_id
+            if progress.get('stage') == 'downloading' and now - self.progress_edited_at.get(chat_id, 0) < PROGRESS_EDIT_INTERVAL:
+                return
+            self.progress_edited_at[chat_id] = now
+            if len(self.progress_edited_at) > 1000:
+                self.progress_edited_at = {chat: edited_at for chat, edited_at in self.progress_edited_at.items()
+                                           if now - edited_at < PROGRESS_EDIT_INTERVAL}
+            progress_edits.append(asyncio.create_task(
+                self.edit_status(status_message, f"{original_text}\n{format_progress(progress)}", self.get_cancel_keyboard())
+            ))
+        
+        job = None
+        try:
+            job = await self.download_scheduler.acquire(
+                on_position if status_message else None,
+                user_id=user_id,
+                user_type=get_user_type(user_id) if user_id is not None else 'free'
+            )
+            await self.journal.set_state_async(current_job.get(), 'downloading')
+            
+            # Если задача ждала в очереди - возвращаем исходный текст статуса
+            if status_message and job['started_at'] - job['enqueued_at'] > 0.5:
+                try:
+                    await status_message.edit_text(original_text, reply_markup=self.get_cancel_keyboard())
+                except Exception:
+                    pass
+            
+            result = await self.download_pool.submit(
+                worker_func, *args,
+                timeout=timeout,
+                download_id=download_id,
+                on_progress=on_progress,
+                **kwargs
+            )
+            if result.get('success'):
+                media_cache_stats['hits' if result.get('from_cache') else 'misses'] += 1
+            return result
+        except asyncio.CancelledError:
+            logger.info(f"Загрузка {download_id} отменена")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка в run_process_download: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            if job is not None:
+                self.download_scheduler.release(job)
+            download_progress.pop(download_id, None)
+            # Запоздавшее обновление прогресса не должно затереть следующий статус
+            pending = [task for task in progress_edits if not task.done()]
+            if pending:
+                done, pending = await asyncio.wait(pending, timeout=5)
+                for task in pending:
+                    task.cancel()
+
+    async def edit_status(self, status_message, text: str, reply_markup=None):
+        """Обновление статусного сообщения без ошибки, если оно удалено или не изменилось"""
+        try:
+            await status_message.edit_text(text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.debug(f"Не удалось обновить статус загрузки: {e}")
+
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Основной обработчик текстовых сообщений"""
+        user_message = update.message.text
+        user_id = update.message.from_user.id
+        username = update.message.from_user.username or "Unknown"
+        
+        # Проверка длины сообщения
+        if len(user_message) > 1000:
+            await update.message.reply_text("Сообщение слишком длинное...")
+            return
+        
+        # Проверка блокировки пользователя
+        if self.is_user_blocked(user_id):
+            await update.message.reply_text("К сожалению, вы заблокированы и не можете использовать бота...")
+            return
+        
+        # Проверка включен ли бот
+        if not bot_enabled and not self.is_admin(user_id):
+            await update.message.reply_text("Бот временно отключен... Попробуйте позже!")
+            return
+        
+        # Проверка ограничения частоты запросов
+        if not check_rate_limit(user_id):
+            await update.message.reply_text("Слишком много запросов... Подождите минуту!")
+            return
+        
+        # Обработка команд администратора
+        if self.is_admin(user_id):
+            # ... (обработка админских команд)
+            pass
+        
+        # Обработка основных команд пользователя
+        if user_message == "Поздороваться":
+            await self.start_command(update, context)
+            return
+        
+        if not context.user_data.get('greeted'):
+            welcome_text = "Нажми кнопку 'Поздороваться' чтобы начать..."
+            await update.message.reply_text(welcome_text, reply_markup=self.get_welcome_keyboard())
+            return
+        
+        # Обработка основных действий пользователя
+        if user_message == "Главное меню":
+            await self.start_command(update, context)
+            return
+        elif user_message == "Помощь":
+            await self.help_command(update, context)
+            return
+        elif user_message == "Премиум":
+            await self.premium_info(update, context)
+            return
+        elif user_message == "История загрузок":
+            await self.show_history(update, context)
+            return
+        elif user_message == "Информация о видео":
+            await self.video_info_command(update, context)
+            return
+        elif user_message == "Скачать видео":
+            # Проверка лимита запросов
+            if not can_make_request(user_id):
+                remaining = get_remaining_requests(user_id)
+                await update.message.reply_text(
+                    f"Лимит запросов исчерпан... Осталось: {remaining}\n"
+                    f"Приобретите премиум для увеличения лимита!",
+                    reply_markup=self.get_main_keyboard()
+                )
+                return
+            
+            context.user_data['awaiting_quality'] = True
+            context.user_data['download_type'] = 'video'
+            increment_request_count(user_id)
+            update_user_stats(user_id, username, 'video_menu')
+            await update.message.reply_text(
+                "Выбери качество видео...",
+                reply_markup=self.get_quality_keyboard()
+            )
+            return
+        elif user_message == "Скачать аудио":
+            if not can_make_request(user_id):
+                remaining = get_remaining_requests(user_id)
+                await update.message.reply_text(
+                    f"Лимит запросов исчерпан... Осталось: {remaining}\n"
+                    f"Приобретите премиум для увеличения лимита!",
+                    reply_markup=self.get_main_keyboard()
+                )
+                return
+            
+            context.user_data['awaiting_url'] = True
+            context.user_data['download_type'] = 'audio'
+            increment_request_count(user_id)
+            update_user_stats(user_id, username, 'audio_menu')
+            await update.message.reply_text(
+                "Отправь ссылку на видео для конвертации в MP3...",
+                reply_markup=self.get_main_keyboard()
+            )
+            return
+        elif user_message == "Назад":
+            if context.user_data.get('awaiting_quality'):
+                context.user_data['awaiting_quality'] = False
+            await update.message.reply_text(
+                "Возвращаюсь в главное меню...",
+                reply_markup=self.get_main_keyboard()
+            )
+            return
+
+        # Обработка выбора качества видео
+        if context.user_data.get('awaiting_quality'):
+            context.user_data['awaiting_quality'] = False
+            context.user_data['awaiting_url'] = True
+            
+            if user_message == "Авто качество":
+                context.user_data['quality'] = None
+                await update.message.reply_text(
+                    "Отправь ссылку на видео (автоматический подбор качества)...",
+                    reply_markup=self.get_main_keyboard()
+                )
+            elif user_message in ["1080p", "720p", "480p", "360p", "240p"]:
+                quality = user_message.replace('p', '')
+                context.user_data['quality'] = quality
+                await update.message.reply_text(
+                    f"Отправь ссылку на видео (будет скачано в {quality}p)...",
+                    reply_markup=self.get_main_keyboard()
+                )
+            return
+
+        # Обработка ссылки для получения информации о видео
+        if context.user_data.get('awaiting_info_url'):
+            context.user_data['awaiting_info_url'] = False
+            await self.process_video_info(update, user_message, user_id, username)
+            return
+
+        # Проверка валидности URL
+        if not self.is_valid_youtube_url(user_message):
+            await update.message.reply_text(
+                "Пожалуйста, отправь корректную ссылку на видео с YouTube, TikTok или RUTube...",
+                reply_markup=self.get_main_keyboard()
+            )
+            return
+
+        # Обработка URL для загрузки
+        if context.user_data.get('awaiting_url'):
+            context.user_data['awaiting_url'] = False
+            download_type = context.user_data.get('download_type')
+            # Одно и то же видео по разным ссылкам дает одну запись в истории, кешах и очереди
+            url = await self.resolve_url(user_message)
+            
+            if download_type in ('video', 'audio'):
+                quality = context.user_data.get('quality') if download_type == 'video' else None
+                await self.run_coalesced(
+                    update, url, download_type, quality, user_id, username,
+                    self.make_process(update, url, download_type, quality, user_id, username)
+                )
+        else:
+            await update.message.reply_text(
+                "Сначала выбери тип загрузки через меню...",
+                reply_markup=self.get_main_keyboard()
+            )
+
+    async def broadcast_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message: str, target: str):
+        """Рассылка сообщений пользователям"""
+        if not message.strip():
+            await update.message.reply_text("Сообщение не может быть пустым...", reply_markup=self.get_admin_broadcast_keyboard())
+            return
+    
+        status_msg = await update.message.reply_text(f"Начинаю рассылку для {target}...")
+    
+        try:
+            sent_count = 0
+            failed_count = 0
+            total_users = 0
+        
+            # Рассылка сообщений выбранной группе пользователей
+            for user_id in user_stats.keys():
+                user_type = get_user_type(user_id)
+            
+                if target == 'all' or (target == 'premium' and user_type == 'premium') or (target == 'free' and user_type == 'free'):
+                    total_users += 1
+                
+                    try:
+                        await context.bot.send_message(
+                            chat_id=user_id,
+                            text=f"Сообщение от администратора:\n\n{message}\n\n— Бот UwU botyk"
+                        )
+                        sent_count += 1
+                        await asyncio.sleep(0.1)  # Задержка чтобы не превысить лимиты Telegram
+                    except Exception as e:
+                        failed_count += 1
+        
+            await status_msg.delete()
+            await update.message.reply_text(
+                f"Рассылка завершена!\n\n"
+                f"Статистика:\n"
+                f"• Целевая группа: {target}\n"
+                f"• Всего пользователей: {total_users}\n"
+                f"• Успешно отправлено: {sent_count}\n"
+                f"• Не удалось отправить: {failed_count}",
+                reply_markup=self.get_admin_broadcast_keyboard()
+            )
+        
+        except Exception as e:
+            logger.error(f"Ошибка при рассылке: {e}")
+            await status_msg.delete()
+            await update.message.reply_text(
+                f"Ошибка при рассылке: {str(e)}",
+                reply_markup=self.get_admin_broadcast_keyboard()
+            )
+
+    async def process_video_info(self, update: Update, url: str, user_id: int, username: str):
+        """Обработка запроса информации о видео"""
+        if not self.is_valid_youtube_url(url):
+            await update.message.reply_text(
+                "Пожалуйста, отправь корректную ссылку на видео...",
+                reply_markup=self.get_main_keyboard()
+            )
+            return
+        
+        status_message = await update.message.reply_text("Получаю информацию о видео...")
+        url = await self.resolve_url(url)
+        
+        try:
+            loop = asyncio.get_running_loop()
+            info = await loop.run_in_executor(None, get_video_info, url)
+            
+            if info['success']:
+                info_text = f"""
+ИНФОРМАЦИЯ О ВИДЕО:
+
+Название: {info['title']}
+Автор: {info['author']}
+Длительность: {info['duration']}
+Просмотры: {info['views']:,}
+Дата публикации: {info['upload_date']}
+Описание: {info['description']}
+                """
+                
+                add_to_history(user_id, url, info['title'], 'info', success=True)
+                await status_message.edit_text(info_text)
+            else:
+                log_error(user_id, username, 'video_info_error', info['error'], url)
+                add_to_history(user_id, url, 'Ошибка', 'info', success=False)
+                await status_message.edit_text("Не удалось получить информацию о видео...")
+                await update.message.reply_text(
+                    "Попробуй другую ссылку...",
+                    reply_markup=self.get_main_keyboard()
+                )
+                
+        except Exception as e:
+            logger.error(f"Ошибка при получении информации о видео: {e}")
+            log_error(user_id, username, 'video_info_processing_error', str(e), url)
+            add_to_history(user_id, url, 'Ошибка', 'info', success=False)
+            await status_message.edit_text("Произошла ошибка при получении информации...")
+            await update.message.reply_text(
+                "Попробуй еще раз...",
+                reply_markup=self.get_main_keyboard()
+            )
+
+    async def add_premium(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
+        """Выдача премиум подписки пользователю"""
+        if not user_input:
+            await update.message.reply_text("Введите ID пользователя или @username...", reply_markup=self.get_admin_premium_keyboard())
+            return
+        
+        user_input = user_input.strip()
+        
+        if user_input.isdigit():
+            # Обработка по ID пользователя
+            user_id = int(user_input)
+            
+            if user_id in premium_users:
+                expiry_date = datetime.datetime.fromtimestamp(premium_users[user_id]).strftime("%Y-%m-%d %H:%M:%S")
+                await update.message.reply_text(
+                    f"Пользователь уже имеет премиум до {expiry_date}...",
+                    reply_markup=self.get_admin_premium_keyboard()
+                )
+                return
+            
+            if user_id not in user_stats:
+                await update.message.reply_text(
+                    f"Пользователь с ID {user_id} не найден в базе...",
+                    reply_markup=self.get_admin_premium_keyboard()
+                )
+                return
+            
+            # Выдача премиум на 30 дней
+            expiry = datetime.datetime.now() + datetime.timedelta(days=30)
+            premium_users[user_id] = expiry.timestamp()
+            save_premium_users(user_id)
+            
+            username = user_stats.get(user_id, {}).get('username', 'Unknown')
+            await update.message.reply_text(
+                f"Пользователь @{username} (ID: {user_id}) получил премиум на 30 дней!", 
+                reply_markup=self.get_admin_premium_keyboard()
+            )
+        
+        else:
+            # Обработка по username
+            found_users = find_user_by_username(user_input)
+            
+            if not found_users:
+                await update.message.reply_text(
+                    f"Пользователь с username '{user_input}' не найден...\n\n"
+                    f"Убедитесь, что пользователь хотя бы раз использовал бота...",
+                    reply_markup=self.get_admin_premium_keyboard()
+                )
+                return
+            
+            if len(found_users) > 1:
+                # Если найдено несколько пользователей
+                users_text = "Найдено несколько пользователей:\n\n"
+                for i, user in enumerate(found_users[:5], 1):
+                    has_premium = " 💎" if user['user_id'] in premium_users else ""
+                    users_text += f"{i}. @{user['username']}{has_premium} (ID: {user['user_id']})\n"
+                
+                users_text += "\nВведите ID пользователя для точного выбора..."
+                await update.message.reply_text(users_text, reply_markup=self.get_admin_premium_keyboard())
+                return
+            
+            user = found_users[0]
+            user_id = user['user_id']
+            
+            if user_id in premium_users:
+                expiry_date = datetime.datetime.fromtimestamp(premium_users[user_id]).strftime("%Y-%m-%d %H:%M:%S")
+                await update.message.reply_text(
+                    f"Пользователь @{user['username']} уже имеет премиум до {expiry_date}...",
+                    reply_markup=self.get_admin_premium_keyboard()
+                )
+                return
+            
+            expiry = datetime.datetime.now() + datetime.timedelta(days=30)
+            premium_users[user_id] = expiry.timestamp()
+            save_premium_users(user_id)
+            
+            await update.message.reply_text(
+                f"Пользователь @{user['username']} (ID: {user_id}) получил премиум на 30 дней!", 
+                reply_markup=self.get_admin_premium_keyboard()
+            )
+
+    async def remove_premium(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
+        """Удаление премиум подписки у пользователя"""
+        if not user_input:
+            await update.message.reply_text("Введите ID пользователя или @username...", reply_markup=self.get_admin_premium_keyboard())
+            return
+        
+        user_input = user_input.strip()
+        
+        if user_input.isdigit():
+            user_id = int(user_input)
+            
+            if user_id in premium_users:
+                del premium_users[user_id]
+                save_premium_users(user_id)
+                username = user_stats.get(user_id, {}).get('username', 'Unknown')
+                await update.message.reply_text(
+                    f"Премиум удален у пользователя @{username} (ID: {user_id})...", 
+                    reply_markup=self.get_admin_premium_keyboard()
+                )
+            else:
+                await update.message.reply_text("Пользователь не имеет премиум...", reply_markup=self.get_admin_premium_keyboard())
+        
+        else:
+            found_users = find_user_by_username(user_input)
+            
+            if not found_users:
+                await update.message.reply_text(
+                    f"Пользователь с username '{user_input}' не найден...\n\n"
+                    f"Убедитесь, что пользователь хотя бы раз использовал бота...",
+                    reply_markup=self.get_admin_premium_keyboard()
+                )
+                return
+            
+            if len(found_users) > 1:
+                users_text = "Найдено несколько пользователей:\n\n"
+                for i, user in enumerate(found_users[:5], 1):
+                    has_premium = " 💎" if user['user_id'] in premium_users else ""
+                    users_text += f"{i}. @{user['username']}{has_premium} (ID: {user['user_id']})\n"
+                
+                users_text += "\nВведите ID пользователя для точного выбора..."
+                await update.message.reply_text(users_text, reply_markup=self.get_admin_premium_keyboard())
+                return
+            
+            user = found_users[0]
+            user_id = user['user_id']
+            
+            if user_id in premium_users:
+                del premium_users[user_id]
+                save_premium_users(user_id)
+                await update.message.reply_text(
+                    f"Премиум удален у пользователя @{user['username']} (ID: {user_id})...", 
+                    reply_markup=self.get_admin_premium_keyboard()
+                )
+            else:
+                await update.message.reply_text(
+                    f"Пользователь @{user['username']} не имеет премиум...", 
+                    reply_markup=self.get_admin_premium_keyboard()
+                )
+
+    async def show_premium_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать список премиум пользователей"""
+        if not premium_users:
+            await update.message.reply_text("Нет премиум пользователей...", reply_markup=self.get_admin_premium_keyboard())
+            return
+        
+        premium_text = "ПРЕМИУМ ПОЛЬЗОВАТЕЛИ:\n\n"
+        for i, (user_id, expiry) in enumerate(list(premium_users.items())[:20], 1):
+            stats = user_stats.get(user_id, {})
+            username = stats.get('username', 'Unknown')
+            expiry_date = datetime.datetime.fromtimestamp(expiry).strftime("%Y-%m-%d %H:%M:%S")
+            premium_text += f"{i}. @{username} (ID: {user_id})\n"
+            premium_text += f"   Действует до: {expiry_date}\n"
+            if stats:
+                premium_text += f"   Запросов: {stats.get('total_requests', 0)}\n"
+            premium_text += "\n"
+        
+        await update.message.reply_text(premium_text, reply_markup=self.get_admin_premium_keyboard())
+
+    async def block_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
+        """Блокировка пользователя"""
+        if not user_input:
+            await update.message.reply_text("Введите ID пользователя или @username...", reply_markup=self.get_admin_block_keyboard())
+            return
+        
+        user_input = user_input.strip()
+        
+        if user_input.isdigit():
+            user_id = int(user_input)
+            
+            if user_id in ADMIN_IDS:
+                await update.message.reply_text("Нельзя заблокировать администратора...", reply_markup=self.get_admin_block_keyboard())
+                return
+            
+            blocked_users.add(user_id)
+            save_blocked_users(user_id)
+            
+            username = user_stats.get(user_id, {}).get('username', 'Unknown')
+            await update.message.reply_text(
+                f"Пользователь {username} (ID: {user_id}) заблокирован...", 
+                reply_markup=self.get_admin_block_keyboard()
+            )
+        
+        else:
+            found_users = find_user_by_username(user_input)
+            
+            if not found_users:
+                await update.message.reply_text(
+                    f"Пользователь с username '{user_input}' не найден...",
+                    reply_markup=self.get_admin_block_keyboard()
+                )
+                return
+            
+            if len(found_users) > 1:
+                users_text = "Найдено несколько пользователей:\n\n"
+                for i, user in enumerate(found_users[:5], 1):
+                    users_text += f"{i}. @{user['username']} (ID: {user['user_id']})\n"
+                
+                users_text += "\nВведите ID пользователя для точного выбора..."
+                await update.message.reply_text(users_text, reply_markup=self.get_admin_block_keyboard())
+                return
+            
+            user = found_users[0]
+            user_id = user['user_id']
+            
+            if user_id in ADMIN_IDS:
+                await update.message.reply_text("Нельзя заблокировать администратора...", reply_markup=self.get_admin_block_keyboard())
+                return
+            
+            blocked_users.add(user_id)
+            save_blocked_users(user_id)
+            
+            await update.message.reply_text(
+                f"Пользователь @{user['username']} (ID: {user_id}) заблокирован...", 
+                reply_markup=self.get_admin_block_keyboard()
+            )
+
+    async def unblock_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
+        """Разблокировка пользователя"""
+        if not user_input:
+            await update.message.reply_text("Введите ID пользователя или @username...", reply_markup=self.get_admin_block_keyboard())
+            return
+        
+        user_input = user_input.strip()
+        
+        if user_input.isdigit():
+            user_id = int(user_input)
+            
+            if user_id in blocked_users:
+                blocked_users.remove(user_id)
+                save_blocked_users(user_id)
+                username = user_stats.get(user_id, {}).get('username', 'Unknown')
+                await update.message.reply_text(
+                    f"Пользователь {username} (ID: {user_id}) разблокирован!", 
+                    reply_markup=self.get_admin_block_keyboard()
+                )
+            else:
+                await update.message.reply_text("Пользователь не заблокирован...", reply_markup=self.get_admin_block_keyboard())
+        
+        else:
+            found_users = find_user_by_username(user_input)
+            
+            if not found_users:
+                await update.message.reply_text(
+                    f"Пользователь с username '{user_input}' не найден...",
+                    reply_markup=self.get_admin_block_keyboard()
+                )
+                return
+            
+            if len(found_users) > 1:
+                users_text = "Найдено несколько пользователей:\n\n"
+                for i, user in enumerate(found_users[:5], 1):
+                    is_blocked = " 🚫" if user['user_id'] in blocked_users else ""
+                    users_text += f"{i}. @{user['username']}{is_blocked} (ID: {user['user_id']})\n"
+                
+                users_text += "\nВведите ID пользователя для точного выбора..."
+                await update.message.reply_text(users_text, reply_markup=self.get_admin_block_keyboard())
+                return
+            
+            user = found_users[0]
+            user_id = user['user_id']
+            
+            if user_id in blocked_users:
+                blocked_users.remove(user_id)
+                save_blocked_users(user_id)
+                await update.message.reply_text(
+                    f"Пользователь @{user['username']} (ID: {user_id}) разблокирован!", 
+                    reply_markup=self.get_admin_block_keyboard()
+                )
+            else:
+                await update.message.reply_text(
+                    f"Пользователь @{user['username']} не заблокирован...", 
+                    reply_markup=self.get_admin_block_keyboard()
+                )
+
+    async def show_statistics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать общую статистику бота"""
+        total_users = len(user_stats)
+        total_videos = sum(stats.get('video_downloads', 0) for stats in user_stats.values())
+        total_audio = sum(stats.get('audio_downloads', 0) for stats in user_stats.values())
+        total_requests = sum(stats.get('total_requests', 0) for stats in user_stats.values())
+        success_rate = (sum(stats.get('successful_requests', 0) for stats in user_stats.values()) / total_requests * 100) if total_requests > 0 else 0
+        
+        today_requests = quota_store.total
+        yesterday_requests = quota_store.archive.get(quota_store.prev_day, {}).get('requests', 0)
+        queue = self.download_scheduler.get_metrics()
+        wait_by_type = '\n'.join(f"Ожидание ({user_type}): среднее {avg:.1f} сек, максимум {longest:.1f} сек"
+                                 for user_type, (jobs, avg, longest) in queue['wait_by_type'].items())
+        cache_requests = delivery_cache_stats['hits'] + delivery_cache_stats['misses']
+        cache_hit_rate = (delivery_cache_stats['hits'] / cache_requests * 100) if cache_requests > 0 else 0
+        media_files, media_bytes = await asyncio.get_running_loop().run_in_executor(None, media_cache.usage)
+        latencies = sorted(update_latency)
+        latency_avg = sum(latencies) / len(latencies) if latencies else 0.0
+        latency_p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+        workers_text = ""
+        if WORKER_MODE == 'remote':
+            workers = await self.download_pool.get_metrics()
+            workers_text = f"\nУзлы-загрузчики ({JOB_QUEUE_BACKEND}): в общей очереди {workers['queued']}, выполняется {workers['running']} (узлов: {workers['nodes']})"
+        
+        stats_text = f"""
+ОБЩАЯ СТАТИСТИКА БОТА:
+
+Пользователей: {total_users}
+Премиум: {len(premium_users)}
+Видео скачано: {total_videos}
+Аудио скачано: {total_audio}
+Всего запросов: {total_requests}
+Запросов сегодня: {today_requests} (вчера: {yesterday_requests})
+Успешных: {success_rate:.1f}%
+Заблокировано: {len(blocked_users)}
+{'Бот включен' if bot_enabled else 'Бот выключен'}
+Отклонено по частоте сообщений: {rate_limiter.rejected} (пользователей в ограничителе: {len(rate_limiter.full_at)})
+
+Очередь загрузок:
+Выполняется: {queue['active']}/{self.download_scheduler.max_concurrent}
+В очереди: {queue['queue_depth']} (максимум {queue['max_queue_depth']})
+Загрузок всего: {queue['total_jobs']} (ждали в очереди: {queue['queued_jobs']})
+Среднее ожидание: {queue['avg_wait']:.1f} сек
+Максимальное ожидание: {queue['max_wait']:.1f} сек
+Пользователей в очереди: {queue['queued_users']}
+{wait_by_type}{workers_text}
+
+Кеш повторной отправки:
+Файлов в кеше: {len(delivery_cache)}
+Попаданий: {delivery_cache_stats['hits']} из {cache_requests} ({cache_hit_rate:.1f}%)
+
+Кеш метаданных:
+Видео в кеше: {len(metadata_cache.entries)}
+Попаданий: {metadata_cache.hits}, промахов: {metadata_cache.misses}
+
+Отправка файлов:
+Отправлено: {upload_stats['uploads']} ({upload_stats['bytes'] / (1024 * 1024):.1f} MB), ошибок: {upload_stats['failed']}
+Средняя скорость: {upload_stats['bytes'] / (1024 * 1024) / upload_stats['seconds'] if upload_stats['seconds'] else 0:.1f} MB/s, последняя: {upload_stats['last_speed']:.1f} MB/s
+
+Кеш файлов:
+Файлов: {media_files}, занято: {media_bytes / (1024 * 1024):.1f} из {MEDIA_CACHE_SIZE} MB
+Загрузок из кеша: {media_cache_stats['hits']}, из сети: {media_cache_stats['misses']}
+Присоединено к идущим загрузкам: {coalesce_stats['joined']} (получили файл: {coalesce_stats['delivered']})
+Отменено пользователями: {cancel_stats['cancelled']}
+
+Доставка обновлений ({BOT_MODE}):
+Средняя задержка: {latency_avg:.2f} сек, 95%: {latency_p95:.2f} сек
+
+Сжатие видео:
+ffmpeg: {'найден' if FFMPEG_PATH else 'не найден'}
+Скорость загрузки: {media_speed['download']:.1f} MB/s
+Скорость сжатия: {media_speed['transcode']:.1f}x реального времени
+        """
+        await update.message.reply_text(stats_text, reply_markup=self.get_admin_keyboard())
+
+    async def show_general_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать общую статистику пользователей"""
+        total_users = len(user_stats)
+        active_today = len([stats for stats in user_stats.values() 
+                          if datetime.datetime.now().strftime("%Y-%m-%d") in stats.get('last_activity', '')])
+        
+        stats_text = f"""
+ОБЩАЯ СТАТИСТИКА:
+
+Всего пользователей: {total_users}
+Премиум пользователей: {len(premium_users)}
+Активных сегодня: {active_today}
+Заблокированных: {len(blocked_users)}
+Последняя активность: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}
+        """
+        await update.message.reply_text(stats_text, reply_markup=self.get_admin_users_keyboard())
+
+    async def show_top_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать топ пользователей по количеству запросов"""
+        if not user_stats:
+            await update.message.reply_text("Данных о пользователях пока нет...", reply_markup=self.get_admin_users_keyboard())
+            return
+        
+        top_users = sorted(user_stats.items(), key=lambda x: x[1].get('total_requests', 0), reverse=True)[:10]
+        
+        top_text = "ТОП-10 ПОЛЬЗОВАТЕЛЕЙ:\n\n"
+        for i, (user_id, stats) in enumerate(top_users, 1):
+            username = stats.get('username', 'Unknown')
+            videos = stats.get('video_downloads', 0)
+            audio = stats.get('audio_downloads', 0)
+            total = stats.get('total_requests', 0)
+            user_type = stats.get('user_type', 'free')
+            premium_badge = " 💎" if user_type == 'premium' else ""
+            
+            top_text += f"{i}. @{username}{premium_badge} (ID: {user_id})\n"
+            top_text += f"   Запросов: {total} (🎥{videos} 🎵{audio})\n"
+            top_text += f"   Последняя активность: {stats.get('last_activity', 'N/A')}\n\n"
+        
+        await update.message.reply_text(top_text, reply_markup=self.get_admin_users_keyboard())
+
+    async def search_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, search_query: str):
+        """Поиск пользователя по ID или username"""
+        found_users = []
+        
+        if search_query.isdigit():
+            user_id = int(search_query)
+            if user_id in user_stats:
+                found_users.append((user_id, user_stats[user_id]))
+        
+        for user_id, stats in user_stats.items():
+            if search_query.lower() in stats.get('username', '').lower():
+                found_users.append((user_id, stats))
+        
+        if not found_users:
+            await update.message.reply_text("Пользователь не найден...", reply_markup=self.get_admin_users_keyboard())
+            return
+        
+        user_text = "НАЙДЕННЫЕ ПОЛЬЗОВАТЕЛИ:\n\n"
+        for user_id, stats in found_users[:5]:
+            username = stats.get('username', 'Unknown')
+            videos = stats.get('video_downloads', 0)
+            audio = stats.get('audio_downloads', 0)
+            total = stats.get('total_requests', 0)
+            success = stats.get('successful_requests', 0)
+            failed = stats.get('failed_requests', 0)
+            user_type = stats.get('user_type', 'free')
+            blocked = "🚫" if self.is_user_blocked(user_id) else "✅"
+            premium_badge = " 💎" if user_type == 'premium' else ""
+            
+            user_text += f"{blocked} @{username}{premium_badge} (ID: {user_id})\n"
+            user_text += f"   Первый визит: {stats.get('first_seen', 'N/A')}\n"
+            user_text += f"   Последняя активность: {stats.get('last_activity', 'N/A')}\n"
+            user_text += f"   Статистика: {total} запросов ({success}✅/{failed}❌)\n"
+            user_text += f"   Загрузки: {videos} видео, {audio} аудио\n\n"
+        
+        await update.message.reply_text(user_text, reply_markup=self.get_admin_users_keyboard())
+
+    async def show_blocked_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать список заблокированных пользователей"""
+        if not blocked_users:
+            await update.message.reply_text("Нет заблокированных пользователей...", reply_markup=self.get_admin_block_keyboard())
+            return
+        
+        blocked_text = "ЗАБЛОКИРОВАННЫЕ ПОЛЬЗОВАТЕЛИ:\n\n"
+        for i, user_id in enumerate(list(blocked_users)[:20], 1):
+            stats = user_stats.get(user_id, {})
+            username = stats.get('username', 'Unknown')
+            blocked_text += f"{i}. @{username} (ID: {user_id})\n"
+            if stats:
+                blocked_text += f"   Последняя активность: {stats.get('last_activity', 'N/A')}\n"
+            blocked_text += "\n"
+        
+        await update.message.reply_text(blocked_text, reply_markup=self.get_admin_block_keyboard())
+
+    async def toggle_bot(self, update: Update, context: ContextTypes.DEFAULT_TYPE, enable: bool):
+        """Включение/выключение бота"""
+        global bot_enabled
+        bot_enabled = enable
+        save_bot_state()
+        
+        status_text = "включен" if enable else "выключен"
+        await update.message.reply_text(
+            f"Бот {status_text}!", 
+            reply_markup=self.get_admin_control_keyboard()
+        )
+
+    async def show_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать настройки бота"""
+        settings_text = f"""
+НАСТРОЙКИ БОТА:
+
+Статус: {'ВКЛЮЧЕН' if bot_enabled else 'ВЫКЛЮЧЕН'}
+Заблокированных: {len(blocked_users)}
+Всего пользователей: {len(user_stats)}
+Премиум пользователей: {len(premium_users)}
+Ошибок в логе: {len(error_log)}
+
+Используйте меню ниже для управления ботом...
+        """
+        await update.message.reply_text(settings_text, reply_markup=self.get_admin_keyboard())
+
+    async def show_error_logs(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать логи ошибок"""
+        if not error_log:
+            await update.message.reply_text("Логов ошибок нет...", reply_markup=self.get_admin_keyboard())
+            return
+        
+        error_text = "ПОСЛЕДНИЕ ОШИБКИ:\n\n"
+        for i, error in enumerate(error_log[-10:], 1):
+            error_text += f"{i}. {error['timestamp']}\n"
+            error_text += f"   👤 {error['username']} (ID: {error['user_id']})\n"
+            error_text += f"   🚨 {error['error_type']}\n"
+            error_text += f"   📝 {error['error_message'][:100]}...\n"
+            if error['url']:
+                error_text += f"   🔗 {error['url'][:50]}...\n"
+            error_text += "\n"
+        
+        await update.message.reply_text(error_text, reply_markup=self.get_admin_keyboard())
+
+    async def run_cancellable(self, user_id: int, job_id: str, coro) -> bool:
+        """Выполнение загрузки пользователя отдельной задачей, которую можно отменить через /cancel
+        или кнопкой под ее статусом; False - задача отменена"""
+        task = asyncio.ensure_future(coro)
+        self.user_jobs.setdefault(user_id, {})[job_id] = task
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            tasks = self.user_jobs.get(user_id)
+            if tasks is not None and tasks.get(job_id) is task:
+                del tasks[job_id]
+                self.status_messages.pop(job_id, None)
+                if not tasks:
+                    del self.user_jobs[user_id]
+        if task.cancelled():
+            if task in self.user_cancelled:
+                self.user_cancelled.discard(task)
+                return False
+            # Отменена не пользователем (остановка бота) - запись журнала остается незавершенной
+            raise asyncio.CancelledError()
+        task.result()
+        return True
+
+    def record_cancel(self, user_id: int, url: str, download_type: str, quality: str):
+        """Учет отмененной пользователем загрузки в истории и статистике"""
+        cancel_stats['cancelled'] += 1
+        add_to_history(user_id, url, 'Отменено', download_type, quality, False)
+
+    def make_process(self, update: Update, url: str, download_type: str, quality: str, user_id: int, username: str):
+        """Функция запуска загрузки нужного типа (используется и при продолжении после перезапуска)"""
+        if download_type == 'audio':
+            return lambda: self.process_audio_download(update, url, user_id, username)
+        if quality:
+            return lambda: self.process_video_quality_download(update, url, quality, user_id, username)
+        return lambda: self.process_video_auto_download(update, url, user_id, username)
+
+    async def resume_jobs(self):
+        """Продолжение загрузок, не завершенных до остановки бота"""
+        pending = await asyncio.get_running_loop().run_in_executor(None, self.journal.pending)
+        for job in pending:
+            job_id = job['job_id']
+            try:
+                message = Message.de_json(json.loads(job['message']), self.application.bot)
+            except Exception as e:
+                logger.error(f"Не удалось восстановить загрузку {job_id}: {e}")
+                await self.journal.set_state_async(job_id, 'failed')
+                continue
+            
+            if time.time() - job['created'] > JOB_RESUME_MAX_AGE or job['attempts'] >= JOB_MAX_ATTEMPTS:
+                await self.journal.set_state_async(job_id, 'failed')
+                shutil.rmtree(os.path.join(JOBS_DIR, job_id), ignore_errors=True)
+                add_to_history(job['user_id'], job['url'], 'Прервано перезапуском', job['download_type'], job['quality'], False)
+                with contextlib.suppress(Exception):
+                    await message.reply_text(
+                        "Загрузка прервалась из-за перезапуска бота... Отправь ссылку еще раз!",
+                        reply_markup=self.get_main_keyboard()
+                    )
+                continue
+            
+            logger.info(f"Продолжение загрузки {job_id} (состояние {job['state']}, попытка {job['attempts'] + 1})")
+            with contextlib.suppress(Exception):
+                await message.reply_text("Бот был перезапущен... Продолжаю твою загрузку!")
+            update = Update(update_id=0, message=message)
+            task = asyncio.create_task(self.run_coalesced(
+                update, job['url'], job['download_type'], job['quality'], job['user_id'], job['username'],
+                self.make_process(update, job['url'], job['download_type'], job['quality'], job['user_id'], job['username'])
+            ))
+            self.resumed_tasks.add(task)
+            task.add_done_callback(self.resumed_tasks.discard)
+
+    async def run_job(self, job_id: str, process):
+        """Выполнение загрузки с привязкой к записи журнала"""
+        current_job.set(job_id)
+        await process()
+
+    async def run_coalesced(self, update: Update, url: str, download_type: str, quality: str, user_id: int, username: str, process):
+        """Загрузка с записью в журнал: при падении бота незавершенная запись продолжается после запуска"""
+        job_id = f"{update.message.chat_id}_{update.message.message_id}"
+        await self.journal.add_async(job_id, update, url, download_type, quality, user_id, username)
+        try:
+            completed = await self.coalesce(update, url, download_type, quality, user_id, username, process, job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self.journal.set_state_async(job_id, 'failed')
+            raise
+        await self.journal.set_state_async(job_id, 'done' if completed else 'cancelled')
+
+    async def coalesce(self, update: Update, url: str, download_type: str, quality: str, user_id: int, username: str,
+                       process, job_id: str) -> bool:
+        """Объединение одинаковых одновременных загрузок: первый запрос качает и отправляет файл,
+        остальные дожидаются его и получают файл по file_id; False - загрузка отменена пользователем"""
+        key = get_delivery_key(url, download_type, quality)
+        flight = self.inflight.get(key)
+        
+        if flight is None:
+            flight = asyncio.get_running_loop().create_future()
+            self.inflight[key] = flight
+            # Ожидающие запускают загрузку заново сами, только если ее отменил пользователь-инициатор;
+            # после ошибки они получают отказ, а не повторяют загрузку все разом
+            outcome = 'failed'
+            try:
+                completed = await self.run_cancellable(user_id, job_id, self.run_job(job_id, process))
+                outcome = 'done' if completed else 'cancelled'
+            except asyncio.CancelledError:
+                outcome = 'stopped'
+                raise
+            finally:
+                del self.inflight[key]
+                flight.set_result(outcome)
+            if not completed:
+                self.record_cancel(user_id, url, download_type, quality)
+            return completed
+        
+        coalesce_stats['joined'] += 1
+        status_message = await update.message.reply_text(
+            "Это видео уже загружается по запросу другого пользователя... Отправлю, как только будет готово!",
+            reply_markup=self.get_cancel_keyboard(job_id)
+        )
+        self.status_messages[job_id] = status_message
+        # Отмена ожидающего запроса не должна затрагивать саму загрузку
+        waited = await self.run_cancellable(user_id, job_id, asyncio.shield(flight))
+        with contextlib.suppress(Exception):
+            await status_message.delete()
+        if not waited:
+            self.record_cancel(user_id, url, download_type, quality)
+            return False
+        if flight.result() == 'cancelled':
+            return await self.coalesce(update, url, download_type, quality, user_id, username, process, job_id)
+        if flight.result() == 'stopped':
+            # Бот останавливается - запись журнала остается незавершенной и продолжится после запуска
+            raise asyncio.CancelledError()
+        
+        # Файл, полученный от идущей загрузки, - не попадание в кеш повторной отправки
+        if flight.result() == 'done' and await self.deliver_from_cache(update, url, download_type, quality, user_id, username,
+                                                                       count_hit=False):
+            coalesce_stats['delivered'] += 1
+            return True
+        
+        # Загрузка не удалась - учитываем неудачу и у присоединившегося пользователя
+        update_user_stats(user_id, username, download_type, False)
+        add_to_history(user_id, url, 'Ошибка загрузки', download_type, quality, False)
+        await update.message.reply_text(
+            "Не удалось загрузить это видео... Попробуй другое качество или другое видео!",
+            reply_markup=self.get_main_keyboard()
+        )
+        return True
+
+    def cancel_job(self, user_id: int, job_id: str):
+        """Отмена одной загрузки пользователя (в очереди или в процессе-загрузчике); None - такой загрузки уже нет"""
+        task = self.user_jobs.get(user_id, {}).get(job_id)
+        if task is None or task.done():
+            return None
+        self.user_cancelled.add(task)
+        task.cancel()
+        return task
+
+    def cancel_user_jobs(self, user_id: int) -> dict:
+        """Отмена всех загрузок пользователя: ID записи журнала -> отмененная задача"""
+        cancelled = {}
+        for job_id in list(self.user_jobs.get(user_id, {})):
+            task = self.cancel_job(user_id, job_id)
+            if task is not None:
+                cancelled[job_id] = task
+        return cancelled
+
+    async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка команды /cancel"""
+        user_id = update.message.from_user.id
+        cancelled = self.cancel_user_jobs(user_id)
+        if not cancelled:
+            await update.message.reply_text("Нет активных загрузок для отмены...", reply_markup=self.get_main_keyboard())
+            return
+        
+        status_messages = [self.status_messages[job_id] for job_id in cancelled if job_id in self.status_messages]
+        # Статус меняется после остановки задачи, чтобы запоздавшее обновление прогресса его не затерло
+        await asyncio.wait(cancelled.values(), timeout=10)
+        for status_message in status_messages:
+            with contextlib.suppress(Exception):
+                await status_message.edit_text("Загрузка отменена...")
+        await update.message.reply_text("Загрузка отменена!", reply_markup=self.get_main_keyboard())
+
+    async def cancel_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Нажатие кнопки отмены под статусом загрузки: отменяется только загрузка этого статуса"""
+        query = update.callback_query
+        job_id = query.data.partition(':')[2]
+        task = self.cancel_job(query.from_user.id, job_id)
+        if task is not None:
+            await query.answer("Загрузка отменена")
+            await asyncio.wait({task}, timeout=10)
+            with contextlib.suppress(Exception):
+                await query.edit_message_text("Загрузка отменена...")
+        else:
+            await query.answer("Загрузка уже завершена")
+            with contextlib.suppress(Exception):
+                await query.edit_message_reply_markup(None)
+
+    async def deliver_from_cache(self, update: Update, url: str, download_type: str, quality: str, user_id: int, username: str,
+                                 count_hit: bool = True) -> bool:
+        """Повторная отправка ранее загруженного файла по file_id без скачивания"""
+        cached = get_cached_delivery(url, download_type, quality, count_hit)
+        if not cached:
+            return False
+        
+        try:
+            if download_type == 'video':
+                caption = f"✅ {cached['title']} {cached['quality']}"
+                await update.message.reply_video(
+                    video=cached['file_id'],
+                    caption=caption,
+                    supports_streaming=True
+                )
+            else:
+                await update.message.reply_audio(
+                    audio=cached['file_id'],
+                    caption=f"🎵 {cached['title']}",
+                    title=cached['title'][:64],
+                    performer="YouTube"
+                )
+        except Exception as e:
+            # file_id мог стать недействительным - удаляем запись и скачиваем заново
+            logger.warning(f"Не удалось отправить по file_id: {e}")
+            drop_delivery(url, download_type, quality)
+            return False
+        
+        update_user_stats(user_id, username, download_type, True)
+        add_to_history(user_id, url, cached['title'], download_type, cached['quality'], True)
+        await update.message.reply_text(
+            "Видео успешно отправлено!" if download_type == 'video' else "Аудио успешно отправлено!",
+            reply_markup=self.get_main_keyboard()
+        )
+        return True
+
+    def remember_delivery(self, message, url: str, download_type: str, quality: str, title: str, sent_quality: str = None):
+        """Запоминание file_id отправленного файла для повторной отправки"""
+        media = getattr(message, download_type, None) or getattr(message, 'document', None)
+        if media is not None:
+            store_delivery(url, download_type, quality, media.file_id, title, sent_quality)
+
+    async def upload_media(self, update: Update, media_type: str, result: dict, **fields) -> Message:
+        """Отправка результата загрузки: файла с диска с замером скорости или file_id файла,
+        который узел-загрузчик уже отправил в Telegram"""
+        data = {'chat_id': str(update.message.chat_id)}
+        # Как reply_* в PTB: в группах отвечаем на исходное сообщение
+        if update.message.chat.type != Chat.PRIVATE:
+            data['reply_to_message_id'] = str(update.message.message_id)
+        for key, value in fields.items():
+            if value is not None:
+                data[key] = json.dumps(value) if isinstance(value, bool) else str(value)
+        
+        await self.journal.set_state_async(current_job.get(), 'uploading')
+        if result.get('file_id'):
+            data[media_type] = result['file_id']
+            message = await post_media(self.upload_client, self.application.bot.base_url, media_type, data)
+            logger.info(f"Файл узла-загрузчика отправлен в чат {update.message.chat_id} по file_id")
+            return Message.de_json(message, self.application.bot)
+        
+        file_path = result['file_path']
+        file_size = os.path.getsize(file_path)
+        started_at = time.monotonic()
+        try:
+            message = await post_media(self.upload_client, self.application.bot.base_url, media_type, data, file_path)
+        except Exception:
+            upload_stats['failed'] += 1
+            raise
+        
+        elapsed = time.monotonic() - started_at
+        speed = file_size / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+        upload_stats['uploads'] += 1
+        upload_stats['bytes'] += file_size
+        upload_stats['seconds'] += elapsed
+        upload_stats['last_speed'] = speed
+        logger.info(f"Файл {os.path.basename(file_path)} ({file_size / (1024 * 1024):.1f} MB) отправлен в чат {update.message.chat_id} за {elapsed:.1f} сек ({speed:.1f} MB/s)")
+        return Message.de_json(message, self.application.bot)
+
+    async def send_video_with_timeout(self, update: Update, result: dict, caption: str):
+        """Отправка видео с увеличенными таймаутами"""
+        return await self.upload_media(update, 'video', result, caption=caption, supports_streaming=True)
+
+    async def process_video_quality_download(self, update: Update, url: str, quality: str, user_id: int, username: str):
+        """Обработка загрузки видео с конкретным качеством"""
+        if await self.deliver_from_cache(update, url, 'video', quality, user_id, username):
+            return
+        
+        download_token = generate_download_token(user_id)
+        download_id = f"video_quality_{update.message.chat_id}_{update.message.message_id}"
+        status_message = await update.message.reply_text(f"Начинаю загрузку видео в {quality}p...", reply_markup=self.get_cancel_keyboard())
+        self.status_messages[current_job.get()] = status_message
+        
+        try:
+            with self.journal.directory() as temp_dir:
+                timeout = 600
+                info = await self.prefetch_metadata(url)
+                
+                result = await self.run_process_download(
+                    download_video_worker,
+                    download_id,
+                    url, quality,
+                    temp_dir=temp_dir,
+                    info=info,
+                    timeout=timeout,
+                    status_message=status_message,
+                    user_id=user_id
+                )
+                record_media_speed(result)
+                
+                if result.get('error') == 'timeout':
+                    log_error(user_id, username, 'download_timeout', f'Video {quality}p timeout', url)
+                    update_user_stats(user_id, username, 'video', False)
+                    add_to_history(user_id, url, 'Таймаут', 'video', quality, False)
+                    await status_message.edit_text("Время загрузки истекло... Попробуйте позже!")
+                    await update.message.reply_text(
+                        "Попробуй выбрать другое качество или другое видео...",
+                        reply_markup=self.get_main_keyboard()
+                    )
+                    return
+                
+                if result['success']:
+                    if not validate_download_token(download_token, user_id):
+                        await status_message.edit_text("Ошибка безопасности... Попробуйте снова!")
+                        return
+                    
+                    if result.get('quality_reduced', False):
+                        await status_message.edit_text("Отправляю видео (качество автоматически понижено)...")
+                        
+                        caption = f"✅ {result['title']} {result['reduced_quality']}"
+                        
+                        sent = await self.send_video_with_timeout(update, result, caption)
+                        self.remember_delivery(sent, url, 'video', quality, result['title'], result['reduced_quality'])
+                        
+                        await status_message.delete()
+                        update_user_stats(user_id, username, 'video', True)
+                        add_to_history(user_id, url, result['title'], 'video', result['reduced_quality'], True)
+                        await update.message.reply_text(
+                            f"Качество автоматически понижено с {result['original_quality']} до {result['reduced_quality']} для соответствия ограничению размера файла {MAX_FILE_SIZE}MB...",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                    else:
+                        await status_message.edit_text("Отправляю видео...")
+                        
+                        caption = f"✅ {result['title']} {quality}p"
+                        
+                        sent = await self.send_video_with_timeout(update, result, caption)
+                        self.remember_delivery(sent, url, 'video', quality, result['title'], f"{quality}p")
+                        
+                        await status_message.delete()
+                        update_user_stats(user_id, username, 'video', True)
+                        add_to_history(user_id, url, result['title'], 'video', quality, True)
+                        await update.message.reply_text(
+                            "Видео успешно отправлено!",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                else:
+                    if result.get('error') == 'file_too_big':
+                        log_error(user_id, username, 'file_too_big', f'Video {quality}p too big', url)
+                        update_user_stats(user_id, username, 'video', False)
+                        add_to_history(user_id, url, 'Файл слишком большой', 'video', quality, False)
+                        await status_message.edit_text(f"Файл в {quality}p превышает {MAX_FILE_SIZE}MB... Пробую понизить качество...")
+                        
+                        reduced_result = None
+                        # Сжатие скачанного исходника или повторная загрузка в качестве ниже - что быстрее
+                        if choose_size_reduction(info, quality, result) == 'transcode':
+                            await status_message.edit_text(f"Файл в {quality}p превышает {MAX_FILE_SIZE}MB... Сжимаю видео...")
+                            reduced_result = await self.run_process_download(
+                                transcode_video_worker,
+                                f"{download_id}_transcode",
+                                url, quality,
+                                temp_dir=temp_dir,
+                                info=info,
+                                resume_format=result.get('partial_format'),
+                                timeout=TRANSCODE_TIMEOUT,
+                                status_message=status_message,
+                                user_id=user_id
+                            )
+                            record_media_speed(reduced_result)
+                        
+                        if not reduced_result or not reduced_result['success']:
+                            reduced_result = await self.run_process_download(
+                                download_video_reduced_quality_worker,
+                                f"{download_id}_reduced",
+                                url, quality,
+                                temp_dir=temp_dir,
+                                info=info,
+                                timeout=600,
+                                status_message=status_message,
+                                user_id=user_id
+                            )
+                            record_media_speed(reduced_result)
+                        
+                        if reduced_result['success']:
+                            if not validate_download_token(download_token, user_id):
+                                await status_message.edit_text("Ошибка безопасности... Попробуйте снова!")
+                                return
+                                
+                            await status_message.edit_text("Отправляю видео (качество автоматически понижено)...")
+                            
+                            caption = f"✅ {reduced_result['title']} {reduced_result['reduced_quality']}"
+                            
+                            sent = await self.send_video_with_timeout(update, reduced_result, caption)
+                            self.remember_delivery(sent, url, 'video', quality, reduced_result['title'], reduced_result['reduced_quality'])
+                            
+                            await status_message.delete()
+                            update_user_stats(user_id, username, 'video', True)
+                            add_to_history(user_id, url, reduced_result['title'], 'video', reduced_result['reduced_quality'], True)
+                            if reduced_result.get('transcoded'):
+                                reduction_text = f"Видео {reduced_result['quality']} сжато для соответствия ограничению размера файла {MAX_FILE_SIZE}MB..."
+                            else:
+                                reduction_text = f"Качество автоматически понижено с {reduced_result['original_quality']} до {reduced_result['reduced_quality']} для соответствия ограничению размера файла {MAX_FILE_SIZE}MB..."
+                            await update.message.reply_text(
+                                reduction_text,
+                                reply_markup=self.get_main_keyboard()
+                            )
+                        else:
+                            log_error(user_id, username, 'no_suitable_quality', f'No suitable quality after reduction', url)
+                            update_user_stats(user_id, username, 'video', False)
+                            add_to_history(user_id, url, 'Нет подходящего качества', 'video', quality, False)
+                            await status_message.edit_text("Не удалось найти подходящее качество... Попробуй другое видео!")
+                            await update.message.reply_text(
+                                "Попробуй выбрать другое качество или другое видео...",
+                                reply_markup=self.get_main_keyboard()
+                            )
+                    else:
+                        log_error(user_id, username, 'video_download_error', str(result.get('error')), url)
+                        update_user_stats(user_id, username, 'video', False)
+                        add_to_history(user_id, url, 'Ошибка загрузки', 'video', quality, False)
+                        await status_message.edit_text("Произошла ошибка при загрузке видео...")
+                        await update.message.reply_text(
+                            "Попробуй выбрать другое качество или другое видео...",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                    
+        except Exception as e:
+            logger.error(f"Ошибка при обработке видео: {e}")
+            log_error(user_id, username, 'video_processing_error', str(e), url)
+            update_user_stats(user_id, username, 'video', False)
+            add_to_history(user_id, url, 'Ошибка обработки', 'video', quality, False)
+            await status_message.edit_text("Произошла ошибка при обработке видео...")
+            await update.message.reply_text(
+                "Попробуй еще раз или выбери другое качество...",
+                reply_markup=self.get_main_keyboard()
+            )
+
+    async def process_video_auto_download(self, update: Update, url: str, user_id: int, username: str):
+        """Обработка загрузки видео с автоматическим подбором качества"""
+        if await self.deliver_from_cache(update, url, 'video', None, user_id, username):
+            return
+        
+        download_token = generate_download_token(user_id)
+        download_id = f"video_auto_{update.message.chat_id}_{update.message.message_id}"
+        status_message = await update.message.reply_text("Начинаю загрузку видео (авто качество)...", reply_markup=self.get_cancel_keyboard())
+        self.status_messages[current_job.get()] = status_message
+        
+        try:
+            with self.journal.directory() as temp_dir:
+                info = await self.prefetch_metadata(url)
+                
+                result = await self.run_process_download(
+                    download_video_worker,
+                    download_id,
+                    url, None,
+                    temp_dir=temp_dir,
+                    info=info,
+                    timeout=600,
+                    status_message=status_message,
+                    user_id=user_id
+                )
+                record_media_speed(result)
+                
+                if result.get('error') == 'timeout':
+                    log_error(user_id, username, 'download_timeout', 'Auto quality timeout', url)
+                    update_user_stats(user_id, username, 'video', False)
+                    add_to_history(user_id, url, 'Таймаут', 'video', 'auto', False)
+                    await status_message.edit_text("Время загрузки истекло... Попробуй позже!")
+                    await update.message.reply_text(
+                        "Попробуй выбрать другое качество или другое видео...",
+                        reply_markup=self.get_main_keyboard()
+                    )
+                    return
+                
+                if result['success']:
+                    if not validate_download_token(download_token, user_id):
+                        await status_message.edit_text("Ошибка безопасности... Попробуйте снова!")
+                        return
+                        
+                    await status_message.edit_text("Отправляю видео...")
+                    
+                    try:
+                        caption = f"✅ {result['title']} {result['quality']}"
+                        
+                        sent = await self.send_video_with_timeout(update, result, caption)
+                        self.remember_delivery(sent, url, 'video', None, result['title'], result['quality'])
+                        
+                        await status_message.delete()
+                        update_user_stats(user_id, username, 'video', True)
+                        add_to_history(user_id, url, result['title'], 'video', result['quality'], True)
+                        await update.message.reply_text(
+                            f"Видео успешно отправлено в {result['quality']}!",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                    except asyncio.TimeoutError:
+                        log_error(user_id, username, 'send_timeout', 'Auto quality send timeout', url)
+                        update_user_stats(user_id, username, 'video', False)
+                        add_to_history(user_id, url, 'Таймаут отправки', 'video', 'auto', False)
+                        await status_message.edit_text("Время отправки истекло... Попробуй позже!")
+                        await update.message.reply_text(
+                            "Попробуй еще раз...",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                    except Exception as file_error:
+                        logger.error(f"Ошибка при отправке видео файла: {file_error}")
+                        log_error(user_id, username, 'video_send_error', str(file_error), url)
+                        update_user_stats(user_id, username, 'video', False)
+                        add_to_history(user_id, url, 'Ошибка отправки', 'video', 'auto', False)
+                        await status_message.edit_text("Ошибка при отправке видео...")
+                        await update.message.reply_text(
+                            "Попробуй еще раз...",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                else:
+                    if result.get('error') == 'no_suitable_quality':
+                        log_error(user_id, username, 'no_suitable_quality', 'No suitable quality found', url)
+                        update_user_stats(user_id, username, 'video', False)
+                        add_to_history(user_id, url, 'Нет подходящего качества', 'video', 'auto', False)
+                        await status_message.edit_text(f"Не удалось найти подходящее качество (все варианты превышают {MAX_FILE_SIZE}MB)...")
+                        await update.message.reply_text(
+                            "Попробуй другое видео...",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                    else:
+                        log_error(user_id, username, 'auto_video_download_error', str(result.get('error')), url)
+                        update_user_stats(user_id, username, 'video', False)
+                        add_to_history(user_id, url, 'Ошибка загрузки', 'video', 'auto', False)
+                        await status_message.edit_text("Произошла ошибка при загрузке видео...")
+                        await update.message.reply_text(
+                            "Попробуй выбрать другое качество или другое видео...",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                    
+        except Exception as e:
+            logger.error(f"Ошибка при обработке видео (авто): {e}")
+            log_error(user_id, username, 'auto_video_processing_error', str(e), url)
+            update_user_stats(user_id, username, 'video', False)
+            add_to_history(user_id, url, 'Ошибка обработки', 'video', 'auto', False)
+            await status_message.edit_text("Произошла ошибка при обработке видео...")
+            await update.message.reply_text(
+                "Попробуй еще раз или выбери другое качество...",
+                reply_markup=self.get_main_keyboard()
+            )
+
+    async def process_audio_download(self, update: Update, url: str, user_id: int, username: str):
+        """Обработка конвертации видео в аудио"""
+        if await self.deliver_from_cache(update, url, 'audio', None, user_id, username):
+            return
+        
+        download_token = generate_download_token(user_id)
+        download_id = f"audio_{update.message.chat_id}_{update.message.message_id}"
+        status_message = await update.message.reply_text("Начинаю конвертацию в аудио...", reply_markup=self.get_cancel_keyboard())
+        self.status_messages[current_job.get()] = status_message
+        
+        try:
+            with self.journal.directory() as temp_dir:
+                info = await self.prefetch_metadata(url)
+                
+                result = await self.run_process_download(
+                    download_audio_worker,
+                    download_id,
+                    url,
+                    temp_dir=temp_dir,
+                    info=info,
+                    timeout=600,
+                    status_message=status_message,
+                    user_id=user_id
+                )
+                
+                if result.get('error') == 'timeout':
+                    log_error(user_id, username, 'audio_timeout', 'Audio conversion timeout', url)
+                    update_user_stats(user_id, username, 'audio', False)
+                    add_to_history(user_id, url, 'Таймаут', 'audio', None, False)
+                    await status_message.edit_text("Время конвертации истекло... Попробуй позже!")
+                    await update.message.reply_text(
+                        "Попробуй другое видео...",
+                        reply_markup=self.get_main_keyboard()
+                    )
+                    return
+                
+                if result['success']:
+                    if not validate_download_token(download_token, user_id):
+                        await status_message.edit_text("Ошибка безопасности... Попробуйте снова!")
+                        return
+                        
+                    await status_message.edit_text("Отправляю аудио...")
+                    
+                    try:
+                        sent = await self.upload_media(
+                            update, 'audio', result,
+                            caption=f"🎵 {result['title']}",
+                            title=result['title'][:64],
+                            performer="YouTube"
+                        )
+                        self.remember_delivery(sent, url, 'audio', None, result['title'])
+                        
+                        await status_message.delete()
+                        update_user_stats(user_id, username, 'audio', True)
+                        add_to_history(user_id, url, result['title'], 'audio', None, True)
+                        await update.message.reply_text(
+                            "Аудио успешно отправлено!",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                    except Exception as file_error:
+                        logger.error(f"Ошибка при отправке аудио файла: {file_error}")
+                        log_error(user_id, username, 'audio_send_error', str(file_error), url)
+                        update_user_stats(user_id, username, 'audio', False)
+                        add_to_history(user_id, url, 'Ошибка отправки', 'audio', None, False)
+                        await status_message.edit_text("Ошибка при отправке аудио...")
+                        await update.message.reply_text(
+                            "Попробуй еще раз...",
+                            reply_markup=self.get_main_keyboard()
+                        )
+                else:
+                    if result.get('error') == 'audio_too_big':
+                        log_error(user_id, username, 'audio_too_big', 'Audio file too big', url)
+                        update_user_stats(user_id, username, 'audio', False)
+                        add_to_history(user_id, url, 'Файл слишком большой', 'audio', None, False)
+                        await status_message.edit_text("Аудио файл слишком большой...")
+                    else:
+                        log_error(user_id, username, 'audio_download_error', str(result.get('error')), url)
+                        update_user_stats(user_id, username, 'audio', False)
+                        add_to_history(user_id, url, 'Ошибка конвертации', 'audio', None, False)
+                        await status_message.edit_text("Произошла ошибка при конвертации аудио...")
+                    await update.message.reply_text(
+                        "Попробуй другое видео...",
+                        reply_markup=self.get_main_keyboard()
+                    )
+                    
+        except Exception as e:
+            logger.error(f"Ошибка при обработке аудио: {e}")
+            log_error(user_id, username, 'audio_processing_error', str(e), url)
+            update_user_stats(user_id, username, 'audio', False)
+            add_to_history(user_id, url, 'Ошибка обработки', 'audio', None, False)
+            await status_message.edit_text("Произошла ошибка при обработке аудио...")
+            await update.message.reply_text(
+                "Попробуй еще раз с другим видео...",
+                reply_markup=self.get_main_keyboard()
+            )
+
+    def run(self):
+        """Запуск бота"""
+        logger.info("Бот запущен!")
+        print("Бот запущен! Нажмите Ctrl+C для остановки...")
+        print(f"Админ-панель доступна для: {ADMIN_IDS}")
+        print(f"Загружено пользователей: {len(user_stats)}")
+        print(f"Премиум пользователей: {len(premium_users)}")
+        print(f"Заблокированных: {len(blocked_users)}")
+        print(f"Статус бота: {'ВКЛЮЧЕН' if bot_enabled else 'ВЫКЛЮЧЕН'}")
+        
+        if BOT_MODE == 'webhook':
+            if not WEBHOOK_URL:
+                print("Не задан WEBHOOK_URL... Проверьте файл config.py")
+                return
+            secret_token = WEBHOOK_SECRET_TOKEN
+            if not secret_token:
+                # Telegram получает токен при регистрации webhook - случайного достаточно для одного экземпляра
+                secret_token = secrets.token_urlsafe(32)
+                logger.warning("WEBHOOK_SECRET_TOKEN не задан, сгенерирован случайный токен")
+            print(f"Режим webhook: {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+            self.application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+if __name__ == "__main__":
+    if not BOT_TOKEN:
+        print("Токен бота не найден... Проверьте файл config.py")
+    elif sys.argv[1:2] == ['worker']:
+        run_worker_node()
+    else:
+        bot = YouTubeDownloaderBot(BOT_TOKEN)
         bot.run()
\ No newline at end of file
@@ -0,0 +1,127 @@
+#Проверка, что долгая загрузка одного пользователя не задерживает ответы другим
+import asyncio
+import datetime
+import multiprocessing
+import time
+import types
+
+import httpx
+from telegram import Chat, Message, Update
+
+import main
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=aaaaaaaaaaa'
+SLOW_WORKER_SECONDS = 3
+
+
+def slow_video_worker(url, quality, temp_dir, info=None):
+    """Медленный воркер вместо настоящей загрузки"""
+    time.sleep(SLOW_WORKER_SECONDS)
+    return {'success': False, 'error': 'no_video_info'}
+
+
+class StubBot:
+    """Заглушка Telegram Bot: ответы складываются в список"""
+    
+    base_url = "http://bot"
+    defaults = None
+    
+    def __init__(self):
+        self.replies = []
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        self.replies.append((chat_id, text))
+        message = Message(len(self.replies), datetime.datetime.now(), Chat(chat_id, Chat.PRIVATE), text=text)
+        message.set_bot(self)
+        return message
+    
+    def __getattr__(self, name):
+        async def ok(*args, **kwargs):
+            return True
+        return ok
+
+
+def make_update(bot, user_id: int, text: str) -> Update:
+    message = Message.de_json({
+        'message_id': user_id, 'date': int(time.time()), 'text': text,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'},
+    }, bot)
+    return Update(user_id, message=message)
+
+
+def make_bot(tmp_path, monkeypatch):
+    """Бот из настоящего конструктора во временном каталоге; Telegram заменен заглушкой"""
+    monkeypatch.chdir(tmp_path)
+    for name, value in {'WORKER_MODE': 'local', 'DOWNLOAD_POOL_SIZE': 2, 'MAX_CONCURRENT_DOWNLOADS': 2}.items():
+        monkeypatch.setattr(main, name, value)
+    # Глобальные данные бота загружаются из временного каталога и восстанавливаются после теста
+    for name in ('storage', 'blocked_users', 'user_stats', 'bot_enabled', 'premium_users', 'user_history',
+                 'download_tokens', 'delivery_cache'):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    bot = main.YouTubeDownloaderBot('123:TEST')
+    stub = StubBot()
+    bot.application = types.SimpleNamespace(bot=stub)
+    bot.upload_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+    return bot, stub
+
+
+def test_second_user_answered_while_slow_download_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'download_video_worker', slow_video_worker)
+    monkeypatch.setattr(main, 'get_video_metadata', lambda url: {'id': 'aaaaaaaaaaa', 'title': 'T'})
+    
+    async def scenario():
+        bot, stub = make_bot(tmp_path, monkeypatch)
+        await bot.download_pool.start()
+        try:
+            downloader = make_update(stub, 1001, VIDEO_URL)
+            download_context = types.SimpleNamespace(user_data={
+                'greeted': True, 'awaiting_url': True, 'download_type': 'video', 'quality': '360'
+            })
+            download = asyncio.create_task(bot.handle_message(downloader, download_context))
+            
+            # Ждем, пока медленный воркер возьмет задачу
+            for _ in range(100):
+                if main.active_processes:
+                    break
+                await asyncio.sleep(0.05)
+            assert main.active_processes
+            
+            started_at = time.monotonic()
+            other = make_update(stub, 1002, "Помощь")
+            await bot.handle_message(other, types.SimpleNamespace(user_data={'greeted': True}))
+            answered_in = time.monotonic() - started_at
+            
+            assert not download.done()
+            assert answered_in < 1
+            assert any(chat_id == 1002 for chat_id, _ in stub.replies)
+            
+            await download
+            assert stub.replies[-1][0] == 1001
+        finally:
+            await bot.download_pool.stop()
+            await bot.upload_client.aclose()
+            bot.journal.close()
+            main.storage.close()
+    
+    asyncio.run(scenario())
+
+
+def test_wait_for_ready_without_add_reader():
+    """Цикл событий без add_reader (Proactor в Windows): ожидание уходит в пул потоков"""
+    async def scenario():
+        loop = asyncio.get_running_loop()
+
+        def add_reader(fd, callback, *args):
+            raise NotImplementedError
+        loop.add_reader = add_reader
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        assert await main.wait_for_ready([receiver], 0.2) == []
+        loop.call_later(0.3, sender.send, 'done')
+        started_at = time.monotonic()
+        assert await main.wait_for_ready([receiver], 5) == [receiver]
+        assert time.monotonic() - started_at < 1
+        receiver.close()
+        sender.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,91 @@
+#Общая очередь задач узлов: каждая задача достается ровно одному узлу
+#PostgreSQL проверяется, если задан TEST_POSTGRES_DSN, например host=/tmp/pgdata dbname=postgres user=postgres
+import os
+import threading
+
+import pytest
+
+import main
+
+TASKS = 200
+NODES = 8
+
+
+def sqlite_queue(tmp_path):
+    return lambda: main.SqliteJobQueue(str(tmp_path / 'queue.db'))
+
+
+def postgres_queue(tmp_path):
+    dsn = os.getenv('TEST_POSTGRES_DSN')
+    if not dsn:
+        pytest.skip("TEST_POSTGRES_DSN не задан")
+    queue = main.PostgresJobQueue(dsn, 1, 2)
+    queue.execute("DELETE FROM worker_tasks")
+    queue.close()
+    return lambda: main.PostgresJobQueue(dsn, 1, 2)
+
+
+@pytest.fixture(params=[sqlite_queue, postgres_queue], ids=['sqlite', 'postgres'])
+def make_queue(request, tmp_path):
+    return request.param(tmp_path)
+
+
+def test_concurrent_claims_take_each_task_once(make_queue):
+    queue = make_queue()
+    for number in range(TASKS):
+        queue.push(f"task{number}", 'download_video_worker', [f"https://youtu.be/{number:011d}", '360'],
+                   {}, f"jobs/{number}", 'video', 600)
+
+    claimed = {}
+    errors = []
+
+    def node_loop(node: str):
+        node_queue = make_queue()
+        try:
+            while True:
+                task = node_queue.claim(node)
+                if task is None:
+                    break
+                claimed.setdefault(task['task_id'], []).append(node)
+                node_queue.finish(task['task_id'], node, {'success': True})
+        except Exception as e:
+            errors.append(e)
+        finally:
+            node_queue.close()
+
+    threads = [threading.Thread(target=node_loop, args=(f"node{number}",)) for number in range(NODES)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(claimed) == TASKS
+    assert all(len(nodes) == 1 for nodes in claimed.values())
+    assert len({nodes[0] for nodes in claimed.values()}) > 1
+    assert queue.get_metrics() == {'queued': 0, 'running': 0, 'nodes': 0}
+    queue.close()
+
+
+def test_task_round_trip(make_queue):
+    queue = make_queue()
+    queue.push('task', 'download_video_worker', ['https://youtu.be/aaaaaaaaaaa', '360'], {'resume_format': '18'},
+               'jobs/1_1', 'video', 600)
+    task = queue.claim('node')
+    assert task['args'] == ['https://youtu.be/aaaaaaaaaaa', '360']
+    assert task['kwargs'] == {'resume_format': '18'}
+    assert task['workdir'] == 'jobs/1_1'
+
+    # Выполняемая задача с тем же ID не перезапускается
+    queue.push('task', 'download_video_worker', [], {}, None, 'video', 600)
+    assert queue.status('task')[0] == 'running'
+    assert queue.heartbeat('task', 'node', {'stage': 'downloading'})
+
+    # Узел, не отмечавшийся дольше срока, теряет задачу, и ее забирает другой
+    assert queue.requeue_stale(-1, 3) == 1
+    assert not queue.heartbeat('task', 'node', {})
+    assert queue.claim('other')['attempts'] == 2
+    assert queue.finish('task', 'other', {'success': True, 'file_id': 'F'})
+    state, _, result = queue.status('task')
+    assert (state, result) == ('done', {'success': True, 'file_id': 'F'})
+    queue.close()
@@ -0,0 +1,22 @@
+#Лимит запросов в скользящем окне: проверка лимита и остаток запросов согласованы
+import main
+
+USER_ID = 42
+
+
+def test_can_make_request_matches_remaining(monkeypatch):
+    quota_store = main.QuotaStore(True)
+    quota_store.load({}, {})
+    monkeypatch.setattr(main, 'quota_store', quota_store)
+    monkeypatch.setattr(main, 'premium_users', {})
+    monkeypatch.setattr(main, 'save_user_requests', lambda *args: None)
+    limit = main.REQUEST_LIMITS['free']
+    # Вчерашние запросы учитываются долей, оставшейся от суток - почти всегда дробным числом
+    quota_store.prev_counts = {str(USER_ID): 1}
+    for _ in range(limit - 1):
+        quota_store.increment(USER_ID)
+
+    used = quota_store.used(USER_ID)
+    assert limit - 1 < used < limit
+    assert main.get_remaining_requests(USER_ID) == 0
+    assert not main.can_make_request(USER_ID)
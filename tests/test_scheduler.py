@@ -0,0 +1,72 @@
+#Симуляция очереди загрузок: премиум пользователь не ждет за потоком бесплатных задач
+import asyncio
+
+import main
+
+FREE_USERS = 10
+FREE_JOBS_PER_USER = 10
+PREMIUM_JOBS = 3
+SLOTS = 3
+
+
+async def run_job(scheduler, user_id, user_type, started):
+    """Задача загрузки: ждет слот, недолго работает и освобождает его"""
+    job = await scheduler.acquire(user_id=user_id, user_type=user_type)
+    started.append(user_id)
+    await asyncio.sleep(0.002)
+    scheduler.release(job)
+
+
+def test_premium_wait_bounded_under_free_flood():
+    async def scenario():
+        scheduler = main.DownloadScheduler(SLOTS, main.SCHEDULER_WEIGHTS, main.USER_MAX_ACTIVE_JOBS)
+        started = []
+        tasks = [asyncio.create_task(run_job(scheduler, user_id, 'free', started))
+                 for _ in range(FREE_JOBS_PER_USER) for user_id in range(FREE_USERS)]
+        # Один пользователь засыпает бота ссылками поверх остальных
+        tasks += [asyncio.create_task(run_job(scheduler, 'spammer', 'free', started)) for _ in range(50)]
+        await asyncio.sleep(0)
+        flood = scheduler.queued
+        assert flood > 100
+
+        started_before = len(started)
+        tasks += [asyncio.create_task(run_job(scheduler, 'premium', 'premium', started)) for _ in range(PREMIUM_JOBS)]
+        await asyncio.gather(*tasks)
+
+        premium_starts = [index - started_before for index, user_id in enumerate(started) if user_id == 'premium']
+        assert len(premium_starts) == PREMIUM_JOBS
+        # Впереди премиум задач - не больше одного круга пользователей, а не весь поток бесплатных задач
+        assert max(premium_starts) <= 2 * (FREE_USERS + 1) + PREMIUM_JOBS
+        assert max(premium_starts) < flood // 4
+        premium_wait = scheduler.wait_by_type['premium'][2]
+        free_wait = scheduler.wait_by_type['free'][2]
+        assert premium_wait < free_wait
+
+    asyncio.run(scenario())
+
+
+def test_positions_recounted_once_per_interval_under_flood(monkeypatch):
+    async def scenario():
+        scheduler = main.DownloadScheduler(1, main.SCHEDULER_WEIGHTS, main.USER_MAX_ACTIVE_JOBS)
+        recounts = []
+        expected_order = scheduler.expected_order
+        monkeypatch.setattr(scheduler, 'expected_order', lambda: recounts.append(1) or expected_order())
+        positions = {}
+
+        def on_position(job_number):
+            async def notify(position, wait):
+                positions[job_number] = position
+            return notify
+
+        waiters = [asyncio.create_task(scheduler.acquire(on_position(number), user_id=number))
+                   for number in range(2000)]
+        await asyncio.sleep(0.05)
+        # Каждая новая задача узнала позицию, а очередь пересчитана один раз, а не на каждую задачу
+        assert len(recounts) == 1
+        assert len(positions) == 1999
+        assert sorted(positions.values()) == list(range(1, 2000))
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    asyncio.run(scenario())
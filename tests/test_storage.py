@@ -0,0 +1,114 @@
+#Общая SQL база нескольких процессов бота: счетчики складываются, история не теряется, блокировки видны всем
+#PostgreSQL проверяется, если задан TEST_POSTGRES_DSN, например host=/tmp/pgdata dbname=postgres user=postgres
+import os
+
+import pytest
+
+import main
+
+USER_ID = 42
+TABLES = ['users', 'history', 'daily_quotas', 'quota_archive', 'blocked_users', 'premium']
+
+
+def sqlite_storage(tmp_path):
+    return lambda: main.SqliteStorage(str(tmp_path / 'bot.db'))
+
+
+def postgres_storage(tmp_path):
+    dsn = os.getenv('TEST_POSTGRES_DSN')
+    if not dsn:
+        pytest.skip("TEST_POSTGRES_DSN не задан")
+    storage = main.PostgresStorage(dsn, 1, 2)
+    with storage.transaction() as cur:
+        for table in TABLES:
+            cur.execute(f"DELETE FROM {table}")
+    storage.close()
+    return lambda: main.PostgresStorage(dsn, 1, 2)
+
+
+@pytest.fixture(params=[sqlite_storage, postgres_storage], ids=['sqlite', 'postgres'])
+def make_storage(request, tmp_path):
+    return request.param(tmp_path)
+
+
+def start_process(monkeypatch, storage):
+    """Состояние отдельного процесса бота: свои данные в памяти и свое подключение к общей базе"""
+    monkeypatch.setattr(main, 'storage', storage)
+    for name, value in {'blocked_users': set(), 'premium_users': {}, 'user_stats': {}, 'user_history': {},
+                        'dirty_stores': {}, 'store_deltas': {}, 'flushing_changes': []}.items():
+        monkeypatch.setattr(main, name, value)
+    quota_store = main.QuotaStore(False)
+    quota_store.load({}, {})
+    monkeypatch.setattr(main, 'quota_store', quota_store)
+
+
+def make_requests(count: int, tag: str):
+    for number in range(count):
+        main.increment_request_count(USER_ID)
+        main.update_user_stats(USER_ID, 'user', 'video')
+        main.add_to_history(USER_ID, f"https://youtu.be/{tag}{number:010d}", f"{tag}{number}", 'video', '360')
+
+
+def test_processes_share_counters_history_and_blocks(make_storage, monkeypatch):
+    first, second = make_storage(), make_storage()
+    start_process(monkeypatch, first)
+    make_requests(3, 'a')
+    main.flush_data()
+
+    # Второй процесс не видел записей первого - его запись прибавляется, а не заменяет их
+    start_process(monkeypatch, second)
+    make_requests(2, 'b')
+    main.blocked_users.add(USER_ID)
+    main.save_blocked_users(USER_ID)
+    main.flush_data()
+
+    day = main.quota_store.day
+    data = second.load()
+    assert data['user_requests'][day][str(USER_ID)] == 5
+    stats = data['user_stats'][USER_ID]
+    assert (stats['total_requests'], stats['video_downloads'], stats['successful_requests']) == (5, 5, 5)
+    assert [entry['title'] for entry in data['user_history'][USER_ID]] == ['a0', 'a1', 'a2', 'b0', 'b1']
+
+    # Первый процесс узнает о блокировке и чужих запросах при следующем обновлении пользователя
+    start_process(monkeypatch, first)
+    main.increment_request_count(USER_ID)
+    main.apply_user_state(USER_ID, first.load_user(USER_ID, [day]))
+    assert USER_ID in main.blocked_users
+    assert main.quota_store.used(USER_ID) == 6
+    main.flush_data()
+    assert first.load_user(USER_ID, [day])['requests'] == {day: 6}
+    first.close()
+    second.close()
+
+
+def test_history_trimmed_in_database(make_storage, monkeypatch):
+    storages = [make_storage(), make_storage()]
+    for tag, storage in zip('ab', storages):
+        start_process(monkeypatch, storage)
+        make_requests(main.MAX_HISTORY_ENTRIES - 10, tag)
+        main.flush_data()
+
+    history = storages[0].load()['user_history'][USER_ID]
+    assert len(history) == main.MAX_HISTORY_ENTRIES
+    assert history[-1]['title'] == f"b{main.MAX_HISTORY_ENTRIES - 11}"
+    for storage in storages:
+        storage.close()
+
+
+def test_failed_write_keeps_increments(make_storage, monkeypatch):
+    storage = make_storage()
+    start_process(monkeypatch, storage)
+    make_requests(2, 'a')
+    write = storage.write
+    storage.write = lambda changes: list(changes)
+    main.flush_data()
+
+    # Незаписанные приращения возвращаются и попадают в базу один раз
+    storage.write = write
+    make_requests(1, 'b')
+    main.flush_data()
+    data = storage.load()
+    assert data['user_requests'][main.quota_store.day][str(USER_ID)] == 3
+    assert data['user_stats'][USER_ID]['total_requests'] == 3
+    assert len(data['user_history'][USER_ID]) == 3
+    storage.close()
@@ -0,0 +1,75 @@
+#Отправка файлов своему серверу Bot API в локальном режиме: путь file:// вместо байтов файла
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs
+
+import httpx
+from telegram import Message, Update
+
+import main
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_bot(tmp_path, monkeypatch):
+    """Бот из настоящего конструктора во временном каталоге"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'WORKER_MODE', 'local')
+    # Глобальные данные бота загружаются из временного каталога и восстанавливаются после теста
+    for name in ('storage', 'blocked_users', 'user_stats', 'bot_enabled', 'premium_users', 'user_history',
+                 'download_tokens', 'delivery_cache'):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    return main.YouTubeDownloaderBot('123:TEST')
+
+
+def test_local_mode_uploads_file_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'BOT_API_LOCAL_MODE', True)
+    bot = make_bot(tmp_path, monkeypatch)
+    media_file = tmp_path / 'video.mp4'
+    media_file.write_bytes(b'\0' * 1024)
+    requests = []
+
+    def handle(request):
+        requests.append(request)
+        message = {'message_id': 2, 'date': int(time.time()), 'chat': {'id': 7, 'type': 'private'}}
+        return httpx.Response(200, json={'ok': True, 'result': message})
+
+    async def scenario():
+        bot.upload_client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+        update = Update(1, message=Message.de_json({
+            'message_id': 1, 'date': int(time.time()), 'text': 'x', 'chat': {'id': 7, 'type': 'private'},
+        }, bot.application.bot))
+        try:
+            return await bot.upload_media(update, 'video', {'file_path': str(media_file)}, caption='T')
+        finally:
+            await bot.upload_client.aclose()
+
+    try:
+        message = asyncio.run(scenario())
+    finally:
+        bot.journal.close()
+        main.storage.close()
+
+    assert message.message_id == 2
+    request, = requests
+    assert request.url.path.endswith('/sendVideo')
+    # Обычная форма без multipart: сервер Bot API читает файл с диска сам
+    assert request.headers['content-type'] == 'application/x-www-form-urlencoded'
+    form = parse_qs(request.content.decode())
+    assert form['video'] == [media_file.absolute().as_uri()]
+    assert form['caption'] == ['T']
+    assert len(request.content) < 1024
+
+
+def test_local_mode_raises_file_size_limit():
+    limits = {}
+    for local_mode in ('false', 'true'):
+        env = dict(os.environ, BOT_API_LOCAL_MODE=local_mode)
+        output = subprocess.run([sys.executable, '-c', 'import json, main; print(json.dumps(main.MAX_FILE_SIZE))'],
+                                cwd=REPO_DIR, env=env, capture_output=True, text=True, timeout=60, check=True).stdout
+        limits[local_mode] = json.loads(output.strip().splitlines()[-1])
+    assert limits == {'false': 50, 'true': main.LOCAL_MODE_MAX_FILE_SIZE}
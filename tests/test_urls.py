@@ -0,0 +1,19 @@
+#Канонические ссылки и ключи видео
+import main
+
+PRIVATE_ID = '0123456789abcdef0123456789abcdef'
+
+
+def test_rutube_private_link_keeps_access_key():
+    url = f'https://rutube.ru/video/private/{PRIVATE_ID}/?p=AbC-12_x&utm_source=share'
+    assert main.canonical_url(url) == f'https://rutube.ru/video/private/{PRIVATE_ID}/?p=AbC-12_x'
+    assert main.get_video_key(url) == main.get_video_key(main.canonical_url(url))
+    # Разные ключи доступа - разные записи кеша
+    assert main.get_video_key(url) != main.get_video_key(f'https://rutube.ru/video/private/{PRIVATE_ID}/?p=other')
+    assert main.get_video_key(url) != main.get_video_key(f'https://rutube.ru/video/{PRIVATE_ID}/')
+
+
+def test_rutube_public_link_unchanged():
+    url = f'https://rutube.ru/video/{PRIVATE_ID}/?r=wd'
+    assert main.canonical_url(url) == f'https://rutube.ru/video/{PRIVATE_ID}/'
+    assert main.get_video_key(url) == f'rutube:{PRIVATE_ID}'
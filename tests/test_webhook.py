@@ -0,0 +1,126 @@
+#Режим webhook: синтетические обновления на встроенный HTTP сервер и замер задержки до ответа обработчика
+import asyncio
+import json
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+from telegram.request import BaseRequest
+
+import main
+
+SECRET_TOKEN = 'test-secret'
+UPDATES = 50
+WAIT_TIMEOUT = 10  # Предел ожидания сервера, ответов и остановки бота в секундах
+
+
+class FakeTelegramApi(BaseRequest):
+    """Bot API без сети: отвечает на запросы бота и запоминает время ответов пользователям"""
+
+    def __init__(self, **kwargs):
+        self.loop = None
+        self.replied_at = {}  # ID чата -> время ответа обработчика
+
+    async def initialize(self):
+        self.loop = asyncio.get_running_loop()
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if api_method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'test_bot'}
+        elif api_method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            self.replied_at.setdefault(chat_id, time.monotonic())
+            result = {'message_id': 1, 'date': int(time.time()), 'text': params.get('text', ''),
+                      'chat': {'id': chat_id, 'type': 'private'}}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_update(update_id: int) -> dict:
+    chat_id = 5000 + update_id
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': '/help',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}],
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'user'},
+        }
+    }
+
+
+def test_webhook_updates_reach_handlers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    port = free_port()
+    for name, value in {'BOT_MODE': 'webhook', 'WEBHOOK_URL': 'https://bot.example.com', 'WEBHOOK_LISTEN': '127.0.0.1',
+                        'WEBHOOK_PORT': port, 'WEBHOOK_SECRET_TOKEN': SECRET_TOKEN, 'DOWNLOAD_POOL_SIZE': 1}.items():
+        monkeypatch.setattr(main, name, value)
+    # Глобальные данные бота загружаются из временного каталога и восстанавливаются после теста
+    for name in ('storage', 'blocked_users', 'user_stats', 'bot_enabled', 'premium_users', 'user_history',
+                 'download_tokens', 'delivery_cache'):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    api = FakeTelegramApi()
+    monkeypatch.setattr(main, 'HTTPXRequest', lambda **kwargs: api)
+
+    bot = main.YouTubeDownloaderBot('123:TEST')
+    url = f"http://127.0.0.1:{port}/{main.WEBHOOK_PATH}"
+    sent_at = {}
+    outcome = {}
+
+    def post_updates():
+        try:
+            with httpx.Client(timeout=5) as client:
+                # Сервер готов, когда отклоняет запрос с чужим токеном
+                for _ in range(int(WAIT_TIMEOUT / 0.05)):
+                    try:
+                        response = client.post(url, json=make_update(0), headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+                        outcome['rejected'] = response.status_code
+                        break
+                    except httpx.TransportError:
+                        time.sleep(0.05)
+                for update_id in range(1, UPDATES + 1):
+                    sent_at[5000 + update_id] = time.monotonic()
+                    response = client.post(url, json=make_update(update_id), headers={'X-Telegram-Bot-Api-Secret-Token': SECRET_TOKEN})
+                    response.raise_for_status()
+                deadline = time.monotonic() + WAIT_TIMEOUT
+                while len(api.replied_at) < UPDATES and time.monotonic() < deadline:
+                    time.sleep(0.05)
+        finally:
+            # Цикл событий появляется при инициализации бота - если до нее не дошло, останавливать нечего
+            deadline = time.monotonic() + WAIT_TIMEOUT
+            while api.loop is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if api.loop is not None:
+                api.loop.call_soon_threadsafe(bot.application.stop_running)
+
+    poster = threading.Thread(target=post_updates, daemon=True)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    try:
+        poster.start()
+        bot.run()
+    finally:
+        asyncio.set_event_loop(None)
+        poster.join(timeout=WAIT_TIMEOUT)
+    assert not poster.is_alive()
+
+    assert outcome.get('rejected') == 403
+    assert 5000 not in api.replied_at
+    latencies = sorted(api.replied_at[chat_id] - sent_at[chat_id] for chat_id in sent_at if chat_id in api.replied_at)
+    assert len(latencies) == UPDATES
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    assert p95 < 1, (f"webhook: {UPDATES} обновлений, задержка до ответа p50 {statistics.median(latencies) * 1000:.1f} мс, "
+                     f"p95 {p95 * 1000:.1f} мс")